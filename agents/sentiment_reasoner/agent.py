@@ -49,7 +49,7 @@ agent = Agent(
 # -----------------------------------------------------------------------------
 # Coin universe
 # -----------------------------------------------------------------------------
-COINS = ["USDC", "USDT", "DAI", "FDUSD", "BUSD", "TUSD", "USDP", "PYUSD", "USDD", "GUSD"]
+from coins import COINS  # shared registry (backend/rebalance_api/app/data/coins.json)
 
 # -----------------------------------------------------------------------------
 # Helpers
@@ -173,7 +173,7 @@ def _fallback_reason(peg_json: str, liq_quote: Optional[float], sentiment_json:
 @agent.on_event("startup")
 async def on_start(ctx: Context):
     ctx.logger.info(f"[{AGENT_NAME}] started. Mailbox={USE_MAILBOX}. MeTTa={'ON' if _METTA_OK else 'OFF'}")
-    ctx.logger.info(f"[{AGENT_NAME}] 10-coin reasoner online. Coins: {', '.join(COINS)}")
+    ctx.logger.info(f"[{AGENT_NAME}] {len(COINS)}-coin reasoner online. Coins: {', '.join(COINS)}")
 
 @agent.on_message(model=ReasonRequest, replies=ReasonResponse)
 async def on_reason(ctx: Context, sender: str, msg: ReasonRequest):
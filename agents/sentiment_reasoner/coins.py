@@ -0,0 +1,24 @@
+# coins.py
+"""
+Coin universe for the reasoner, read from the shared registry
+(backend/rebalance_api/app/data/coins.json, or COINS_REGISTRY_PATH).
+Falls back to the original 10 coins if the file isn't deployed next to the agent.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Tuple
+
+_DEFAULT_PATH = Path(__file__).resolve().parents[2] / "backend" / "rebalance_api" / "app" / "data" / "coins.json"
+_BUILTIN = ("USDC", "USDT", "DAI", "FDUSD", "BUSD", "TUSD", "USDP", "PYUSD", "USDD", "GUSD")
+
+
+def load_coins() -> Tuple[str, ...]:
+    try:
+        data = json.loads(Path(os.getenv("COINS_REGISTRY_PATH", str(_DEFAULT_PATH))).read_text())
+        return tuple(str(c["symbol"]).upper() for c in data["coins"]) or _BUILTIN
+    except Exception:
+        return _BUILTIN
+
+
+COINS: Tuple[str, ...] = load_coins()
@@ -2,11 +2,8 @@
 from typing import Optional, Dict, Tuple, List
 from hyperon import MeTTa, E, S, ValueAtom
 
-# -------- 10-coin universe (shared by all agents) --------
-COINS: Tuple[str, ...] = (
-    "USDC", "USDT", "DAI", "FDUSD", "BUSD",
-    "TUSD", "USDP", "PYUSD", "USDD", "GUSD"
-)
+# -------- coin universe (shared registry, see coins.py) --------
+from coins import COINS
 
 def coins() -> Tuple[str, ...]:
     """Expose the coin universe to callers that don't import from other files."""
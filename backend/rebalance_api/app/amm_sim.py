@@ -0,0 +1,405 @@
+# amm_sim.py
+"""
+Offline execution simulator for swap plans: what a plan would actually yield before we sign it.
+- Pools are local models, reserves in human units (stables ≈ $1):
+  "stableswap" = Curve 2-coin invariant with amplification `amp`, fee taken from the output;
+  "constant_product" = x*y=k (Uniswap v2 style, or v3 as virtual reserves), fee taken from the input.
+- Legs run in plan order (sells_to_base, direct_swaps, buys_from_base) and move the pool
+  reserves, so two legs through the same pool see each other's impact.
+- simulate_plans() / simulate_batch() score many plans at once: one NumPy pass per pool,
+  not per plan. Every plan starts from the same pool state (candidates, not a sequence).
+- Per leg: realized output, fee, price impact vs the pool's spot price (bps, after the fee)
+  and whether it lands under the leg's min_receive (the swap would revert).
+  Per plan: balance changes, end balances, value lost and any base deficit.
+
+Example:
+pools = PoolSet.load()
+sim = simulate_plans([plan], pools, balances=[balances])
+print(sim.to_dict(0))
+"""
+
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+try:
+    from app.swapPlanner import LiquidityModel, SwapPlan, SwapPlanBatch, round2
+except Exception:
+    from swapPlanner import LiquidityModel, SwapPlan, SwapPlanBatch, round2  # fallback for local runs
+
+POOLS_PATH = Path(os.getenv("AMM_POOLS_PATH", str(Path(__file__).resolve().parent / "data" / "amm_pools.json")))
+POOL_KINDS = ("stableswap", "constant_product")
+_PHASES = ("sells_to_base", "direct_swaps", "buys_from_base")
+
+
+# ─────────────────────────────────────────────────────────────
+# Pool math (vectorized over plans)
+# ─────────────────────────────────────────────────────────────
+def _stable_D(x, y, ann):
+    # Curve get_D for n=2: Newton on A n^n S + D = A n^n D + D^3 / (4xy)
+    s = x + y
+    d = s.copy()
+    for _ in range(255):
+        dp = d ** 3 / (4 * x * y)
+        prev = d
+        d = (ann * s + 2 * dp) * d / ((ann - 1) * d + 3 * dp)
+        if np.all(np.abs(d - prev) <= 1e-12 * np.maximum(d, 1.0)):
+            break
+    return d
+
+
+def _stable_y(x_new, d, ann):
+    # Curve get_y: the other reserve that keeps D after x moves to x_new
+    c = d ** 3 / (4 * x_new * ann)
+    b = x_new + d / ann
+    y = d.copy()
+    for _ in range(255):
+        prev = y
+        y = (y * y + c) / (2 * y + b - d)
+        if np.all(np.abs(y - prev) <= 1e-12 * np.maximum(y, 1.0)):
+            break
+    return y
+
+
+@dataclass
+class Pool:
+    kind: str                  # "stableswap" | "constant_product"
+    reserves: Tuple[float, float]   # (first, second) coin of the pair key, human units
+    amp: float = 100.0         # stableswap only
+    fee_bps: float = 4.0
+    venue: str = "pool"
+
+    def __post_init__(self):
+        if self.kind not in POOL_KINDS:
+            raise ValueError(f"unknown pool kind: {self.kind!r} (expected one of {POOL_KINDS})")
+        if min(self.reserves) <= 0:
+            raise ValueError(f"pool {self.venue}: reserves must be > 0, got {self.reserves}")
+
+    def spot(self, x, y):
+        """Marginal output per unit input (fee excluded) at reserves (x in, y out)."""
+        if self.kind == "constant_product":
+            return y / x
+        ann = self.amp * 4
+        d = _stable_D(x, y, ann)
+        return (ann + d ** 3 / (4 * x * x * y)) / (ann + d ** 3 / (4 * x * y * y))
+
+    def swap(self, x, y, dx):
+        """
+        Sell dx into reserves (x in, y out), all (N,) arrays.
+        Returns (out, fee_usd, spot, new_x, new_y).
+        """
+        f = self.fee_bps / 1e4
+        spot = self.spot(x, y)
+        if self.kind == "constant_product":
+            dx_net = dx * (1 - f)
+            out = y * dx_net / (x + dx_net)
+            fee = dx * f
+        else:
+            ann = self.amp * 4
+            gross = y - _stable_y(x + dx, _stable_D(x, y, ann), ann)
+            gross = np.clip(gross, 0.0, None)
+            out = gross * (1 - f)
+            fee = gross * f
+        return out, fee, spot, x + dx, y - out
+
+
+class PoolSet:
+    """
+    Pools per pair (first listed = default for legs without a venue); the reverse pair is used
+    if only it is given, like CostModel / LiquidityModel. Pairs without pools use `default`
+    (one fresh copy per pair) or raise.
+    """
+
+    def __init__(self, pairs: Optional[Dict[Tuple[str, str], List[Pool]]] = None, default: Optional[Pool] = None):
+        self.pairs = pairs or {}
+        self.default = default
+
+    def resolve(self, src: str, dst: str, venue: Optional[str] = None) -> Tuple[Tuple[str, str, str], Pool, bool]:
+        """(state key, pool, reversed) for a src->dst leg; reversed means src is the pool's second coin."""
+        for key, rev in (((src, dst), False), ((dst, src), True)):
+            pools = self.pairs.get(key)
+            if pools:
+                pool = next((p for p in pools if p.venue == venue), pools[0])
+                return (key[0], key[1], pool.venue), pool, rev
+        if self.default is not None:
+            return (src, dst, self.default.venue), self.default, False
+        raise ValueError(f"no pool for {src}/{dst}; add it to the pool set or configure a default")
+
+    @staticmethod
+    def _pool(d: Mapping[str, Any], venue: str) -> Pool:
+        return Pool(
+            kind=d.get("kind", "stableswap"),
+            reserves=tuple(float(r) for r in d["reserves"]),
+            amp=float(d.get("amp", 100.0)),
+            fee_bps=float(d.get("fee_bps", 4.0)),
+            venue=d.get("venue", venue),
+        )
+
+    @classmethod
+    def from_dict(cls, d: Mapping[str, Any]) -> "PoolSet":
+        """
+        {"default": {"kind": "stableswap", "reserves": [1e7, 1e7], "amp": 200, "fee_bps": 4},
+         "pairs": {"USDT/USDC": [{"venue": "curve-3pool", "kind": "stableswap",
+                                  "reserves": [6e7, 6e7], "amp": 2000, "fee_bps": 1}, ...]}}
+        Venue names match liquidity_curves.json so split legs land on their own pool.
+        """
+        pairs: Dict[Tuple[str, str], List[Pool]] = {}
+        for key, pools in (d.get("pairs") or {}).items():
+            src, dst = key.upper().split("/")
+            pairs[(src, dst)] = [cls._pool(p, f"pool{i}") for i, p in enumerate(pools)]
+        default = cls._pool(d["default"], "default") if d.get("default") else None
+        return cls(pairs, default)
+
+    @classmethod
+    def load(cls, path: Path = POOLS_PATH) -> "PoolSet":
+        return cls.from_dict(json.loads(Path(path).read_text()))
+
+    @classmethod
+    def from_liquidity(cls, model: LiquidityModel) -> "PoolSet":
+        """
+        Constant-product pools with the planner's venue depths, to check a plan against the model
+        it was built with (within a few bps of expected_receive: the planner takes fees from the output).
+        """
+        pairs = {
+            key: [Pool("constant_product", (v.depth, v.depth), fee_bps=v.fee_bps, venue=v.name) for v in venues]
+            for key, venues in model.pairs.items() if venues
+        }
+        default = None
+        if model.default_depth:
+            default = Pool("constant_product", (model.default_depth, model.default_depth),
+                           fee_bps=model.default_fee_bps, venue="default")
+        return cls(pairs, default)
+
+
+# ─────────────────────────────────────────────────────────────
+# Simulation
+# ─────────────────────────────────────────────────────────────
+LegKey = Tuple[int, str, str, Optional[str]]   # (phase, src, dst, venue)
+
+
+class SimBatch:
+    """
+    Result of simulate_plans() / simulate_batch(). Arrays are (N, K) over the union of leg
+    keys in execution order (0 where a plan has no such leg) or (N, C) over `coins`.
+    """
+
+    def __init__(self, keys: List[LegKey], coins: List[str], bases: List[str], **arrays):
+        self.keys = keys
+        self.coins = coins
+        self.bases = bases                             # per plan
+        self.amount = arrays["amount"]                 # (N, K) sold
+        self.out = arrays["out"]                       # (N, K) realized receive
+        self.fee = arrays["fee"]                       # (N, K) USD
+        self.impact_bps = arrays["impact_bps"]         # (N, K) vs spot, after the fee
+        self.expected = arrays["expected"]             # (N, K) planner's expected_receive (nan if none)
+        self.min_receive = arrays["min_receive"]       # (N, K) nan if none
+        self.start = arrays["start"]                   # (N, C) nan where unknown
+        self.change = arrays["change"]                 # (N, C)
+
+    def __len__(self) -> int:
+        return int(self.amount.shape[0])
+
+    @property
+    def end(self):
+        return self.start + self.change
+
+    @property
+    def value_lost(self):
+        """(N,) USD given up to fees and impact across all legs (stables ≈ $1)."""
+        return self.amount.sum(axis=1) - self.out.sum(axis=1)
+
+    @property
+    def below_min(self):
+        """(N, K) legs whose realized output is under min_receive (the swap would revert)."""
+        with np.errstate(invalid="ignore"):
+            return (self.amount > 0) & (self.out < self.min_receive - 1e-9)
+
+    @property
+    def base_deficit(self):
+        """(N,) base the buys spend beyond what the wallet and the realized sells provide."""
+        idx = [self.coins.index(b) for b in self.bases]
+        end = self.end[np.arange(len(self)), idx]
+        return np.clip(-np.nan_to_num(end, nan=0.0), 0.0, None)
+
+    def to_dict(self, i: int) -> Dict[str, Any]:
+        legs = []
+        below = self.below_min[i]
+        for k in np.flatnonzero(self.amount[i] > 0):
+            phase, src, dst, venue = self.keys[k]
+            exp = self.expected[i, k]
+            legs.append({
+                "phase": _PHASES[phase],
+                "src": src,
+                "dst": dst,
+                "venue": venue,
+                "amount": round2(self.amount[i, k]),
+                "out": round(float(self.out[i, k]), 6),
+                "fee": round(float(self.fee[i, k]), 6),
+                "impact_bps": round(float(self.impact_bps[i, k]), 2),
+                "expected_receive": None if np.isnan(exp) else float(exp),
+                "below_min_receive": bool(below[k]),
+            })
+        known = ~np.isnan(self.start[i])
+        changed = np.abs(self.change[i]) > 1e-9
+        warnings = []
+        if below.any():
+            warnings.append(f"{int(below.sum())} leg(s) would receive less than min_receive and revert.")
+        if self.base_deficit[i] > 1e-6:
+            warnings.append(
+                f"Buys need {self.base_deficit[i]:.2f} {self.bases[i]} more than the wallet and realized sells provide."
+            )
+        return {
+            "base": self.bases[i],
+            "legs": legs,
+            "value_lost": round(float(self.value_lost[i]), 6),
+            "fees": round(float(self.fee[i].sum()), 6),
+            "balance_changes": {c: round(float(self.change[i, j]), 6) for j, c in enumerate(self.coins) if changed[j]},
+            "end_balances": {c: round(float(self.end[i, j]), 6) for j, c in enumerate(self.coins) if known[j]},
+            "base_deficit": round(float(self.base_deficit[i]), 6),
+            "warnings": warnings,
+        }
+
+
+def _execute(
+    keys: List[LegKey], amount, pools: PoolSet, coins: List[str], bases: List[str], start,
+    expected=None, min_receive=None,
+) -> SimBatch:
+    N, K = amount.shape
+    col = {c: j for j, c in enumerate(coins)}
+    out = np.zeros((N, K))
+    fee = np.zeros((N, K))
+    impact = np.zeros((N, K))
+    change = np.zeros((N, len(coins)))
+    state: Dict[Tuple[str, str, str], Tuple[Any, Any]] = {}   # pool -> (first, second) reserves per plan
+    for k, (_, src, dst, venue) in enumerate(keys):
+        dx = amount[:, k]
+        hit = dx > 0
+        if not hit.any():
+            continue
+        skey, pool, rev = pools.resolve(src, dst, venue)
+        if skey not in state:
+            state[skey] = (np.full(N, pool.reserves[0]), np.full(N, pool.reserves[1]))
+        a, b = state[skey]
+        x, y = (b, a) if rev else (a, b)
+        o, f, spot, nx, ny = pool.swap(x[hit], y[hit], dx[hit])
+        out[hit, k], fee[hit, k] = o, f
+        impact[hit, k] = 1e4 * (1 - o / (dx[hit] * spot * (1 - pool.fee_bps / 1e4)))
+        x, y = x.copy(), y.copy()
+        x[hit], y[hit] = nx, ny
+        state[skey] = (y, x) if rev else (x, y)
+        change[:, col[src]] -= dx
+        change[:, col[dst]] += out[:, k]
+    nan = np.full((N, K), np.nan)
+    return SimBatch(
+        keys, coins, bases,
+        amount=amount, out=out, fee=fee, impact_bps=impact,
+        expected=nan if expected is None else expected,
+        min_receive=nan.copy() if min_receive is None else min_receive,
+        start=start, change=change,
+    )
+
+
+def simulate_plans(
+    plans: Sequence[SwapPlan],
+    pools: PoolSet,
+    balances: Optional[Sequence[Mapping[str, float]]] = None,
+) -> SimBatch:
+    """
+    Execute each plan's legs in order against `pools`. Plans may differ in base, mode and
+    venue splits. balances (one dict per plan) enable end_balances; without them only the
+    base start (from the plan's base_funding) is known, which is enough for base_deficit.
+    """
+    if np is None:
+        raise ImportError("simulate_plans requires numpy")
+    order: Dict[LegKey, int] = {}
+    for plan in plans:
+        for phase, name in enumerate(_PHASES):
+            for leg in getattr(plan, name):
+                order.setdefault((phase, leg.src, leg.dst, leg.venue), len(order))
+    # phase-major so every plan's sells land before its buys; pools within a phase don't interact
+    keys = sorted(order, key=lambda key: (key[0], order[key]))
+    kidx = {key: k for k, key in enumerate(keys)}
+    coins = sorted({c for key in keys for c in key[1:3]} | {p.base for p in plans}
+                   | {c for bal in (balances or []) for c in bal})
+    cidx = {c: j for j, c in enumerate(coins)}
+
+    N, K = len(plans), len(keys)
+    amount = np.zeros((N, K))
+    expected = np.full((N, K), np.nan)
+    min_receive = np.full((N, K), np.nan)
+    start = np.full((N, len(coins)), np.nan)
+    for i, plan in enumerate(plans):
+        for phase, name in enumerate(_PHASES):
+            for leg in getattr(plan, name):
+                k = kidx[(phase, leg.src, leg.dst, leg.venue)]
+                amount[i, k] += leg.amount
+                if leg.expected_receive is not None:
+                    expected[i, k] = np.nan_to_num(expected[i, k]) + leg.expected_receive
+                if leg.min_receive is not None:
+                    min_receive[i, k] = np.nan_to_num(min_receive[i, k]) + leg.min_receive
+        if balances is not None:
+            for c, v in balances[i].items():
+                start[i, cidx[c]] = v
+        if np.isnan(start[i, cidx[plan.base]]):
+            funding = plan.base_funding
+            start[i, cidx[plan.base]] = funding.get("base_balance_start", 0.0) + funding.get("wallet_base_available", 0.0)
+    return _execute(keys, amount, pools, coins, [p.base for p in plans], start, expected, min_receive)
+
+
+def simulate_batch(batch: SwapPlanBatch, pools: PoolSet) -> SimBatch:
+    """
+    Simulate every portfolio of a build_swap_plans_batch() result straight from its arrays
+    (base-mode legs, one leg per coin; venue splits and netting are only in plan(i)).
+    """
+    if np is None:
+        raise ImportError("simulate_batch requires numpy")
+    coins, base = list(batch.coins), batch.base
+    sell_cols = [j for j in range(len(coins)) if batch.sell_mask[:, j].any()]
+    buy_cols = [j for j in range(len(coins)) if batch.buy_mask[:, j].any()]
+    keys: List[LegKey] = [(0, coins[j], base, None) for j in sell_cols] + [(2, base, coins[j], None) for j in buy_cols]
+    amount = np.hstack([
+        np.where(batch.sell_mask[:, sell_cols], batch.sells[:, sell_cols], 0.0),
+        np.where(batch.buy_mask[:, buy_cols], batch.buys[:, buy_cols], 0.0),
+    ])
+    start = np.array(batch.balances, dtype=float, copy=True)
+    start[:, coins.index(base)] += batch.wallet_base_available
+    return _execute(keys, amount, pools, coins, [base] * len(batch), start)
+
+
+# ─────────────────────────────────────────────────────────────
+if __name__ == "__main__":
+    import random
+    import time
+    try:
+        from app.swapPlanner import build_swap_plan, build_swap_plans_batch
+    except Exception:
+        from swapPlanner import build_swap_plan, build_swap_plans_batch
+
+    pools = PoolSet.load()
+    balances = {"USDC": 1200.0, "USDT": 800.0, "DAI": 500.0, "GUSD": 100.0, "USDD": 400.0}
+    deltas = {"USDC": -836.4, "USDT": -254.8, "DAI": -136.4, "GUSD": 40000.0, "USDD": 145.2}
+    balances["USDC"] += 40000.0
+    plan = build_swap_plan(balances, deltas, base="USDC")
+    print(json.dumps(simulate_plans([plan], pools, [balances]).to_dict(0), indent=2))
+
+    coins = ["USDC", "USDT", "DAI", "FDUSD", "BUSD", "TUSD", "USDP", "PYUSD", "USDD", "GUSD"]
+    rnd = random.Random(7)
+    n = 5000
+    bal = [[rnd.uniform(0, 5e4) for _ in coins] for _ in range(n)]
+    dlt = []
+    for row in bal:
+        d = [rnd.uniform(-0.5, 0.5) * v for v in row]
+        d[0] -= sum(d)
+        dlt.append(d)
+    t0 = time.perf_counter()
+    sim = simulate_batch(build_swap_plans_batch(bal, dlt, coins), pools)
+    dt = time.perf_counter() - t0
+    print(f"{n} plans planned + simulated in {dt * 1000:.0f} ms ({n / dt:,.0f} plans/s); "
+          f"mean value lost ${sim.value_lost.mean():.2f}")
@@ -0,0 +1,176 @@
+# balance_fetcher.py
+"""
+On-chain balances for active vacation users, so alerts don't run on stale pushed balances.
+- balanceOf(wallet) for every registry token with an address (the liquidity agent's list),
+  packed into one Multicall3 aggregate3 eth_call per chunk of wallets (allowFailure=true);
+  several chunks go out per HTTP request as a JSON-RPC batch. 5000 wallets x 10 tokens =
+  50 eth_calls in 5 HTTP requests, not 50,000 calls.
+- Every chunk reads the same block (eth_blockNumber first), so one refresh is one snapshot.
+- rpc is any async callable(list of JSON-RPC requests) -> list of responses: JsonRpc(url)
+  for a node or a local devnet (anvil/hardhat), or an in-process stub.
+- refresh_users() writes changed balances to the user store in one transaction and keeps
+  quote_amount and any coins the chain didn't answer for.
+"""
+
+import re
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import aiohttp  # only needed for JsonRpc
+except Exception:
+    aiohttp = None
+
+try:
+    from app.coins import COINS, CoinRegistry
+    from app.tx_bundle import encode_call
+    from app.user_store import UserStore
+except Exception:
+    from coins import COINS, CoinRegistry  # fallback for local runs
+    from tx_bundle import encode_call
+    from user_store import UserStore
+
+MULTICALL3 = "0xcA11bde05977b3631167028862bE2a173976CA11"   # same address on mainnet and most chains
+_ADDRESS = re.compile(r"^0x[0-9a-fA-F]{40}$")
+
+Rpc = Callable[[List[Dict[str, Any]]], Awaitable[List[Dict[str, Any]]]]
+
+
+class JsonRpc:
+    """POSTs a JSON-RPC batch to `url` and returns the responses in request order."""
+
+    def __init__(self, url: str, timeout: float = 20.0):
+        if aiohttp is None:
+            raise ImportError("JsonRpc requires aiohttp")
+        self.url = url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: Optional["aiohttp.ClientSession"] = None
+
+    async def __call__(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+        async with self._session.post(self.url, json=batch) as resp:
+            resp.raise_for_status()
+            out = await resp.json(content_type=None)
+        out = out if isinstance(out, list) else [out]
+        by_id = {r.get("id"): r for r in out}
+        return [by_id.get(req["id"], {"error": {"message": "no response"}}) for req in batch]
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+def decode_aggregate3(data: bytes) -> List[Tuple[bool, bytes]]:
+    """ABI-decode aggregate3's (bool success, bytes returnData)[]."""
+    word = lambda off: int.from_bytes(data[off:off + 32], "big")
+    arr = word(0)
+    n = word(arr)
+    head = arr + 32
+    out = []
+    for i in range(n):
+        t = head + word(head + 32 * i)
+        b = t + word(t + 32)
+        out.append((bool(word(t)), data[b + 32:b + 32 + word(b)]))
+    return out
+
+
+class BalanceFetcher:
+    def __init__(
+        self,
+        rpc: Rpc,
+        coins: CoinRegistry = COINS,
+        multicall: str = MULTICALL3,
+        chunk_wallets: int = 100,        # x tokens balanceOf calls per eth_call; keep under the node's gas cap
+        chunks_per_request: int = 10,    # eth_calls per HTTP request
+    ):
+        self.rpc = rpc
+        self.tokens = [(c.symbol, c.address, c.decimals) for c in coins.coins if c.address]
+        self.multicall = multicall
+        self.chunk_wallets = max(1, int(chunk_wallets))
+        self.chunks_per_request = max(1, int(chunks_per_request))
+        self.http_requests = 0
+        self.eth_calls = 0
+        self.failed_calls = 0
+
+    async def block_number(self) -> int:
+        self.http_requests += 1
+        (resp,) = await self.rpc([{"jsonrpc": "2.0", "id": 0, "method": "eth_blockNumber", "params": []}])
+        if resp.get("error"):
+            raise RuntimeError(f"eth_blockNumber failed: {resp['error']}")
+        return int(resp["result"], 16)
+
+    def _chunk_call(self, wallets: Sequence[str]) -> str:
+        calls = [
+            (token, True, encode_call("balanceOf(address)", w))
+            for w in wallets for _, token, _ in self.tokens
+        ]
+        return "0x" + encode_call("aggregate3((address,bool,bytes)[])", calls).hex()
+
+    async def fetch(self, wallets: Sequence[str], block: Optional[int] = None) -> Tuple[int, Dict[str, Dict[str, float]]]:
+        """
+        (block, {wallet_lc: {SYMBOL: amount}}) for valid addresses in `wallets`. Tokens whose call
+        failed are missing from that wallet's dict; a chunk whose eth_call failed is missing entirely.
+        """
+        if block is None:
+            block = await self.block_number()
+        wallets = list(dict.fromkeys(w.lower() for w in wallets if _ADDRESS.match(w or "")))
+        chunks = [wallets[i:i + self.chunk_wallets] for i in range(0, len(wallets), self.chunk_wallets)]
+        out: Dict[str, Dict[str, float]] = {}
+        for r in range(0, len(chunks), self.chunks_per_request):
+            group = chunks[r:r + self.chunks_per_request]
+            batch = [
+                {"jsonrpc": "2.0", "id": i + 1, "method": "eth_call",
+                 "params": [{"to": self.multicall, "data": self._chunk_call(chunk)}, hex(block)]}
+                for i, chunk in enumerate(group)
+            ]
+            self.http_requests += 1
+            self.eth_calls += len(batch)
+            for chunk, resp in zip(group, await self.rpc(batch)):
+                if resp.get("error") or not resp.get("result"):
+                    self.failed_calls += len(chunk) * len(self.tokens)
+                    continue
+                results = decode_aggregate3(bytes.fromhex(resp["result"][2:]))
+                for w_i, w in enumerate(chunk):
+                    bal = out.setdefault(w, {})
+                    for t_i, (sym, _, decimals) in enumerate(self.tokens):
+                        ok, ret = results[w_i * len(self.tokens) + t_i]
+                        if ok and len(ret) >= 32:
+                            bal[sym] = int.from_bytes(ret[:32], "big") / 10 ** decimals
+                        else:
+                            self.failed_calls += 1
+        return block, out
+
+    def stats(self) -> Dict[str, int]:
+        return {"http_requests": self.http_requests, "eth_calls": self.eth_calls, "failed_calls": self.failed_calls}
+
+
+async def refresh_users(
+    store: UserStore,
+    fetcher: BalanceFetcher,
+    users: Sequence[Tuple[int, Dict[str, Any]]],
+    coins: CoinRegistry = COINS,
+    block: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Fetch on-chain balances for `users` and store the ones that changed (one transaction)."""
+    by_wallet: Dict[str, List[Tuple[int, Dict[str, Any]]]] = {}
+    for uid, u in users:
+        by_wallet.setdefault((u.get("wallet_address") or "").lower(), []).append((uid, u))
+    before = fetcher.stats()
+    block, fetched = await fetcher.fetch(list(by_wallet), block)
+
+    updates: Dict[int, Dict[str, Any]] = {}
+    for wallet, onchain in fetched.items():
+        for uid, u in by_wallet.get(wallet, []):
+            old_json = u.get("balances_json") or {}
+            old = coins.parse_balances(old_json)
+            new = {**old, **onchain}
+            if new == old:
+                continue
+            updates[uid] = {"balances_json": {**new, "quote_amount": old_json.get("quote_amount", 1000.0)}}
+    return {
+        "block": block,
+        "wallets": len(by_wallet),
+        "fetched": len(fetched),
+        "updated": store.update_many(updates),
+        **{k: v - before[k] for k, v in fetcher.stats().items()},
+    }
@@ -0,0 +1,122 @@
+# coins.py
+"""
+Coin registry shared by the backend and the agents.
+- Loaded once from app/data/coins.json (or COINS_REGISTRY_PATH); file order is the
+  canonical vector order. Adding a coin there needs no schema edits once the balancer
+  speaks CompactRebalanceRequest (BALANCER_COMPACT_REQUESTS=true); the legacy
+  RebalanceCheckRequest only has fields for the original ten coins.
+- parse_balances() accepts every payload shape we store or receive:
+  legacy "<sym>_balance" fields, compact {"symbols": [...], "amounts": [...]},
+  {"balances": {SYM: amount}} or plain {SYM: amount}; returns {SYMBOL: float}.
+- vector()/matrix() give NumPy rows in registry order for allocation math over many coins.
+"""
+
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+try:
+    import numpy as np  # only needed for vector()/matrix()
+except Exception:
+    np = None
+
+REGISTRY_PATH = Path(os.getenv("COINS_REGISTRY_PATH", str(Path(__file__).resolve().parent / "data" / "coins.json")))
+_BUILTIN = ("USDC", "USDT", "DAI", "FDUSD", "BUSD", "TUSD", "USDP", "PYUSD", "USDD", "GUSD")
+_NOT_COINS = frozenset(("quote_amount", "note", "request_id", "user_id", "symbols", "amounts", "balances"))
+
+
+@dataclass(frozen=True)
+class Coin:
+    symbol: str
+    name: str = ""
+    decimals: int = 18
+    address: Optional[str] = None
+    coingecko_id: Optional[str] = None
+
+
+class CoinRegistry:
+    def __init__(self, coins: Iterable[Coin]):
+        self.coins: Tuple[Coin, ...] = tuple(coins)
+        self.symbols: Tuple[str, ...] = tuple(c.symbol for c in self.coins)
+        self.index: Dict[str, int] = {s: i for i, s in enumerate(self.symbols)}
+        self.by_symbol: Dict[str, Coin] = {c.symbol: c for c in self.coins}
+        # "usdc_balance" -> "USDC", built once instead of string-munging every request
+        self.legacy_fields: Dict[str, str] = {f"{s.lower()}_balance": s for s in self.symbols}
+
+    @classmethod
+    def load(cls, path: Path = REGISTRY_PATH) -> "CoinRegistry":
+        try:
+            data = json.loads(Path(path).read_text())
+            coins = [
+                Coin(
+                    symbol=str(c["symbol"]).upper(),
+                    name=c.get("name", ""),
+                    decimals=int(c.get("decimals", 18)),
+                    address=c.get("address"),
+                    coingecko_id=c.get("coingecko_id"),
+                )
+                for c in data.get("coins", [])
+            ]
+        except Exception:
+            coins = []
+        return cls(coins or [Coin(s) for s in _BUILTIN])
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol.upper() in self.index
+
+    def unknown(self, symbols: Iterable[str]) -> List[str]:
+        return sorted({s.upper() for s in symbols} - set(self.index))
+
+    # ── parsing ─────────────────────────────────────────────
+    def parse_balances(self, payload: Optional[Mapping[str, Any]]) -> Dict[str, float]:
+        out: Dict[str, float] = {}
+        if not payload:
+            return out
+        for k, v in payload.items():
+            if k in _NOT_COINS or isinstance(v, (list, dict)):
+                continue
+            sym = self.legacy_fields.get(k)
+            if sym is None:
+                sym = (k[: -len("_balance")] if k.endswith("_balance") else k).upper()
+            out[sym] = float(v or 0.0)
+        out.update(self.parse_compact(payload.get("symbols"), payload.get("amounts"), payload.get("balances")))
+        return out
+
+    @staticmethod
+    def parse_compact(
+        symbols: Optional[Sequence[str]],
+        amounts: Optional[Sequence[float]],
+        balances: Optional[Mapping[str, float]] = None,
+    ) -> Dict[str, float]:
+        """{SYMBOL: amount} from parallel symbols/amounts arrays and/or a balances dict."""
+        symbols, amounts = symbols or [], amounts or []
+        if len(symbols) != len(amounts):
+            raise ValueError(f"symbols ({len(symbols)}) and amounts ({len(amounts)}) differ in length")
+        out = {s.upper(): float(a or 0.0) for s, a in zip(symbols, amounts)}
+        for s, a in (balances or {}).items():
+            out[s.upper()] = float(a or 0.0)
+        return out
+
+    # ── vectors ─────────────────────────────────────────────
+    def vector(self, balances: Mapping[str, float]):
+        """Balances as a (len(registry),) array in registry order; unknown coins are ignored."""
+        v = np.zeros(len(self.symbols))
+        for s, a in balances.items():
+            i = self.index.get(s)
+            if i is not None:
+                v[i] = a
+        return v
+
+    def matrix(self, portfolios: Sequence[Mapping[str, float]]):
+        return np.vstack([self.vector(p) for p in portfolios]) if portfolios else np.zeros((0, len(self.symbols)))
+
+    def to_dict(self, vector) -> Dict[str, float]:
+        return {s: float(x) for s, x in zip(self.symbols, vector)}
+
+
+COINS = CoinRegistry.load()
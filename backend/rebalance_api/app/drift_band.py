@@ -0,0 +1,82 @@
+# drift_band.py
+"""
+No-trade band around a wallet's target weights.
+- A coin breaches the band when |current - target| exceeds abs_bps (weight basis points)
+  or, for coins with a non-zero target, exceeds rel x target.
+- The wallet breaches it when any coin does, or when turnover (half the summed absolute
+  drift, i.e. the share of the portfolio a rebalance would move) exceeds turnover_bps.
+- A value exactly on a limit is inside (limits are compared without float noise).
+- Any limit set to None is ignored; all three None means "always replan".
+"""
+
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+BAND_KEYS = ("abs_bps", "rel", "turnover_bps")
+
+
+def _over(value: float, limit: float) -> bool:
+    # a weight exactly on the edge (0.52 vs 0.50 is 200.00000000000017 bps) is inside
+    return value - limit > 1e-9 * max(1.0, abs(limit))
+
+
+@dataclass
+class DriftBand:
+    abs_bps: Optional[float] = 200.0        # per coin, e.g. 200 = 2 percentage points
+    rel: Optional[float] = 0.25             # per coin, fraction of its target weight
+    turnover_bps: Optional[float] = 300.0   # whole wallet
+
+    @classmethod
+    def from_prefs(cls, prefs: Optional[Dict[str, Any]], default: "DriftBand") -> "DriftBand":
+        """Per-user overrides (any subset of BAND_KEYS) on top of `default`."""
+        band = cls(**asdict(default))
+        for k in BAND_KEYS:
+            if prefs and k in prefs:
+                setattr(band, k, None if prefs[k] is None else float(prefs[k]))
+        return band
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def check(self, current: Dict[str, float], target: Dict[str, float]) -> "DriftCheck":
+        coins = sorted(set(current) | set(target))
+        breaches: List[str] = []
+        max_abs = max_rel = turnover = 0.0
+        for c in coins:
+            t = float(target.get(c, 0.0))
+            drift = abs(float(current.get(c, 0.0)) - t)
+            turnover += drift / 2
+            max_abs = max(max_abs, drift)
+            rel = drift / t if t > 0 else None
+            if rel is not None:
+                max_rel = max(max_rel, rel)
+            if self.abs_bps is not None and _over(drift * 1e4, self.abs_bps):
+                breaches.append(f"{c} off target by {drift * 1e4:.0f} bps")
+            elif self.rel is not None and rel is not None and _over(rel, self.rel):
+                breaches.append(f"{c} off target by {rel:.0%} of its weight")
+        if self.turnover_bps is not None and _over(turnover * 1e4, self.turnover_bps):
+            breaches.append(f"turnover {turnover * 1e4:.0f} bps")
+        enabled = any(getattr(self, k) is not None for k in BAND_KEYS)
+        return DriftCheck(
+            inside=enabled and not breaches,
+            max_abs_bps=round(max_abs * 1e4, 1),
+            max_rel=round(max_rel, 4),
+            turnover_bps=round(turnover * 1e4, 1),
+            breaches=breaches,
+        )
+
+
+@dataclass
+class DriftCheck:
+    inside: bool
+    max_abs_bps: float
+    max_rel: float
+    turnover_bps: float
+    breaches: List[str] = field(default_factory=list)
+
+    @property
+    def status(self) -> str:
+        return "within band" if self.inside else "outside band"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"status": self.status, **asdict(self)}
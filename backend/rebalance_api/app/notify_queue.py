@@ -0,0 +1,157 @@
+# notify_queue.py
+"""
+Async outbound Telegram queue.
+- enqueue() returns immediately; alert loops never wait on Telegram.
+- Global token bucket (Telegram allows ~30 msg/s per bot) + min spacing per chat (~1 msg/s).
+- Messages to the same chat are delivered in order by one worker per chat.
+- RetryAfter (429) waits the advertised delay; timeouts / 5xx retry with exponential backoff;
+  other errors (bad request, bot blocked) fail immediately.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None   # created lazily inside the running loop
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
+
+
+class TelegramQueue:
+    def __init__(
+        self,
+        bot,
+        global_rate: float = 25.0,          # msgs/s across all chats (stay under Telegram's 30)
+        per_chat_interval: float = 1.0,     # seconds between two messages to the same chat
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0,
+    ):
+        self.bot = bot
+        self.bucket = TokenBucket(global_rate)
+        self.per_chat_interval = float(per_chat_interval)
+        self.max_retries = int(max_retries)
+        self.backoff_base = float(backoff_base)
+        self.backoff_max = float(backoff_max)
+        self._queues: Dict[str, Deque[Tuple[str, Dict[str, Any], asyncio.Future]]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._last_sent: Dict[str, float] = {}   # per chat, outlives its worker so spacing holds across bursts
+        self.enqueued = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latencies: Deque[float] = deque(maxlen=1000)   # seconds per delivery, incl. retries
+        self.on_delivered: Optional[Callable[[bool, float], None]] = None   # (ok, seconds) hook for metrics
+
+    def enqueue(self, chat_id, text: str, **kwargs) -> asyncio.Future:
+        """Queue a message; the returned future resolves True on delivery or to the final exception."""
+        fut = asyncio.get_running_loop().create_future()
+        if self.bot is None:
+            fut.set_exception(RuntimeError("TELEGRAM_BOT_TOKEN not configured"))
+            fut.exception()  # mark retrieved: fire-and-forget callers don't await
+            return fut
+        chat = str(chat_id)
+        kwargs.setdefault("parse_mode", "HTML")
+        kwargs.setdefault("disable_web_page_preview", True)
+        self._queues.setdefault(chat, deque()).append((text, kwargs, fut))
+        self.enqueued += 1
+        if chat not in self._workers or self._workers[chat].done():
+            self._workers[chat] = asyncio.ensure_future(self._run_chat(chat))
+        return fut
+
+    async def send(self, chat_id, text: str, **kwargs) -> bool:
+        """Enqueue and wait for delivery (raises the final error)."""
+        return await self.enqueue(chat_id, text, **kwargs)
+
+    async def _run_chat(self, chat: str):
+        q = self._queues[chat]
+        while q:
+            text, kwargs, fut = q.popleft()
+            wait = self._last_sent.get(chat, 0.0) + self.per_chat_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            started = time.monotonic()
+            try:
+                await self._deliver(chat, text, kwargs)
+                self.sent += 1
+                self.latencies.append(time.monotonic() - started)
+                if self.on_delivered is not None:
+                    self.on_delivered(True, self.latencies[-1])
+                if not fut.done():
+                    fut.set_result(True)
+            except Exception as e:
+                self.failed += 1
+                if self.on_delivered is not None:
+                    self.on_delivered(False, time.monotonic() - started)
+                if not fut.done():
+                    fut.set_exception(e)
+                    fut.exception()
+            self._last_sent[chat] = time.monotonic()
+        self._queues.pop(chat, None)
+        # entries older than the spacing can't delay anything; don't keep one per chat forever
+        cutoff = time.monotonic() - self.per_chat_interval
+        for c in [c for c, t in self._last_sent.items() if t < cutoff and c not in self._workers]:
+            del self._last_sent[c]
+        self._workers.pop(chat, None)
+
+    async def _deliver(self, chat: str, text: str, kwargs: Dict[str, Any]):
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat, text=text, **kwargs)
+                return
+            except RetryAfter as e:
+                err, delay = e, float(e.retry_after)
+            except (BadRequest, Forbidden):
+                raise
+            except NetworkError as e:
+                err, delay = e, min(self.backoff_max, self.backoff_base * (2 ** attempt))
+            attempt += 1
+            if attempt > self.max_retries:
+                raise err
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    def depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    async def drain(self, timeout: float = 10.0):
+        """Wait (bounded) for queued messages to go out, e.g. on shutdown."""
+        workers: List[asyncio.Task] = [t for t in self._workers.values() if not t.done()]
+        if workers:
+            await asyncio.wait(workers, timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        lat = sorted(self.latencies)
+        return {
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "queue_depth": self.depth(),
+            "active_chats": len(self._workers),
+            "p50_latency_sec": round(lat[len(lat) // 2], 4) if lat else None,
+            "p95_latency_sec": round(lat[int(len(lat) * 0.95)], 4) if lat else None,
+        }
@@ -4,21 +4,39 @@ import os
 import json
 import time
 import asyncio
-from typing import Optional, Dict, Any
+import uuid
+import copy
+from typing import Optional, Dict, Any, List, Hashable, Tuple, Union
 from pathlib import Path
 import hashlib
+import sqlite3
 
 from dotenv import load_dotenv
 from uagents import Agent, Context, Model
 from uagents.setup import fund_agent_if_low
 
 # Balancer models
-from app.rebalance_models import RebalanceCheckRequest, RebalanceCheckResponse
+from app.rebalance_models import RebalanceCheckRequest, RebalanceCheckResponse, CompactRebalanceRequest
+from app.coins import COINS
+from app.preview_cache import PreviewCache
+from app.user_store import UserStore
+from app.notify_queue import TelegramQueue
+from app.summary_scheduler import SummaryScheduler
+from app.write_behind import WriteBehind
+from app.side_server import SideServer
+from app.drift_band import DriftBand, DriftCheck
+from app.tx_bundle import encode_plan
+from app.balance_fetcher import BalanceFetcher, JsonRpc, MULTICALL3, refresh_users
+from app.metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
+try:
+    import msgpack  # optional: compact binary format for the on-disk caches
+except Exception:
+    msgpack = None
 # try both import locations so it works in dev and on Render
 try:
-    from app.swapPlanner import build_swap_plan
+    from app.swapPlanner import build_swap_plan, build_swap_plans_batch, choose_base, CostModel, DustPolicy, LiquidityModel, SwapPlan, replan
 except Exception:
-    from swapPlanner import build_swap_plan  # fallback for local runs
+    from swapPlanner import build_swap_plan, build_swap_plans_batch, choose_base, CostModel, DustPolicy, LiquidityModel, SwapPlan, replan  # fallback for local runs
 
 # Telegram (send-only)
 from telegram import Bot
@@ -32,23 +50,103 @@ BALANCER_AGENT_ADDRESS = os.getenv("BALANCER_AGENT_ADDRESS", "").strip()
 USE_MAILBOX = str(os.getenv("MAILBOX_ENABLED", os.getenv("USE_MAILBOX", "true"))).lower() in ("1", "true", "yes", "y")
 DEFAULT_TIMEOUT_SEC = float(os.getenv("DEFAULT_TIMEOUT_SEC", "60"))
 AGENT_NAME = "rebalance-rest-port"
+PREVIEW_CACHE_TTL_SEC = float(os.getenv("PREVIEW_CACHE_TTL_SEC", "60"))   # market-data freshness window
+PREVIEW_CACHE_MAX = int(os.getenv("PREVIEW_CACHE_MAX", "1024"))
+CACHE_FLUSH_SEC = float(os.getenv("CACHE_FLUSH_SEC", "1.0"))   # min spacing of on-disk cache writes
+BATCH_MAX_PORTFOLIOS = int(os.getenv("BATCH_MAX_PORTFOLIOS", "1000"))
+UPSTREAM_COMPACT = os.getenv("BALANCER_COMPACT_REQUESTS", "false").lower() in ("1", "true", "yes", "y")   # balancer speaks CompactRebalanceRequest
+SWAP_PLAN_MODE = os.getenv("SWAP_PLAN_MODE", "base").strip().lower()   # base | net (direct coin->coin where cheaper)
+SWAP_BASES = [b.strip().upper() for b in os.getenv("SWAP_BASES", "USDC").split(",") if b.strip()] or ["USDC"]   # first = preferred
+SWAP_COST = CostModel(
+    fee_bps=float(os.getenv("SWAP_FEE_BPS", "5")),
+    gas_per_leg=float(os.getenv("SWAP_GAS_PER_LEG_USD", "0.5")),
+    # {"GUSD/DAI": "inf", ...}: per-pair bps, "inf" = unavailable; {"USDD": 40, ...}: per-coin risk/depeg bps
+    pair_bps={tuple(k.upper().split("/")): float(v) for k, v in json.loads(os.getenv("SWAP_PAIR_BPS_JSON", "{}")).items()},
+    coin_bps={k.upper(): float(v) for k, v in json.loads(os.getenv("SWAP_COIN_BPS_JSON", "{}")).items()},
+)
+SWAP_SLIPPAGE_BPS = float(os.getenv("SWAP_SLIPPAGE_BPS", "30"))     # min_receive = expected receive less this
+SWAP_ROUTER_ADDRESS = os.getenv("SWAP_ROUTER_ADDRESS", "").strip()   # router the /rebalance/bundle swaps call
+_DUST_ACTION = os.getenv("SWAP_DUST_ACTION", "merge").strip().lower()   # merge | drop | off
+SWAP_DUST = None if _DUST_ACTION in ("", "off", "none") else DustPolicy(
+    min_trade=float(os.getenv("SWAP_MIN_TRADE_USD", "10")),
+    coin_min={k.upper(): float(v) for k, v in json.loads(os.getenv("SWAP_MIN_TRADE_JSON", "{}")).items()},
+    max_gas_bps=float(os.getenv("SWAP_DUST_MAX_GAS_BPS", "100")) or None,   # gas at most this share of a leg; 0 = ignore gas
+    action=_DUST_ACTION,
+)
+SIDE_HTTP_PORT = int(os.getenv("SIDE_HTTP_PORT", str(PORT + 1)))   # SSE stream server; 0 disables
+STREAM_KEEPALIVE_SEC = float(os.getenv("STREAM_KEEPALIVE_SEC", "15"))
 
 # Vacation settings
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
 CHECK_INTERVAL_SEC = int(os.getenv("CHECK_INTERVAL_SEC", "120"))        # alert checks
-SUMMARY_TICK_SEC   = int(os.getenv("SUMMARY_TICK_SEC", "60"))           # summary clock tick
+SUMMARY_TICK_SEC   = int(os.getenv("SUMMARY_TICK_SEC", "60"))           # max summary scheduler sleep
 DEFAULT_ALERT_THRESHOLD = os.getenv("DEFAULT_ALERT_THRESHOLD", "RED")   # per-user can override
+ALERT_SLICE_SIZE   = int(os.getenv("ALERT_SLICE_SIZE", "8"))            # users planned per slice before yielding to the loop
+ALERT_CYCLE_DEADLINE_SEC = float(os.getenv("ALERT_CYCLE_DEADLINE_SEC", str(CHECK_INTERVAL_SEC * 0.9)))
+
+# No-trade band (per-user overridable via /users/prefs); empty value disables that limit
+_opt_float = lambda v: float(v) if str(v).strip() else None
+DRIFT_BAND = DriftBand(
+    abs_bps=_opt_float(os.getenv("DRIFT_BAND_ABS_BPS", "200")),
+    rel=_opt_float(os.getenv("DRIFT_BAND_REL", "0.25")),
+    turnover_bps=_opt_float(os.getenv("DRIFT_BAND_TURNOVER_BPS", "300")),
+)
+DRIFT_BAND_MAX_AGE_SEC = float(os.getenv("DRIFT_BAND_MAX_AGE_SEC", "21600"))   # replan anyway after this
+
+# On-chain balance refresh for active users (empty BALANCE_RPC_URL = balances only via /users/balances)
+BALANCE_RPC_URL = os.getenv("BALANCE_RPC_URL", "").strip()
+BALANCE_POLL_SEC = float(os.getenv("BALANCE_POLL_SEC", "60"))
+BALANCE_CHUNK_WALLETS = int(os.getenv("BALANCE_CHUNK_WALLETS", "100"))           # wallets per multicall eth_call
+BALANCE_CHUNKS_PER_REQUEST = int(os.getenv("BALANCE_CHUNKS_PER_REQUEST", "10"))  # eth_calls per JSON-RPC batch
+MULTICALL3_ADDRESS = os.getenv("MULTICALL3_ADDRESS", MULTICALL3).strip()
+
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "25"))                 # msgs/s across all chats
+TG_PER_CHAT_INTERVAL_SEC = float(os.getenv("TG_PER_CHAT_INTERVAL_SEC", "1.0"))
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "5"))
 
 bot = Bot(TELEGRAM_BOT_TOKEN) if TELEGRAM_BOT_TOKEN else None
+TG = TelegramQueue(bot, global_rate=TG_GLOBAL_RATE, per_chat_interval=TG_PER_CHAT_INTERVAL_SEC, max_retries=TG_MAX_RETRIES)
+
+# --- Metrics (served as Prometheus text on the side server: GET /metrics) ---
+M_UPSTREAM_RTT = REGISTRY.histogram("port_agent_upstream_rtt_seconds", "Balancer request to matching reply")
+M_PREVIEW = REGISTRY.histogram("port_agent_preview_compute_seconds", "Preview computed from a fresh balancer reply")
+M_SWAP_PLAN = REGISTRY.histogram("port_agent_build_swap_plan_seconds", "Swap planning (mode=single per portfolio | batch per request)")
+M_USER_DB = REGISTRY.histogram("port_agent_user_db_seconds", "User store operation (op=get|update|...)")
+M_CYCLE = REGISTRY.histogram("port_agent_cycle_seconds", "Background cycle duration (cycle=alert|summary)",
+                             buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+M_TG_SEND = REGISTRY.histogram("port_agent_telegram_send_seconds", "Telegram delivery incl. retries (ok=true|false)")
+M_CACHE = REGISTRY.counter("port_agent_preview_cache_total", "Preview cache lookups (result=hit|miss)")
+M_TIMEOUTS = REGISTRY.counter("port_agent_upstream_timeouts_total", "Balancer replies not received within DEFAULT_TIMEOUT_SEC")
+M_JOINS = REGISTRY.counter("port_agent_singleflight_joins_total", "Requests served by joining an identical in-flight one (kind=reply|preview)")
+M_FALLBACKS = REGISTRY.counter("port_agent_cached_fallbacks_total", "Timeouts answered from the on-disk cache (endpoint=...)")
+M_REPLAN = REGISTRY.counter("port_agent_replans_total", "Incremental replans vs the last sent plan (result=unchanged|patched|rebuilt)")
+M_BALANCE_RPC = REGISTRY.counter("port_agent_balance_rpc_total", "On-chain balance refresh calls (kind=http|eth_call|failed_call)")
+M_BAND = REGISTRY.counter("port_agent_drift_band_checks_total", "Alert-cycle drift checks (result=inside|outside|stale)")
+TG.on_delivered = lambda ok, sec: M_TG_SEND.observe(sec, ok=str(ok).lower())
 
 # --- Local cache & DB setup (app/data/...) ---
 APP_DIR = Path(__file__).resolve().parent
-DATA_DIR = APP_DIR / "data"
+DATA_DIR = Path(os.getenv("PORT_AGENT_DATA_DIR", str(APP_DIR / "data")))   # overridable for load tests
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 CACHE_PATH = DATA_DIR / "rebalance_latest.json"          # raw balancer reply cache (stringified)
 PREVIEW_CACHE_PATH = DATA_DIR / "rebalance_preview.json" # combined preview cache
-USERS_DB_PATH = DATA_DIR / "vacation_users.json"         # user store
+CACHE_BIN_PATH = DATA_DIR / "rebalance_latest.msgpack"            # same caches as msgpack, used when
+PREVIEW_CACHE_BIN_PATH = DATA_DIR / "rebalance_preview.msgpack"   # msgpack is installed
+USERS_DB_PATH = DATA_DIR / "vacation_users.db"           # user store (SQLite, WAL)
+USERS_JSON_PATH = DATA_DIR / "vacation_users.json"       # legacy JSON store, migrated once on startup
+LIQUIDITY_CURVES_PATH = Path(os.getenv("LIQUIDITY_CURVES_PATH", str(APP_DIR / "data" / "liquidity_curves.json")))
+
+def _load_liquidity() -> Optional[LiquidityModel]:
+    # per-pair venue curves for leg splitting + min_receive; missing/empty path = plain legs
+    if not LIQUIDITY_CURVES_PATH.is_file():
+        return None
+    try:
+        return LiquidityModel.from_dict(json.loads(LIQUIDITY_CURVES_PATH.read_text()))
+    except Exception:
+        return None
+
+SWAP_LIQUIDITY = _load_liquidity()
 
 # ─────────────────────────────────────────────────────────────
 # Models for preview + vacation REST
@@ -62,6 +160,29 @@ class PreviewResponse(Model):
     rationale: Optional[str] = None
     error: Optional[str] = None
 
+class BatchRequest(Model):
+    requests: List[RebalanceCheckRequest] = []
+    portfolios: List[CompactRebalanceRequest] = []
+    # array form: one row of amounts per portfolio, columns in `symbols` order
+    symbols: List[str] = []
+    rows: List[List[float]] = []
+    quote_amount: float = 1000.0
+
+class BatchResponse(Model):
+    ok: bool
+    results: List[PreviewResponse] = []
+    error: Optional[str] = None
+
+class BundleRequest(Model):
+    swap_plan: Dict[str, Any]      # a preview's swap_plan
+    account: str                   # smart account that executes the batch (and receives the swaps)
+    router: Optional[str] = None   # defaults to SWAP_ROUTER_ADDRESS
+
+class BundleResp(Model):
+    ok: bool
+    bundle: Dict[str, Any] = {}    # {"tx": {...}, "calls": [...], "gas_estimate", "gas_separate", ...}
+    error: Optional[str] = None
+
 class OkResp(Model):
     ok: bool
     error: Optional[str] = None
@@ -88,6 +209,10 @@ class Balances(Model):
     usdd_balance: float = 0.0
     gusd_balance: float = 0.0
     quote_amount: float = 1000.0
+    # any registry coin (app/data/coins.json); overrides the *_balance fields above
+    symbols: List[str] = []
+    amounts: List[float] = []
+    balances: Dict[str, float] = {}
 
 class BalancesWithId(Balances):
     user_id: int
@@ -97,6 +222,9 @@ class PrefsBody(Model):
     active: Optional[bool] = None
     alert_threshold: Optional[str] = None  # RED|YELLOW|GREEN
     daily_summary_hour_utc: Optional[int] = None  # 0..23
+    band_abs_bps: Optional[float] = None      # no-trade band overrides, see DriftBand
+    band_rel: Optional[float] = None
+    band_turnover_bps: Optional[float] = None
 
 class StartStopBody(Model):
     user_id: int
@@ -114,8 +242,32 @@ class StatusResp(Model):
     last_rationale: Optional[str] = None
     last_plan: Optional[Dict[str, Any]] = None
     next_summary_at: Optional[str] = None
+    drift_band: Optional[Dict[str, Any]] = None
+    last_drift: Optional[Dict[str, Any]] = None   # {"status": "within band" | "outside band", ...}
     error: Optional[str] = None
 
+class CacheStatsResp(Model):
+    ok: bool
+    size: int = 0
+    max_entries: int = 0
+    ttl_sec: float = 0.0
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    snapshot: Optional[str] = None
+
+class NotifyStatsResp(Model):
+    ok: bool
+    enqueued: int = 0
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    queue_depth: int = 0
+    active_chats: int = 0
+    p50_latency_sec: Optional[float] = None
+    p95_latency_sec: Optional[float] = None
+
 class HealthResp(Model):
     ok: bool
     agent: str
@@ -145,76 +297,204 @@ def as_utc(x: Optional[str]):
     except Exception:
         return None
 
-def _save_latest(ctx: Context, resp: Dict[str, Any]):
-    payload_str = json.dumps(resp, sort_keys=True)
-    new_hash = hashlib.sha1(payload_str.encode("utf-8")).hexdigest()
-    last_hash = ctx.storage.get("latest_hash") or ""
-    ctx.storage.set("latest_payload", payload_str)
-    ctx.storage.set("latest_ts", _now())
-    ctx.storage.set("latest_hash", new_hash)
-    if new_hash != last_hash:
-        payload = {"latest_payload": payload_str, "latest_ts": _now()}
-        try:
-            CACHE_PATH.write_text(json.dumps(payload, indent=2))
-            ctx.logger.info(f"💾 Cached raw reply to file: {CACHE_PATH}")
-        except Exception as e:
-            ctx.logger.warning(f"Failed to write raw cache file: {e}")
+# In-memory copies (parsed) are authoritative; the files are written behind for restarts.
+PERSIST = WriteBehind(interval_sec=CACHE_FLUSH_SEC)
+_LATEST: Dict[str, Any] = {}    # data (dict), ts
+_PREVIEW: Dict[str, Any] = {}   # payload (dict), ts
 
-def _get_latest(ctx: Context) -> Optional[Dict[str, Any]]:
-    raw = ctx.storage.get("latest_payload") or None
-    if raw:
-        return json.loads(raw)
+def _read_cache_file(bin_path: Path, json_path: Path) -> Optional[Any]:
     try:
-        if CACHE_PATH.exists():
-            data = json.loads(CACHE_PATH.read_text())
-            return json.loads(data.get("latest_payload", "{}"))
+        if msgpack is not None and bin_path.exists():
+            return msgpack.unpackb(bin_path.read_bytes(), raw=False)
+        if json_path.exists():
+            return json.loads(json_path.read_text())
     except Exception:
         pass
     return None
 
-def _save_preview(ctx: Context, preview: Dict[str, Any]):
-    s = json.dumps(preview, sort_keys=True)
-    ctx.storage.set("latest_preview_payload", s)
-    ctx.storage.set("latest_preview_ts", _now())
-    try:
-        PREVIEW_CACHE_PATH.write_text(s)
-    except Exception as e:
-        ctx.logger.warning(f"Failed to write preview cache file: {e}")
+def _save_latest(ctx: Context, resp: Dict[str, Any]):
+    changed = resp != _LATEST.get("data")
+    _LATEST.update(data=resp, ts=_now())
+    if not changed:
+        return
+    if msgpack is not None:
+        PERSIST.submit(CACHE_BIN_PATH, {"latest": resp, "latest_ts": _LATEST["ts"]}, msgpack.packb)
+    else:
+        payload = {"latest_payload": json.dumps(resp, sort_keys=True), "latest_ts": _LATEST["ts"]}
+        PERSIST.submit(CACHE_PATH, payload, lambda p: json.dumps(p, indent=2))
 
-def _get_preview(ctx: Context) -> Optional[Dict[str, Any]]:
-    raw = ctx.storage.get("latest_preview_payload")
-    if raw:
+def _get_latest(ctx: Context) -> Optional[Dict[str, Any]]:
+    if _LATEST.get("data") is not None:
+        return _LATEST["data"]
+    stored = _read_cache_file(CACHE_BIN_PATH, CACHE_PATH) or {}
+    if "latest" in stored:
+        data = stored["latest"]
+    elif "latest_payload" in stored:
         try:
-            return json.loads(raw)
+            data = json.loads(stored["latest_payload"])
         except Exception:
             return None
+    else:
+        return None
+    _LATEST.update(data=data, ts=stored.get("latest_ts"))
+    return data
+
+def _save_preview(ctx: Context, preview: Dict[str, Any]):
+    _PREVIEW.update(payload=preview, ts=_now())
+    if msgpack is not None:
+        PERSIST.submit(PREVIEW_CACHE_BIN_PATH, preview, msgpack.packb)
+    else:
+        PERSIST.submit(PREVIEW_CACHE_PATH, preview, lambda p: json.dumps(p, sort_keys=True))
+
+def _get_preview(ctx: Context) -> Optional[Dict[str, Any]]:
+    if _PREVIEW.get("payload") is None:
+        stored = _read_cache_file(PREVIEW_CACHE_BIN_PATH, PREVIEW_CACHE_PATH)
+        if not isinstance(stored, dict):
+            return None
+        _PREVIEW.update(payload=stored, ts=None)
+    return _PREVIEW["payload"]
+
+# ─────────────────────────────────────────────────────────────
+# Reply correlation (uAgents session -> Future)
+# ─────────────────────────────────────────────────────────────
+# Every upstream request goes out on its own uAgents session, and a balancer that
+# answers from its message handler replies on that same session, so on_reply can
+# resolve the matching future without a correlation field in the wire models
+# (adding one would change their schema digest and break the hosted balancer).
+# A reply on a session nobody is waiting for (late, after a timeout) is dropped.
+_PENDING_REPLIES: Dict[str, asyncio.Future] = {}
+
+def _session_ctx(ctx: Context) -> Context:
+    # the same context on a fresh session; ctx.send stamps ctx.session on the envelope
+    sctx = copy.copy(ctx)
+    sctx._session = uuid.uuid4()
+    sctx._outbound_messages = {}
+    return sctx
+
+def _register_reply(session: str) -> asyncio.Future:
+    fut = asyncio.get_running_loop().create_future()
+    _PENDING_REPLIES[session] = fut
+    return fut
+
+def _resolve_reply(session: str, data: Dict[str, Any]) -> bool:
+    fut = _PENDING_REPLIES.pop(session, None)
+    if fut is None or fut.done():
+        return False
+    fut.set_result(data)
+    return True
+
+AnyRebalanceRequest = Union[RebalanceCheckRequest, CompactRebalanceRequest]
+
+def _upstream_message(body: AnyRebalanceRequest) -> AnyRebalanceRequest:
+    # the balancer gets the format it speaks, whichever one the REST caller used
+    if isinstance(body, CompactRebalanceRequest) == UPSTREAM_COMPACT:
+        return body
+    return _request_from_balances(_balances_from_request(body), body.quote_amount)
+
+async def _send_and_wait(ctx: Context, body: AnyRebalanceRequest) -> Optional[Dict[str, Any]]:
+    """
+    Send `body` upstream on a fresh session and wait for the reply on that session.
+    Returns the reply dict, or None on timeout.
+    """
+    sctx = _session_ctx(ctx)
+    session = str(sctx.session)
+    fut = _register_reply(session)
+    await sctx.send(BALANCER_AGENT_ADDRESS, _upstream_message(body))
+    ctx.logger.info(f"→ Sent request to balancer (session={session})")
+    started = time.perf_counter()
     try:
-        if PREVIEW_CACHE_PATH.exists():
-            return json.loads(PREVIEW_CACHE_PATH.read_text())
-    except Exception:
-        pass
-    return None
+        data = await asyncio.wait_for(fut, timeout=DEFAULT_TIMEOUT_SEC)
+        M_UPSTREAM_RTT.observe(time.perf_counter() - started)
+        return data
+    except asyncio.TimeoutError:
+        M_TIMEOUTS.inc()
+        return None
+    finally:
+        _PENDING_REPLIES.pop(session, None)
+
+# ─────────────────────────────────────────────────────────────
+# Single-flight (identical in-flight requests share one task)
+# ─────────────────────────────────────────────────────────────
+_INFLIGHT: Dict[Tuple[str, Hashable], asyncio.Task] = {}
+_SIG_FIELDS = tuple(RebalanceCheckRequest.__fields__)
+
+def _request_sig(body: AnyRebalanceRequest) -> Tuple:
+    # the field values themselves are the key: no dict()/json/sha1 per request
+    if isinstance(body, CompactRebalanceRequest):
+        return (body.note, body.quote_amount, tuple(body.symbols), tuple(body.amounts), tuple(sorted(body.balances.items())))
+    return tuple(getattr(body, f) for f in _SIG_FIELDS)
+
+async def _single_flight(ctx: Context, key: Tuple[str, Hashable], factory):
+    """Run factory() once per key; concurrent callers with the same key await the same task."""
+    task = _INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        _INFLIGHT[key] = task
+        task.add_done_callback(lambda t: _INFLIGHT.pop(key, None) if _INFLIGHT.get(key) is t else None)
+    else:
+        ctx.logger.info(f"↩︎ Joining in-flight {key[0]} request")
+        M_JOINS.inc(kind=key[0])
+    # shield: a cancelled caller must not cancel the shared task
+    return await asyncio.shield(task)
+
+async def _fetch_reply(ctx: Context, body: AnyRebalanceRequest) -> Optional[Dict[str, Any]]:
+    return await _single_flight(ctx, ("reply", _request_sig(body)), lambda: _send_and_wait(ctx, body))
+
+# ─────────────────────────────────────────────────────────────
+# Preview cache keyed by (balances, upstream snapshot)
+# ─────────────────────────────────────────────────────────────
+PREVIEW_CACHE = PreviewCache(max_entries=PREVIEW_CACHE_MAX, ttl_sec=PREVIEW_CACHE_TTL_SEC)
+_SNAPSHOT_SIG: Optional[str] = None   # market part of the most recent balancer reply
+
+def _snapshot_sig(raw: Dict[str, Any]) -> str:
+    # wallet-independent part of a reply: target weights + reasoner rationale
+    plan = raw.get("plan") or {}
+    market = {
+        "ok": raw.get("ok"),
+        "target_weights": plan.get("target_weights") or {},
+        "rationale": raw.get("error") or raw.get("diagnostics_json"),
+    }
+    return hashlib.sha1(json.dumps(market, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _balances_sig(balances: Dict[str, float]) -> Tuple:
+    # balance vector rounded to cents, in a stable coin order; hashable as-is
+    return tuple(sorted((k, round(float(v), 2)) for k, v in balances.items()))
 
 def _to_current_alloc(balances: Dict[str, float]) -> Dict[str, float]:
     total = sum(balances.values()) or 1.0
     return {k: round(v / total, 4) for k, v in balances.items()}
 
-def load_users() -> Dict[str, Any]:
-    if USERS_DB_PATH.exists():
-        try:
-            return json.loads(USERS_DB_PATH.read_text())
-        except Exception:
-            pass
-    return {"seq": 0, "users": {}}
+USERS = UserStore(USERS_DB_PATH)
+USERS.on_timing = lambda op, sec: M_USER_DB.observe(sec, op=op)
+SUMMARIES = SummaryScheduler()   # uid -> next_summary_at, rebuilt from USERS on startup
+
+def _schedule_summary(uid: int, next_summary_at: Optional[str]):
+    nxt = as_utc(next_summary_at)
+    if nxt is None:
+        SUMMARIES.unschedule(uid)
+    else:
+        SUMMARIES.schedule(uid, nxt.timestamp())
+
+def _rebuild_summary_schedule() -> int:
+    SUMMARIES.clear()
+    for uid, u in USERS.active_users():
+        _schedule_summary(uid, u.get("next_summary_at"))
+    return len(SUMMARIES)
 
-def save_users(db: Dict[str, Any]):
-    tmp = USERS_DB_PATH.with_suffix(".tmp")
-    tmp.write_text(json.dumps(db, indent=2))
-    tmp.replace(USERS_DB_PATH)
+def _next_summary_target(hour: int):
+    import datetime as _dt
+    now = now_utc_dt()
+    target = now.replace(hour=int(hour), minute=0, second=0, microsecond=0)
+    if target <= now:
+        target += _dt.timedelta(days=1)
+    return target
 
-def next_user_id(db: Dict[str, Any]) -> int:
-    db["seq"] += 1
-    return db["seq"]
+def tg_enqueue(ctx: Context, chat_id, text: str, tag: str):
+    """Queue a Telegram message without waiting; failures are logged when they happen."""
+    def _log_failure(f: asyncio.Future):
+        if not f.cancelled() and f.exception() is not None:
+            ctx.logger.warning(f"[{tag}] telegram send failed chat {chat_id}: {f.exception()}")
+    TG.enqueue(chat_id, text).add_done_callback(_log_failure)
 
 def fmt_rebalance_msg(plan_like: Dict[str, Any], rationale: Optional[str]) -> str:
     base = plan_like.get("base", "USDC")
@@ -236,6 +516,28 @@ def fmt_rebalance_msg(plan_like: Dict[str, Any], rationale: Optional[str]) -> st
         parts += ["", f"<b>Rationale:</b> {rationale}"]
     return "\n".join(parts)
 
+def fmt_patch_msg(plan_like: Dict[str, Any], rationale: Optional[str]) -> str:
+    """Only what changed since the last plan we sent (plan_like["patch"], see swapPlanner.replan)."""
+    patch = plan_like.get("patch") or {}
+    via = lambda x: f" via {x['venue']}" if x.get("venue") else ""
+
+    def legs(L, fmt):
+        return "\n".join([fmt(x) for x in L]) or "• (none)"
+
+    parts = [
+        "🔁 <b>Rebalance Update</b>",
+        f"<b>Routing base:</b> {plan_like.get('base', 'USDC')}",
+        "", "<b>Resized:</b>",
+        legs(patch.get("resized", []), lambda x: f"• {x['src']} → {x['dst']}{via(x)}: {x['previous_amount']} → {x['amount']}"),
+        "", "<b>New legs:</b>", legs(patch.get("added", []), lambda x: f"• {x['src']} → {x['dst']}{via(x)}: {x['amount']}"),
+        "", "<b>Dropped legs:</b>", legs(patch.get("removed", []), lambda x: f"• {x['src']} → {x['dst']}{via(x)}: {x['amount']}"),
+        "", f"<i>{patch.get('unchanged', 0)} leg(s) unchanged.</i>",
+        f"<b>Shortfall:</b> {plan_like.get('shortfall', 0)}",
+    ]
+    if rationale:
+        parts += ["", f"<b>Rationale:</b> {rationale}"]
+    return "\n".join(parts)
+
 def fmt_summary_msg(current: Dict[str, float], suggested: Dict[str, float]) -> str:
     lines = ["📊 <b>Daily Summary</b>", "", "<b>Current Allocation</b>"]
     lines += [f"• {k}: {v:.2%}" for k, v in current.items()]
@@ -279,10 +581,29 @@ async def on_start(ctx: Context):
     ctx.logger.info(f"[{AGENT_NAME}] Address: {agent.address}")
     ctx.logger.info(f"Balancer Target: {BALANCER_AGENT_ADDRESS or '<unset>'}")
     ctx.logger.info(f"Mailbox Enabled: {USE_MAILBOX}")
+    PERSIST.logger = ctx.logger
     ctx.logger.info(f"Raw Cache: {CACHE_PATH}")
     ctx.logger.info(f"Preview Cache: {PREVIEW_CACHE_PATH}")
     ctx.logger.info(f"Users DB: {USERS_DB_PATH}")
-    _ = load_users()
+    migrated = USERS.migrate_from_json(USERS_JSON_PATH)
+    if migrated:
+        ctx.logger.info(f"Migrated {migrated} users from {USERS_JSON_PATH}")
+    ctx.logger.info(f"Summary schedule: {_rebuild_summary_schedule()} users")
+    global _SUMMARY_TASK, _AGENT_CTX
+    _SUMMARY_TASK = asyncio.ensure_future(_summary_loop(ctx))
+    _AGENT_CTX = ctx
+    if SIDE_HTTP_PORT:
+        SIDE.logger = ctx.logger
+        try:
+            await SIDE.start()
+            # a second port: on a single-port deployment these are unreachable unless it's exposed too
+            ctx.logger.info(f"SSE /rebalance/preview/stream and GET /metrics are on port {SIDE_HTTP_PORT}, "
+                            f"not the REST port {PORT}; expose both (SIDE_HTTP_PORT=0 disables)")
+        except OSError as e:
+            ctx.logger.warning(f"Side HTTP server not started on :{SIDE_HTTP_PORT}: {e} — "
+                               f"SSE /rebalance/preview/stream and /metrics are unavailable")
+    else:
+        ctx.logger.info("SIDE_HTTP_PORT=0: SSE /rebalance/preview/stream and /metrics are disabled")
 
 @agent.on_message(model=RebalanceCheckResponse)
 async def on_reply(ctx: Context, sender: str, msg: RebalanceCheckResponse):
@@ -292,8 +613,12 @@ async def on_reply(ctx: Context, sender: str, msg: RebalanceCheckResponse):
         "plan": msg.plan.dict() if msg.plan else None,
         "diagnostics_json": msg.diagnostics_json,
     }
+    global _SNAPSHOT_SIG
     _save_latest(ctx, data)
+    _SNAPSHOT_SIG = _snapshot_sig(data)
     ctx.logger.info("✅ Cached latest rebalance reply")
+    if not _resolve_reply(str(ctx.session), data):
+        ctx.logger.warning(f"Dropped reply on unknown or expired session={ctx.session}")
 
 # ─────────────────────────────────────────────────────────────
 # EXISTING: raw rebalance proxy & cache
@@ -303,37 +628,26 @@ async def rebalance(ctx: Context, body: RebalanceCheckRequest) -> RebalanceCheck
     if not BALANCER_AGENT_ADDRESS.startswith("agent1q"):
         return RebalanceCheckResponse(ok=False, error="Balancer address not set")
 
-    # idempotency guard (duplicate within 600ms)
-    body_sig = hashlib.sha1(json.dumps(body.dict(), sort_keys=True).encode("utf-8")).hexdigest()
-    last_sig = ctx.storage.get("last_req_sig") or ""
-    last_ts = ctx.storage.get("last_req_ts") or 0.0
-    now_ts = _now()
-    duplicate = (body_sig == last_sig) and ((now_ts - float(last_ts)) < 0.6)
-
-    if duplicate:
-        ctx.logger.info("↩︎ Duplicate REST request detected within 600ms — not re-sending upstream")
-    else:
-        await ctx.send(BALANCER_AGENT_ADDRESS, body)
-        ctx.storage.set("last_req_sig", body_sig)
-        ctx.storage.set("last_req_ts", now_ts)
-        ctx.logger.info("→ Sent request to balancer")
-
-    start = _now()
-    last = ctx.storage.get("latest_ts") or 0.0
-
-    while _now() - start < DEFAULT_TIMEOUT_SEC:
-        await asyncio.sleep(0.2)
-        ts = ctx.storage.get("latest_ts") or 0.0
-        if ts > last:
-            data = _get_latest(ctx)
-            return RebalanceCheckResponse(**data)
+    # identical concurrent requests share one upstream round-trip
+    data = await _fetch_reply(ctx, body)
+    if data is not None:
+        return RebalanceCheckResponse(**data)
 
     cached = _get_latest(ctx)
     if cached:
         ctx.logger.warning("⏱ Timeout — returning cached result")
+        M_FALLBACKS.inc(endpoint="rebalance")
         return RebalanceCheckResponse(**cached)
     return RebalanceCheckResponse(ok=False, error="Timeout waiting for balancer response")
 
+@agent.on_rest_post("/rebalance/compact", CompactRebalanceRequest, RebalanceCheckResponse)
+async def rebalance_compact(ctx: Context, body: CompactRebalanceRequest) -> RebalanceCheckResponse:
+    """/rebalance for any number of coins: {"symbols": [...], "amounts": [...]} or {"balances": {...}}."""
+    err = _compact_error(body)
+    if err:
+        return RebalanceCheckResponse(ok=False, error=err)
+    return await rebalance(ctx, body)
+
 @agent.on_rest_get("/rebalance/cached", RebalanceCheckResponse)
 async def cached(ctx: Context) -> RebalanceCheckResponse:
     data = _get_latest(ctx)
@@ -342,82 +656,218 @@ async def cached(ctx: Context) -> RebalanceCheckResponse:
 # ─────────────────────────────────────────────────────────────
 # NEW: preview (raw plan + computed swap_plan + helpful fields)
 # ─────────────────────────────────────────────────────────────
-async def _compute_preview_after_reply(ctx: Context, body: RebalanceCheckRequest) -> PreviewResponse:
-    # balances from body
-    balances = {}
-    for k, v in body.dict().items():
-        if k.endswith("_balance"):
-            balances[k.replace("_balance", "").upper()] = float(v)
-
-    # wait for fresh balancer reply (reused logic from /rebalance)
-    start = _now()
-    last = ctx.storage.get("latest_ts") or 0.0
-
-    while _now() - start < DEFAULT_TIMEOUT_SEC:
-        await asyncio.sleep(0.2)
-        ts = ctx.storage.get("latest_ts") or 0.0
-        if ts > last:
-            raw = _get_latest(ctx) or {}
-            if not raw.get("ok"):
-                return PreviewResponse(ok=False, error=raw.get("error") or "balancer not ok")
-
-            plan = raw.get("plan") or {}
-            deltas = plan.get("trade_deltas", {}) or {}
-            target_weights = plan.get("target_weights", {}) or {}
-
-            try:
-                swap_plan = build_swap_plan(
-                    balances=balances,
-                    deltas=deltas,
-                    base="USDC",
-                    wallet_base_available=0.0,
-                ).to_dict()
-            except Exception as e:
-                swap_plan = {"warnings": [f"swapPlanner error: {e}"]}
-
-            current_alloc = _to_current_alloc(balances)
-            rationale = raw.get("error") or raw.get("diagnostics_json")
-
-            out = {
-                "ok": True,
-                "current_allocation": current_alloc,
-                "suggested_allocation": target_weights,
-                "trade_deltas": deltas,
-                "swap_plan": swap_plan,
-                "rationale": rationale,
-                "error": None,
-            }
-            _save_preview(ctx, out)
-            return PreviewResponse(**out)
+# legacy schema: (field, SYMBOL) pairs resolved once, not per request
+_LEGACY_FIELDS = tuple(
+    (f, COINS.legacy_fields.get(f, f[: -len("_balance")].upper()))
+    for f in RebalanceCheckRequest.__fields__ if f.endswith("_balance")
+)
+_LEGACY_SYMBOLS = {sym: f for f, sym in _LEGACY_FIELDS}
+
+def _balances_from_request(body: AnyRebalanceRequest) -> Dict[str, float]:
+    if isinstance(body, CompactRebalanceRequest):
+        return COINS.parse_compact(body.symbols, body.amounts, body.balances)
+    return {sym: float(getattr(body, f)) for f, sym in _LEGACY_FIELDS}
+
+def _balances_from_user(balances_json: Dict[str, Any]) -> Dict[str, float]:
+    # stored as {SYMBOL: amount}; rows written before the registry hold Balances.dict() ("usdc_balance": ...)
+    return COINS.parse_balances(balances_json)
+
+def _legacy_unsent(balances: Dict[str, float]) -> List[str]:
+    """Held coins the legacy RebalanceCheckRequest has no field for (none when the balancer speaks compact)."""
+    if UPSTREAM_COMPACT:
+        return []
+    return sorted(c for c, v in balances.items() if v and c not in _LEGACY_SYMBOLS)
+
+def _legacy_unsent_msg(coins: List[str]) -> str:
+    return (f"{', '.join(coins)} can't be sent to the balancer in the legacy request format; "
+            f"set BALANCER_COMPACT_REQUESTS=true once it speaks CompactRebalanceRequest")
+
+def _compact_error(body: CompactRebalanceRequest) -> Optional[str]:
+    try:
+        balances = _balances_from_request(body)
+    except ValueError as e:
+        return str(e)
+    unknown = COINS.unknown(balances)
+    if unknown:
+        return f"unknown coin(s) {', '.join(unknown)}; add them to the coin registry"
+    unsent = _legacy_unsent(balances)
+    return _legacy_unsent_msg(unsent) if unsent else None
+
+def _request_from_balances(balances: Dict[str, float], quote_amount: float = 1000.0) -> AnyRebalanceRequest:
+    if UPSTREAM_COMPACT:
+        return CompactRebalanceRequest(balances=balances, quote_amount=float(quote_amount))
+    return RebalanceCheckRequest(
+        **{_LEGACY_SYMBOLS[c]: v for c, v in balances.items() if c in _LEGACY_SYMBOLS},
+        quote_amount=float(quote_amount),
+    )
+
+async def _fetch_market_snapshot(ctx: Context, portfolios: List[Dict[str, float]], quote_amount: float = 1000.0) -> Optional[Dict[str, Any]]:
+    """
+    Ask the balancer once for market target weights on behalf of many portfolios
+    (the request carries their aggregate). Returns the raw reply, or None on timeout.
+    """
+    aggregate: Dict[str, float] = {}
+    for bal in portfolios:
+        for c, v in bal.items():
+            aggregate[c] = aggregate.get(c, 0.0) + v
+    return await _fetch_reply(ctx, _request_from_balances(aggregate, quote_amount))
+
+def _deltas_from_targets(balances: Dict[str, float], target_weights: Dict[str, float]) -> Dict[str, float]:
+    # market targets are wallet-independent: delta = target weight * portfolio value - balance
+    total = sum(balances.values())
+    coins = sorted(set(balances) | set(target_weights))
+    return {c: round(float(target_weights.get(c, 0.0)) * total - float(balances.get(c, 0.0)), 2) for c in coins}
+
+def _plan_stage(balances: Dict[str, float], raw: Dict[str, Any], local_deltas: bool = False):
+    """(target_weights, trade_deltas) from a balancer reply."""
+    plan = raw.get("plan") or {}
+    target_weights = plan.get("target_weights", {}) or {}
+    deltas = plan.get("trade_deltas", {}) or {}
+    if local_deltas:
+        deltas = _deltas_from_targets(balances, target_weights)
+    return target_weights, deltas
+
+def _swap_plan_for(
+    balances: Dict[str, float], deltas: Dict[str, float], prev_plan: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Swap plan dict for (balances, deltas). With prev_plan (a stored swap plan dict) it is
+    replanned incrementally and carries "patch": the legs added / removed / resized since.
+    """
+    opts = dict(
+        base=SWAP_BASES[0],
+        wallet_base_available=0.0,
+        mode=SWAP_PLAN_MODE,
+        cost_model=SWAP_COST,
+        liquidity=SWAP_LIQUIDITY,
+        slippage_bps=SWAP_SLIPPAGE_BPS,
+        bases=SWAP_BASES if len(SWAP_BASES) > 1 else None,
+        dust=SWAP_DUST,
+    )
+    try:
+        if prev_plan:
+            with M_SWAP_PLAN.time(mode="replan"):
+                patch = replan(SwapPlan.from_dict(prev_plan), balances, deltas, **opts)
+            M_REPLAN.inc(result="rebuilt" if patch.rebuilt else "unchanged" if patch.empty else "patched")
+            return {**patch.plan.to_dict(), "patch": patch.to_dict()}
+        with M_SWAP_PLAN.time(mode="single"):
+            return build_swap_plan(balances=balances, deltas=deltas, **opts).to_dict()
+    except Exception as e:
+        return {"warnings": [f"swapPlanner error: {e}"]}
+
+def _preview_dict(
+    balances: Dict[str, float], raw: Dict[str, Any], target_weights: Dict[str, float],
+    deltas: Dict[str, float], swap_plan: Dict[str, Any],
+) -> Dict[str, Any]:
+    """The ok=True preview shape shared by /rebalance/preview, /rebalance/batch and the SSE stream."""
+    unsent = _legacy_unsent(balances)
+    if unsent:
+        # stored/on-chain balances can hold registry coins the balancer never saw: say so on the plan
+        swap_plan = {**swap_plan, "warnings": [*swap_plan.get("warnings", []),
+                                               f"Not priced by the balancer: {_legacy_unsent_msg(unsent)}."]}
+    return {
+        "ok": True,
+        "current_allocation": _to_current_alloc(balances),
+        "suggested_allocation": target_weights,
+        "trade_deltas": deltas,
+        "swap_plan": swap_plan,
+        "rationale": raw.get("error") or raw.get("diagnostics_json"),
+        "error": None,
+    }
+
+def _build_preview(
+    balances: Dict[str, float], raw: Dict[str, Any], local_deltas: bool = False,
+    prev_plan: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Combine a balancer reply with `balances` into a preview dict.
+    local_deltas=True re-derives trade_deltas from the reply's target weights
+    (for replies fetched on behalf of a different portfolio).
+    prev_plan: the swap plan last sent to this wallet; the new one is a patch on it.
+    """
+    if not raw.get("ok"):
+        return {"ok": False, "error": raw.get("error") or "balancer not ok"}
+
+    target_weights, deltas = _plan_stage(balances, raw, local_deltas)
+    return _preview_dict(balances, raw, target_weights, deltas, _swap_plan_for(balances, deltas, prev_plan))
+
+def _build_previews_batch(all_balances: List[Dict[str, float]], raw: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """_build_preview(..., local_deltas=True) for many portfolios, swap plans in one vectorized pass."""
+    if not raw.get("ok"):
+        return [_build_preview(bal, raw, local_deltas=True) for bal in all_balances]
+    target_weights = (raw.get("plan") or {}).get("target_weights", {}) or {}
+    all_deltas = [_deltas_from_targets(bal, target_weights) for bal in all_balances]
+    coins = sorted(set(target_weights).union(*all_balances))
+    balances_matrix = [[bal.get(c, 0.0) for c in coins] for bal in all_balances]
+    deltas_matrix = [[d.get(c, 0.0) for c in coins] for d in all_deltas]
+    try:
+        with M_SWAP_PLAN.time(mode="batch"):
+            # one vectorized pass per candidate base; choose_base() picks per portfolio
+            batches = [build_swap_plans_batch(balances_matrix, deltas_matrix, coins, base=b,
+                                              dust=SWAP_DUST, cost_model=SWAP_COST)
+                       for b in SWAP_BASES]
+    except ImportError:
+        return [_build_preview(bal, raw, local_deltas=True) for bal in all_balances]
+    opts = dict(mode=SWAP_PLAN_MODE, cost_model=SWAP_COST, liquidity=SWAP_LIQUIDITY, slippage_bps=SWAP_SLIPPAGE_BPS)
+
+    def plan_dict(i: int) -> Dict[str, Any]:
+        if len(batches) == 1:
+            return batches[0].to_dict(i, **opts)
+        return choose_base([b.plan(i, **opts) for b in batches], preferred=SWAP_BASES[0]).to_dict()
+
+    return [
+        _preview_dict(bal, raw, target_weights, deltas, plan_dict(i))
+        for i, (bal, deltas) in enumerate(zip(all_balances, all_deltas))
+    ]
+
+def _remember_preview(ctx: Context, balances: Dict[str, float], raw: Dict[str, Any], out: Dict[str, Any]) -> PreviewResponse:
+    preview = PreviewResponse(**out)
+    if out["ok"]:
+        _save_preview(ctx, out)
+        PREVIEW_CACHE.put((_balances_sig(balances), _snapshot_sig(raw)), preview)
+    return preview
+
+async def _compute_preview(ctx: Context, body: AnyRebalanceRequest) -> PreviewResponse:
+    balances = _balances_from_request(body)
+
+    # wait for this request's own balancer reply (see _send_and_wait)
+    started = time.perf_counter()
+    raw = await _fetch_reply(ctx, body)
+    if raw is not None:
+        preview = _remember_preview(ctx, balances, raw, _build_preview(balances, raw))
+        M_PREVIEW.observe(time.perf_counter() - started)
+        return preview
 
     cached = _get_preview(ctx)
     if cached:
         ctx.logger.warning("⏱ Timeout — returning cached PREVIEW")
+        M_FALLBACKS.inc(endpoint="preview")
         return PreviewResponse(**cached)
     return PreviewResponse(ok=False, error="Timeout waiting for balancer response")
 
+async def _compute_preview_after_reply(ctx: Context, body: AnyRebalanceRequest) -> PreviewResponse:
+    # same balances against the current upstream snapshot -> answer from cache
+    if _SNAPSHOT_SIG:
+        hit = PREVIEW_CACHE.get((_balances_sig(_balances_from_request(body)), _SNAPSHOT_SIG))
+        M_CACHE.inc(result="miss" if hit is None else "hit")
+        if hit is not None:
+            return hit
+    # identical concurrent previews (dashboard, alert loop) share one reply + one build_swap_plan
+    return await _single_flight(ctx, ("preview", _request_sig(body)), lambda: _compute_preview(ctx, body))
+
 @agent.on_rest_post("/rebalance/preview", RebalanceCheckRequest, PreviewResponse)
 async def rebalance_preview(ctx: Context, body: RebalanceCheckRequest) -> PreviewResponse:
     if not BALANCER_AGENT_ADDRESS.startswith("agent1q"):
         return PreviewResponse(ok=False, error="Balancer address not set")
-
-    # forward (with duplicate guard)
-    body_sig = hashlib.sha1(json.dumps(body.dict(), sort_keys=True).encode("utf-8")).hexdigest()
-    last_sig = ctx.storage.get("last_req_sig_prev") or ""
-    last_ts = ctx.storage.get("last_req_ts_prev") or 0.0
-    now_ts = _now()
-    duplicate = (body_sig == last_sig) and ((now_ts - float(last_ts)) < 0.6)
-
-    if duplicate:
-        ctx.logger.info("↩︎ Duplicate PREVIEW request within 600ms — not re-sending upstream")
-    else:
-        await ctx.send(BALANCER_AGENT_ADDRESS, body)
-        ctx.storage.set("last_req_sig_prev", body_sig)
-        ctx.storage.set("last_req_ts_prev", now_ts)
-        ctx.logger.info("→ Sent PREVIEW request to balancer")
-
     return await _compute_preview_after_reply(ctx, body)
 
+@agent.on_rest_post("/rebalance/preview/compact", CompactRebalanceRequest, PreviewResponse)
+async def rebalance_preview_compact(ctx: Context, body: CompactRebalanceRequest) -> PreviewResponse:
+    err = _compact_error(body)
+    if err:
+        return PreviewResponse(ok=False, error=err)
+    return await rebalance_preview(ctx, body)
+
 @agent.on_rest_get("/rebalance/preview/cached", PreviewResponse)
 async def rebalance_preview_cached(ctx: Context) -> PreviewResponse:
     data = _get_preview(ctx)
@@ -425,132 +875,263 @@ async def rebalance_preview_cached(ctx: Context) -> PreviewResponse:
         return PreviewResponse(ok=False, error="No preview cached")
     return PreviewResponse(**data)
 
+@agent.on_rest_post("/rebalance/bundle", BundleRequest, BundleResp)
+async def rebalance_bundle(ctx: Context, body: BundleRequest) -> BundleResp:
+    """A swap plan as one batched transaction (approvals + router swaps); no chain access."""
+    router = (body.router or SWAP_ROUTER_ADDRESS).strip()
+    if not router:
+        return BundleResp(ok=False, error="router not set (body.router or SWAP_ROUTER_ADDRESS)")
+    try:
+        plan = SwapPlan.from_dict(body.swap_plan)
+        return BundleResp(ok=True, bundle=encode_plan(plan, body.account, router, slippage_bps=SWAP_SLIPPAGE_BPS).to_dict())
+    except (KeyError, ValueError, TypeError, ImportError) as e:
+        return BundleResp(ok=False, error=f"cannot bundle swap plan: {e}")
+
+# ─────────────────────────────────────────────────────────────
+# Streaming preview (SSE on the side server): stages go out as they complete
+#   allocation -> plan -> swap_plan -> rationale -> done
+# ─────────────────────────────────────────────────────────────
+SIDE = SideServer(port=SIDE_HTTP_PORT)
+_AGENT_CTX: Optional[Context] = None   # startup context, used by side-server handlers to reach the balancer
+
+def _preview_stages(out: Dict[str, Any], **extra):
+    yield "plan", {"suggested_allocation": out.get("suggested_allocation", {}), "trade_deltas": out.get("trade_deltas", {}), **extra}
+    yield "swap_plan", {"swap_plan": out.get("swap_plan", {}), **extra}
+    yield "rationale", {"rationale": out.get("rationale"), **extra}
+    yield "done", {**out, **extra}
+
+async def _stream_preview(body_json: Dict[str, Any]):
+    try:
+        compact = any(k in body_json for k in ("symbols", "balances"))
+        body = (CompactRebalanceRequest if compact else RebalanceCheckRequest).parse_obj(body_json)
+        err = _compact_error(body) if compact else None
+        if err:
+            raise ValueError(err)
+    except Exception as e:
+        yield "error", {"ok": False, "error": f"invalid request: {e}"}
+        return
+    ctx = _AGENT_CTX
+    balances = _balances_from_request(body)
+    yield "allocation", {"current_allocation": _to_current_alloc(balances)}
+
+    if ctx is None or not BALANCER_AGENT_ADDRESS.startswith("agent1q"):
+        yield "error", {"ok": False, "error": "Balancer address not set"}
+        return
+
+    hit = PREVIEW_CACHE.get((_balances_sig(balances), _SNAPSHOT_SIG)) if _SNAPSHOT_SIG else None
+    if _SNAPSHOT_SIG:
+        M_CACHE.inc(result="miss" if hit is None else "hit")
+    if hit is not None:
+        for stage in _preview_stages(hit.dict()):
+            yield stage
+        return
+
+    # wait for the balancer, keeping the connection warm through proxies
+    started = time.perf_counter()
+    fetch = asyncio.ensure_future(_fetch_reply(ctx, body))
+    try:
+        while not fetch.done():
+            done, _ = await asyncio.wait({fetch}, timeout=STREAM_KEEPALIVE_SEC)
+            if not done:
+                yield None, None
+        raw = fetch.result()
+    finally:
+        if not fetch.done():
+            fetch.cancel()   # client disconnected; single-flight keeps other waiters' shared task alive
+
+    if raw is None:
+        cached = _get_preview(ctx)
+        if cached:
+            ctx.logger.warning("⏱ Timeout — streaming cached PREVIEW")
+            M_FALLBACKS.inc(endpoint="preview_stream")
+            for stage in _preview_stages(cached, cached=True):
+                yield stage
+        else:
+            yield "error", {"ok": False, "error": "Timeout waiting for balancer response"}
+        return
+    if not raw.get("ok"):
+        yield "error", {"ok": False, "error": raw.get("error") or "balancer not ok"}
+        return
+
+    target_weights, deltas = _plan_stage(balances, raw)
+    yield "plan", {"suggested_allocation": target_weights, "trade_deltas": deltas}
+    out = _preview_dict(balances, raw, target_weights, deltas, _swap_plan_for(balances, deltas))
+    yield "swap_plan", {"swap_plan": out["swap_plan"]}
+    yield "rationale", {"rationale": out["rationale"]}
+    _remember_preview(ctx, balances, raw, out)
+    M_PREVIEW.observe(time.perf_counter() - started)
+    yield "done", out
+
+SIDE.sse_post("/rebalance/preview/stream", _stream_preview)
+
+SIDE.text_get("/metrics", REGISTRY.render, METRICS_CONTENT_TYPE)
+
+@agent.on_rest_post("/rebalance/batch", BatchRequest, BatchResponse)
+async def rebalance_batch(ctx: Context, body: BatchRequest) -> BatchResponse:
+    """
+    Preview many portfolios with one upstream round-trip: the balancer is asked once
+    (for the aggregate portfolio) for market target weights, then deltas and swap
+    plans are derived locally per portfolio.
+    """
+    if not BALANCER_AGENT_ADDRESS.startswith("agent1q"):
+        return BatchResponse(ok=False, error="Balancer address not set")
+    n = len(body.requests) + len(body.portfolios) + len(body.rows)
+    if not n:
+        return BatchResponse(ok=True, results=[])
+    if n > BATCH_MAX_PORTFOLIOS:
+        return BatchResponse(ok=False, error=f"at most {BATCH_MAX_PORTFOLIOS} portfolios per batch")
+    if any(len(r) != len(body.symbols) for r in body.rows):
+        return BatchResponse(ok=False, error=f"every row needs {len(body.symbols)} amounts (one per symbol)")
+    compact = body.portfolios + [CompactRebalanceRequest(symbols=body.symbols, amounts=r) for r in body.rows]
+    for r in compact:
+        err = _compact_error(r)
+        if err:
+            return BatchResponse(ok=False, error=err)
+
+    # results come back in order: requests, then portfolios, then rows
+    all_balances = [_balances_from_request(r) for r in body.requests] + [_balances_from_request(r) for r in compact]
+    quote = body.requests[0].quote_amount if body.requests else body.quote_amount
+    raw = await _fetch_market_snapshot(ctx, all_balances, quote)
+    if raw is None:
+        return BatchResponse(ok=False, error="Timeout waiting for balancer response")
+    if not raw.get("ok"):
+        return BatchResponse(ok=False, error=raw.get("error") or "balancer not ok")
+
+    snap = _snapshot_sig(raw)
+    results: List[PreviewResponse] = []
+    for bal, out in zip(all_balances, _build_previews_batch(all_balances, raw)):
+        preview = PreviewResponse(**out)
+        PREVIEW_CACHE.put((_balances_sig(bal), snap), preview)
+        results.append(preview)
+    return BatchResponse(ok=True, results=results)
+
+@agent.on_rest_get("/rebalance/preview/cache/stats", CacheStatsResp)
+async def rebalance_preview_cache_stats(ctx: Context) -> CacheStatsResp:
+    return CacheStatsResp(ok=True, snapshot=_SNAPSHOT_SIG, **PREVIEW_CACHE.stats())
+
 # ─────────────────────────────────────────────────────────────
 # Vacation: REST (body style)
 # ─────────────────────────────────────────────────────────────
 @agent.on_rest_post("/users/onboard", Onboard, OnboardResp)
 async def rest_onboard(ctx: Context, body: Onboard) -> OnboardResp:
-    db = load_users()
-    # dedupe by wallet
-    for uid, u in db["users"].items():
-        if u["wallet_address"].lower() == body.wallet_address.lower():
-            u["telegram_chat_id"] = body.telegram_chat_id
-            if body.nickname:
-                u["nickname"] = body.nickname
-            save_users(db)
-            return OnboardResp(ok=True, user_id=int(uid))
-    uid = next_user_id(db)
-    db["users"][str(uid)] = {
-        "wallet_address": body.wallet_address,
-        "telegram_chat_id": body.telegram_chat_id,
-        "nickname": body.nickname or "",
-        "is_active": False,
-        "daily_summary_hour_utc": 9,
-        "alert_threshold": DEFAULT_ALERT_THRESHOLD,
-        "next_summary_at": None,
-        "last_alert_at": None,
-        "balances_json": None,
-        "last_plan_json": None,
-        "last_rationale": None,
-        "last_regime": None,
-    }
-    save_users(db)
+    # dedupe by wallet (unique index on lowercase address)
+    found = USERS.find_by_wallet(body.wallet_address)
+    if found:
+        uid, _ = found
+        updates = {"telegram_chat_id": body.telegram_chat_id}
+        if body.nickname:
+            updates["nickname"] = body.nickname
+        USERS.update(uid, **updates)
+        return OnboardResp(ok=True, user_id=uid)
+    try:
+        uid = USERS.create({
+            "wallet_address": body.wallet_address,
+            "telegram_chat_id": body.telegram_chat_id,
+            "nickname": body.nickname or "",
+            "is_active": False,
+            "daily_summary_hour_utc": 9,
+            "alert_threshold": DEFAULT_ALERT_THRESHOLD,
+            "next_summary_at": None,
+            "last_alert_at": None,
+            "balances_json": None,
+            "last_plan_json": None,
+            "last_rationale": None,
+            "last_regime": None,
+        })
+    except sqlite3.IntegrityError:
+        # lost a race with a concurrent onboard for the same wallet
+        uid, _ = USERS.find_by_wallet(body.wallet_address)
+        USERS.update(uid, telegram_chat_id=body.telegram_chat_id)
     return OnboardResp(ok=True, user_id=uid)
 
 @agent.on_rest_post("/users/balances", BalancesWithId, OkResp)
 async def rest_balances(ctx: Context, body: BalancesWithId) -> OkResp:
-    db = load_users()
-    u = db["users"].get(str(body.user_id))
-    if not u:
+    try:
+        balances = COINS.parse_balances(body.dict())
+    except ValueError as e:
+        return OkResp(ok=False, error=str(e))
+    unknown = COINS.unknown(balances)
+    if unknown:
+        return OkResp(ok=False, error=f"unknown coin(s) {', '.join(unknown)}; add them to the coin registry")
+    if not USERS.update(body.user_id, balances_json={**balances, "quote_amount": body.quote_amount}):
         return OkResp(ok=False, error="user not found")
-    payload = body.dict()
-    payload.pop("user_id", None)
-    u["balances_json"] = payload
-    save_users(db)
     return OkResp(ok=True)
 
 @agent.on_rest_post("/users/prefs", PrefsBody, OkResp)
 async def prefs_body(ctx: Context, body: PrefsBody) -> OkResp:
-    db = load_users()
-    u = db["users"].get(str(body.user_id))
+    u = USERS.get(body.user_id)
     if not u:
         return OkResp(ok=False, error="user not found")
 
+    updates: Dict[str, Any] = {}
     if body.active is not None:
-        u["is_active"] = bool(body.active)
-        if u["is_active"] and not u.get("next_summary_at"):
-            now = now_utc_dt()
-            target = now.replace(hour=int(u["daily_summary_hour_utc"]), minute=0, second=0, microsecond=0)
-            if target <= now:
-                import datetime as _dt
-                target += _dt.timedelta(days=1)
-            u["next_summary_at"] = iso(target)
+        updates["is_active"] = bool(body.active)
+        if updates["is_active"] and not u.get("next_summary_at"):
+            updates["next_summary_at"] = iso(_next_summary_target(u["daily_summary_hour_utc"]))
 
     if body.alert_threshold:
         if body.alert_threshold not in ("RED", "YELLOW", "GREEN"):
             return OkResp(ok=False, error="alert_threshold must be RED|YELLOW|GREEN")
-        u["alert_threshold"] = body.alert_threshold
+        updates["alert_threshold"] = body.alert_threshold
 
     if body.daily_summary_hour_utc is not None:
         hour = int(body.daily_summary_hour_utc)
         if not (0 <= hour <= 23):
             return OkResp(ok=False, error="daily_summary_hour_utc must be 0..23")
-        u["daily_summary_hour_utc"] = hour
-        now = now_utc_dt()
-        target = now.replace(hour=hour, minute=0, second=0, microsecond=0)
-        if target <= now:
-            import datetime as _dt
-            target += _dt.timedelta(days=1)
-        u["next_summary_at"] = iso(target)
-
-    save_users(db)
+        updates["daily_summary_hour_utc"] = hour
+        updates["next_summary_at"] = iso(_next_summary_target(hour))
+
+    band = dict(u.get("drift_band_json") or {})
+    for key in ("abs_bps", "rel", "turnover_bps"):
+        val = getattr(body, f"band_{key}")
+        if val is None:
+            continue
+        if val < 0:
+            return OkResp(ok=False, error=f"band_{key} must be >= 0")
+        band[key] = float(val)
+    if band != (u.get("drift_band_json") or {}):
+        updates["drift_band_json"] = band
+
+    USERS.update(body.user_id, **updates)
+    if updates.get("is_active", u["is_active"]):
+        _schedule_summary(body.user_id, updates.get("next_summary_at", u.get("next_summary_at")))
+    else:
+        SUMMARIES.unschedule(body.user_id)
     return OkResp(ok=True)
 
 @agent.on_rest_post("/users/vacation/start", StartStopBody, OkResp)
 async def vacation_start(ctx: Context, body: StartStopBody) -> OkResp:
-    db = load_users()
-    u = db["users"].get(str(body.user_id))
+    u = USERS.get(body.user_id)
     if not u:
         return OkResp(ok=False, error="user not found")
-    u["is_active"] = True
-    now = now_utc_dt()
-    target = now.replace(hour=int(u["daily_summary_hour_utc"]), minute=0, second=0, microsecond=0)
-    if target <= now:
-        import datetime as _dt
-        target += _dt.timedelta(days=1)
-    u["next_summary_at"] = iso(target)
-    save_users(db)
+    next_summary_at = iso(_next_summary_target(u["daily_summary_hour_utc"]))
+    USERS.update(body.user_id, is_active=True, next_summary_at=next_summary_at)
+    _schedule_summary(body.user_id, next_summary_at)
     return OkResp(ok=True)
 
 @agent.on_rest_post("/users/vacation/stop", StartStopBody, OkResp)
 async def vacation_stop(ctx: Context, body: StartStopBody) -> OkResp:
-    db = load_users()
-    u = db["users"].get(str(body.user_id))
-    if not u:
+    if not USERS.update(body.user_id, is_active=False):
         return OkResp(ok=False, error="user not found")
-    u["is_active"] = False
-    save_users(db)
+    SUMMARIES.unschedule(body.user_id)
     return OkResp(ok=True)
 
 @agent.on_rest_post("/users/notify/alert", NotifyBody, OkResp)
 async def notify_alert(ctx: Context, body: NotifyBody) -> OkResp:
-    db = load_users()
-    u = db["users"].get(str(body.user_id))
+    u = USERS.get(body.user_id)
     if not u:
         return OkResp(ok=False, error="user not found")
     if not u.get("balances_json"):
         return OkResp(ok=False, error="balances not set")
 
     # build a RebalanceCheckRequest from user's balances
-    req = RebalanceCheckRequest(**{f"{k.lower()}_balance": v for k, v in u["balances_json"].items() if k != "quote_amount"},
-                                quote_amount=float(u["balances_json"].get("quote_amount", 1000.0)))
+    req = _request_from_balances(_balances_from_user(u["balances_json"]),
+                                 u["balances_json"].get("quote_amount", 1000.0))
 
-    # send request
     if not BALANCER_AGENT_ADDRESS.startswith("agent1q"):
         return OkResp(ok=False, error="Balancer address not set")
-    await ctx.send(BALANCER_AGENT_ADDRESS, req)
 
-    # compute preview (includes swap legs)
+    # send request + compute preview (includes swap legs)
     preview = await _compute_preview_after_reply(ctx, req)
     if not preview.ok:
         return OkResp(ok=False, error=preview.error or "upstream not ok")
@@ -559,61 +1140,46 @@ async def notify_alert(ctx: Context, body: NotifyBody) -> OkResp:
         "target_weights": preview.suggested_allocation,
         "trade_deltas": preview.trade_deltas,
         "base": (preview.swap_plan or {}).get("base", "USDC"),
+        "planned_at": iso(now_utc_dt()),
+        "swap_plan": preview.swap_plan or None,   # last plan sent; the alert loop patches against it
     }
     rationale = preview.rationale or ""
 
     if bot:
         try:
-            await bot.send_message(
-                chat_id=u["telegram_chat_id"],
-                text=fmt_rebalance_msg(preview.swap_plan or {}, rationale),
-                parse_mode="HTML",
-                disable_web_page_preview=True,
-            )
+            await TG.send(u["telegram_chat_id"], fmt_rebalance_msg(preview.swap_plan or {}, rationale))
         except Exception as e:
             return OkResp(ok=False, error=f"telegram send failed: {e}")
 
     # store snapshot for summaries
-    u["last_alert_at"]  = iso(now_utc_dt())
-    u["last_plan_json"] = plan_for_summary
-    u["last_rationale"] = rationale
-    u["last_regime"]    = parse_regime({"rationale": rationale})
-    save_users(db)
+    USERS.update(
+        body.user_id,
+        last_alert_at=iso(now_utc_dt()),
+        last_plan_json=plan_for_summary,
+        last_rationale=rationale,
+        last_regime=parse_regime({"rationale": rationale}),
+    )
     return OkResp(ok=True)
 
 @agent.on_rest_post("/users/notify/summary", NotifyBody, OkResp)
 async def notify_summary(ctx: Context, body: NotifyBody) -> OkResp:
-    db = load_users()
-    u = db["users"].get(str(body.user_id))
+    u = USERS.get(body.user_id)
     if not u:
         return OkResp(ok=False, error="user not found")
     if not (u.get("balances_json") and u.get("last_plan_json")):
         return OkResp(ok=False, error="need balances + at least one plan")
-    bal = u["balances_json"]
-    current = _to_current_alloc({
-        "USDC": bal.get("usdc_balance", 0.0), "USDT": bal.get("usdt_balance", 0.0),
-        "DAI": bal.get("dai_balance", 0.0), "FDUSD": bal.get("fdusd_balance", 0.0),
-        "BUSD": bal.get("busd_balance", 0.0), "TUSD": bal.get("tusd_balance", 0.0),
-        "USDP": bal.get("usdp_balance", 0.0), "PYUSD": bal.get("pyusd_balance", 0.0),
-        "USDD": bal.get("usdd_balance", 0.0), "GUSD": bal.get("gusd_balance", 0.0),
-    })
+    current = _to_current_alloc(_balances_from_user(u["balances_json"]))
     suggested = u["last_plan_json"].get("target_weights", {}) if isinstance(u["last_plan_json"], dict) else {}
     if bot:
         try:
-            await bot.send_message(
-                chat_id=u["telegram_chat_id"],
-                text=fmt_summary_msg(current, suggested),
-                parse_mode="HTML",
-                disable_web_page_preview=True,
-            )
+            await TG.send(u["telegram_chat_id"], fmt_summary_msg(current, suggested))
         except Exception as e:
             return OkResp(ok=False, error=f"telegram send failed: {e}")
     return OkResp(ok=True)
 
 @agent.on_rest_post("/users/status", StatusBody, StatusResp)
 async def status_body(ctx: Context, body: StatusBody) -> StatusResp:
-    db = load_users()
-    u = db["users"].get(str(body.user_id))
+    u = USERS.get(body.user_id)
     if not u:
         return StatusResp(ok=False, error="user not found")
     return StatusResp(
@@ -623,104 +1189,247 @@ async def status_body(ctx: Context, body: StatusBody) -> StatusResp:
         last_rationale=u.get("last_rationale"),
         last_plan=u.get("last_plan_json"),
         next_summary_at=u.get("next_summary_at"),
+        drift_band=_user_band(u).to_dict(),
+        last_drift=u.get("last_drift_json"),
     )
 
 # ─────────────────────────────────────────────────────────────
 # Background loops (alerts + daily summaries)
 # ─────────────────────────────────────────────────────────────
+def _user_band(u: Dict[str, Any]) -> DriftBand:
+    return DriftBand.from_prefs(u.get("drift_band_json"), DRIFT_BAND)
+
+def _band_check(u: Dict[str, Any]) -> Optional[DriftCheck]:
+    """Drift of the wallet vs its last plan's targets; None if there is no recent plan to hold to."""
+    plan = u.get("last_plan_json") if isinstance(u.get("last_plan_json"), dict) else {}
+    planned_at = as_utc(plan.get("planned_at"))
+    if not plan.get("target_weights") or planned_at is None:
+        return None
+    if (now_utc_dt() - planned_at).total_seconds() > DRIFT_BAND_MAX_AGE_SEC:
+        return None
+    return _user_band(u).check(_to_current_alloc(_balances_from_user(u["balances_json"])), plan["target_weights"])
+
+def _alert_check_user(ctx: Context, uid: int, u: Dict[str, Any], market: Dict[str, Any]):
+    try:
+        # plan locally against this cycle's market snapshot (no per-user upstream call),
+        # as a patch on the swap plan this user was last sent
+        last_plan = u.get("last_plan_json") if isinstance(u.get("last_plan_json"), dict) else {}
+        sent_plan = last_plan.get("swap_plan")
+        preview = PreviewResponse(**_build_preview(_balances_from_user(u["balances_json"]), market,
+                                                   local_deltas=True, prev_plan=sent_plan))
+        if not preview.ok:
+            return
+        swap_plan = dict(preview.swap_plan or {})
+        patch = swap_plan.pop("patch", None)
+
+        plan_for_summary = {
+            "target_weights": preview.suggested_allocation,
+            "trade_deltas": preview.trade_deltas,
+            "base": swap_plan.get("base", "USDC"),
+            "planned_at": iso(now_utc_dt()),
+            "swap_plan": sent_plan,
+        }
+        rationale = preview.rationale or ""
+        regime = parse_regime({"rationale": rationale})
+        drift = _user_band(u).check(_to_current_alloc(_balances_from_user(u["balances_json"])), preview.suggested_allocation)
+
+        updates: Dict[str, Any] = {
+            "last_plan_json": plan_for_summary,
+            "last_rationale": rationale,
+            "last_regime": regime,
+            "last_drift_json": drift.to_dict(),
+        }
+
+        order = {"GREEN": 0, "YELLOW": 1, "RED": 2, "UNKNOWN": 3}
+        send_if = order.get(regime, 3) >= order.get(u.get("alert_threshold", DEFAULT_ALERT_THRESHOLD), 2)
+
+        last = as_utc(u.get("last_alert_at"))
+        import datetime as _dt
+        ok_to_send = (last is None) or (now_utc_dt() - last > _dt.timedelta(hours=1))
+
+        # only suggest a trade once the wallet has drifted out of its band around the new targets,
+        # and only if the plan differs from the one already sent (then just the diff)
+        changed = patch is None or patch["rebuilt"] or not patch["empty"]
+        if send_if and ok_to_send and bot and not drift.inside and changed:
+            if patch is None or patch["rebuilt"]:
+                msg = fmt_rebalance_msg(swap_plan, rationale)
+            else:
+                msg = fmt_patch_msg(preview.swap_plan, rationale)
+            # enqueue and move on; stamp now so the next cycle doesn't re-alert while it's queued
+            tg_enqueue(ctx, u["telegram_chat_id"], msg, "alert")
+            updates["last_alert_at"] = iso(now_utc_dt())
+            plan_for_summary["swap_plan"] = swap_plan
+        USERS.update(uid, **updates)
+    except Exception as e:
+        ctx.logger.warning(f"[alert] uid={uid} error: {e}")
+
+_ALERT_CYCLE_RUNNING = False
+_ALERT_CURSOR: Optional[int] = None   # last uid planned; the next cycle starts after it
+
+def _rotate_after(users: List[Tuple[int, Dict[str, Any]]], cursor: Optional[int]) -> List[Tuple[int, Dict[str, Any]]]:
+    # uid order starting after `cursor`, wrapping around, so a deadline cut never starves the same tail
+    users = sorted(users, key=lambda x: x[0])
+    if cursor is None:
+        return users
+    i = next((k for k, (uid, _) in enumerate(users) if uid > cursor), 0)
+    return users[i:] + users[:i]
+
 @agent.on_interval(period=CHECK_INTERVAL_SEC)
 async def periodic_alert_check(ctx: Context):
-    db = load_users()
-    for uid, u in list(db["users"].items()):
-        try:
-            if not u.get("is_active") or not u.get("balances_json"):
-                continue
-
-            req = RebalanceCheckRequest(**{f"{k.lower()}_balance": v for k, v in u["balances_json"].items() if k != "quote_amount"},
-                                        quote_amount=float(u["balances_json"].get("quote_amount", 1000.0)))
+    global _ALERT_CYCLE_RUNNING, _ALERT_CURSOR
+    if _ALERT_CYCLE_RUNNING:
+        ctx.logger.warning("[alert] previous cycle still running — skipping this tick")
+        return
+    if not BALANCER_AGENT_ADDRESS.startswith("agent1q"):
+        return
 
-            if not BALANCER_AGENT_ADDRESS.startswith("agent1q"):
+    _ALERT_CYCLE_RUNNING = True
+    started = _now()
+    try:
+        users = []
+        within = 0
+        for uid, u in USERS.active_users():
+            if not u.get("balances_json"):
                 continue
-            await ctx.send(BALANCER_AGENT_ADDRESS, req)
-            preview = await _compute_preview_after_reply(ctx, req)
-            if not preview.ok:
+            # inside the no-trade band around the last plan: no upstream call, no swap planning
+            drift = _band_check(u)
+            M_BAND.inc(result="stale" if drift is None else "inside" if drift.inside else "outside")
+            if drift is not None and drift.inside:
+                within += 1
+                if (u.get("last_drift_json") or {}) != drift.to_dict():
+                    USERS.update(uid, last_drift_json=drift.to_dict())
                 continue
+            users.append((uid, u))
+        if not users:
+            if within:
+                ctx.logger.info(f"[alert] all {within} users within band — no replanning this cycle")
+            return
+        # one market snapshot per cycle; every user is planned from it locally
+        portfolios = [_balances_from_user(u["balances_json"]) for _, u in users]
+        unsent = sorted(set().union(*(_legacy_unsent(b) for b in portfolios)))
+        if unsent:
+            ctx.logger.warning(f"[alert] {_legacy_unsent_msg(unsent)}; plans will carry a warning")
+        market = await _fetch_market_snapshot(ctx, portfolios)
+        if market is None or not market.get("ok"):
+            ctx.logger.warning(f"[alert] no market snapshot this cycle: {(market or {}).get('error') or 'timeout'}")
+            return
+        # planning is local CPU work: run it in slices and yield between them so REST handlers
+        # aren't starved, and stop at the deadline; the next cycle resumes after the last user
+        # planned here, so users cut off by the deadline go first next time
+        step = max(1, ALERT_SLICE_SIZE)
+        deadline = started + ALERT_CYCLE_DEADLINE_SEC
+        users = _rotate_after(users, _ALERT_CURSOR)
+        done = 0
+        while done < len(users) and _now() < deadline:
+            for uid, u in users[done:done + step]:
+                _alert_check_user(ctx, uid, u, market)
+                _ALERT_CURSOR = uid
+            done = min(done + step, len(users))
+            await asyncio.sleep(0)
+        ctx.logger.info(
+            f"[alert] cycle took {_now() - started:.2f}s: processed={done} within_band={within} "
+            f"skipped={len(users) - done} (deadline {ALERT_CYCLE_DEADLINE_SEC:.0f}s, slice {step})"
+        )
+    finally:
+        _ALERT_CYCLE_RUNNING = False
+        M_CYCLE.observe(_now() - started, cycle="alert")
+
+BALANCES = BalanceFetcher(
+    JsonRpc(BALANCE_RPC_URL) if BALANCE_RPC_URL else None, COINS, MULTICALL3_ADDRESS,
+    chunk_wallets=BALANCE_CHUNK_WALLETS, chunks_per_request=BALANCE_CHUNKS_PER_REQUEST,
+)
+_BALANCES_BLOCK: Optional[int] = None   # last block read; nothing to do until the chain moves
+
+@agent.on_interval(period=BALANCE_POLL_SEC)
+async def periodic_balance_refresh(ctx: Context):
+    """Pull balanceOf for every active wallet, a chunk of wallets per multicall, before alerts use them."""
+    global _BALANCES_BLOCK
+    if BALANCES.rpc is None:
+        return
+    started = _now()
+    try:
+        block = await BALANCES.block_number()
+        if block == _BALANCES_BLOCK:
+            return
+        users = [(uid, u) for uid, u in USERS.active_users() if u.get("wallet_address")]
+        if not users:
+            return
+        stats = await refresh_users(USERS, BALANCES, users, COINS, block=block)
+        _BALANCES_BLOCK = block
+        M_BALANCE_RPC.inc(stats["http_requests"], kind="http")
+        M_BALANCE_RPC.inc(stats["eth_calls"], kind="eth_call")
+        M_BALANCE_RPC.inc(stats["failed_calls"], kind="failed_call")
+        ctx.logger.info(f"[balances] block {block}: {stats['fetched']}/{stats['wallets']} wallets read, "
+                        f"{stats['updated']} updated in {stats['http_requests']} requests")
+    except Exception as e:
+        ctx.logger.warning(f"[balances] refresh failed: {e}")
+    finally:
+        M_CYCLE.observe(_now() - started, cycle="balances")
 
-            plan_for_summary = {
-                "target_weights": preview.suggested_allocation,
-                "trade_deltas": preview.trade_deltas,
-                "base": (preview.swap_plan or {}).get("base", "USDC"),
-            }
-            rationale = preview.rationale or ""
-            regime = parse_regime({"rationale": rationale})
-
-            u["last_plan_json"] = plan_for_summary
-            u["last_rationale"] = rationale
-            u["last_regime"]    = regime
-
-            order = {"GREEN": 0, "YELLOW": 1, "RED": 2, "UNKNOWN": 3}
-            send_if = order.get(regime, 3) >= order.get(u.get("alert_threshold", DEFAULT_ALERT_THRESHOLD), 2)
-
-            last = as_utc(u.get("last_alert_at"))
-            import datetime as _dt
-            ok_to_send = (last is None) or (now_utc_dt() - last > _dt.timedelta(hours=1))
-
-            if send_if and ok_to_send and bot:
-                try:
-                    await bot.send_message(
-                        chat_id=u["telegram_chat_id"],
-                        text=fmt_rebalance_msg(preview.swap_plan or {}, rationale),
-                        parse_mode="HTML",
-                        disable_web_page_preview=True,
-                    )
-                    u["last_alert_at"] = iso(now_utc_dt())
-                except Exception as e:
-                    ctx.logger.warning(f"[alert] telegram send failed user {uid}: {e}")
-        except Exception as e:
-            ctx.logger.warning(f"[alert] uid={uid} error: {e}")
-    save_users(db)
-
-@agent.on_interval(period=SUMMARY_TICK_SEC)
 async def periodic_summary_check(ctx: Context):
-    db = load_users()
+    """Send summaries for the users the scheduler says are due (no full-table scan)."""
     now = now_utc_dt()
+    due = SUMMARIES.pop_due(now.timestamp())
+    if not due:
+        return
+    with M_CYCLE.time(cycle="summary"):
+        _send_due_summaries(ctx, now, due)
+
+def _send_due_summaries(ctx: Context, now, due: List[int]):
     import datetime as _dt
-    for uid, u in list(db["users"].items()):
+    for uid in due:
         try:
-            if not u.get("is_active"):
+            u = USERS.get(uid)
+            if not u or not u.get("is_active"):
                 continue
             nxt = as_utc(u.get("next_summary_at"))
-            if (nxt is None) or (now < nxt):
+            if nxt is None:
+                continue
+            if now < nxt:
+                _schedule_summary(uid, u["next_summary_at"])   # schedule moved since it was queued
                 continue
             if not (u.get("balances_json") and u.get("last_plan_json")):
-                u["next_summary_at"] = iso(now + _dt.timedelta(days=1))
+                next_summary_at = iso(now + _dt.timedelta(days=1))
+                USERS.update(uid, next_summary_at=next_summary_at)
+                _schedule_summary(uid, next_summary_at)
                 continue
 
-            bal = u["balances_json"]
-            current = _to_current_alloc({
-                "USDC": bal.get("usdc_balance",0.0), "USDT": bal.get("usdt_balance",0.0),
-                "DAI": bal.get("dai_balance",0.0), "FDUSD": bal.get("fdusd_balance",0.0),
-                "BUSD": bal.get("busd_balance",0.0), "TUSD": bal.get("tusd_balance",0.0),
-                "USDP": bal.get("usdp_balance",0.0), "PYUSD": bal.get("pyusd_balance",0.0),
-                "USDD": bal.get("usdd_balance",0.0), "GUSD": bal.get("gusd_balance",0.0),
-            })
+            current = _to_current_alloc(_balances_from_user(u["balances_json"]))
             suggested = u["last_plan_json"].get("target_weights", {}) if isinstance(u["last_plan_json"], dict) else {}
             if bot:
-                try:
-                    await bot.send_message(
-                        chat_id=u["telegram_chat_id"],
-                        text=fmt_summary_msg(current, suggested),
-                        parse_mode="HTML",
-                        disable_web_page_preview=True,
-                    )
-                except Exception as e:
-                    ctx.logger.warning(f"[summary] telegram send failed user {uid}: {e}")
+                tg_enqueue(ctx, u["telegram_chat_id"], fmt_summary_msg(current, suggested), "summary")
 
             next_day = nxt.replace(minute=0, second=0, microsecond=0) + _dt.timedelta(days=1)
-            u["next_summary_at"] = iso(next_day)
+            while next_day <= now:   # missed days (agent was down): one summary, then the next future slot
+                next_day += _dt.timedelta(days=1)
+            USERS.update(uid, next_summary_at=iso(next_day))
+            _schedule_summary(uid, iso(next_day))
         except Exception as e:
             ctx.logger.warning(f"[summary] uid={uid} error: {e}")
-    save_users(db)
+            SUMMARIES.schedule(uid, now.timestamp() + SUMMARY_TICK_SEC)   # retry on a later tick
+
+_SUMMARY_TASK: Optional[asyncio.Task] = None
+
+async def _summary_loop(ctx: Context):
+    # sleep until the earliest next_summary_at (capped at SUMMARY_TICK_SEC), or until a schedule changes
+    while True:
+        try:
+            await periodic_summary_check(ctx)
+        except Exception as e:
+            ctx.logger.warning(f"[summary] cycle error: {e}")
+        await SUMMARIES.wait_next(max_sleep=SUMMARY_TICK_SEC)
+
+@agent.on_event("shutdown")
+async def on_shutdown(ctx: Context):
+    if TG.depth():
+        ctx.logger.info(f"Flushing {TG.depth()} queued Telegram messages")
+    if _SUMMARY_TASK is not None:
+        _SUMMARY_TASK.cancel()
+    await TG.drain(timeout=10.0)
+    await SIDE.stop()
+    if isinstance(BALANCES.rpc, JsonRpc):
+        await BALANCES.rpc.close()
+    PERSIST.close()
 
 # ─────────────────────────────────────────────────────────────
 # Health
@@ -729,6 +1438,10 @@ async def periodic_summary_check(ctx: Context):
 async def health(_: Context) -> HealthResp:
     return HealthResp(ok=True, agent=AGENT_NAME, upstream=BALANCER_AGENT_ADDRESS or "<unset>", telegram=bool(bot))
 
+@agent.on_rest_get("/notify/stats", NotifyStatsResp)
+async def notify_stats(_: Context) -> NotifyStatsResp:
+    return NotifyStatsResp(ok=True, **TG.stats())
+
 # --- Run Agent ---
 def run():
     agent.run()
@@ -1,4 +1,4 @@
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 from uagents import Model
 
 # rebalance_models.py
@@ -16,6 +16,14 @@ class RebalanceCheckRequest(Model):
     note: str = "rebalance_10coin"
     quote_amount: float = 1.0
 
+class CompactRebalanceRequest(Model):
+    # any number of coins (see app/data/coins.json): parallel arrays and/or a dict
+    symbols: List[str] = []
+    amounts: List[float] = []
+    balances: Dict[str, float] = {}
+    note: str = "rebalance_compact"
+    quote_amount: float = 1.0
+
 # class RebalancePlan(Model):
 #     trade_USDC_delta: float
 #     trade_USDT_delta: float
@@ -0,0 +1,89 @@
+# side_server.py
+"""
+Small aiohttp server next to the uAgents REST port, for responses the uAgents
+REST layer can't produce (it only returns one validated JSON model per request).
+- sse_post(path, stream): POST JSON body -> text/event-stream; `stream(body)` is an
+  async iterator of (event, data) pairs, data is JSON-encoded; event=None sends a keepalive comment.
+- text_get(path, render): plain-text GET (e.g. Prometheus /metrics).
+- CORS is open so the dashboard can read the stream with fetch().
+"""
+
+import json
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+from aiohttp import web
+
+SSEStream = Callable[[Dict[str, Any]], AsyncIterator[Tuple[Optional[str], Any]]]
+
+_CORS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type",
+}
+
+
+class SideServer:
+    def __init__(self, host: str = "0.0.0.0", port: int = 8001, logger=None):
+        self.host = host
+        self.port = int(port)
+        self.logger = logger
+        self.app = web.Application()
+        self._runner: Optional[web.AppRunner] = None
+
+    # ── routes ───────────────────────────────────────────────
+    def sse_post(self, path: str, stream: SSEStream):
+        async def handler(request: web.Request) -> web.StreamResponse:
+            try:
+                body = await request.json()
+            except Exception:
+                return web.json_response({"ok": False, "error": "invalid JSON body"}, status=400, headers=_CORS)
+
+            resp = web.StreamResponse(headers={
+                "Content-Type": "text/event-stream",
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no",   # don't let nginx/Render buffer the stream
+                **_CORS,
+            })
+            await resp.prepare(request)
+            agen = stream(body)
+            try:
+                async for event, data in agen:
+                    if event is None:
+                        await resp.write(b": keepalive\n\n")
+                    else:
+                        await resp.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+            except (ConnectionResetError, ConnectionError):
+                return resp   # client went away: nothing left to write to
+            finally:
+                # leaving async-for by an exception doesn't close the generator; do it now so its
+                # cleanup (e.g. cancelling in-flight upstream work) runs instead of at GC time
+                await agen.aclose()
+            await resp.write_eof()
+            return resp
+
+        self.app.router.add_post(path, handler)
+        self.app.router.add_route("OPTIONS", path, self._preflight)
+
+    def text_get(self, path: str, render: Callable[[], str], content_type: str = "text/plain; charset=utf-8"):
+        async def handler(_: web.Request) -> web.Response:
+            return web.Response(body=render().encode("utf-8"), headers={"Content-Type": content_type, **_CORS})
+
+        self.app.router.add_get(path, handler)
+
+    async def _preflight(self, _: web.Request) -> web.Response:
+        return web.Response(status=204, headers=_CORS)
+
+    # ── lifecycle ────────────────────────────────────────────
+    async def start(self):
+        if self._runner is not None:
+            return
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        if self.logger:
+            self.logger.info(f"Side HTTP server on http://{self.host}:{self.port}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
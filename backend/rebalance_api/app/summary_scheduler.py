@@ -0,0 +1,72 @@
+# summary_scheduler.py
+"""
+Min-heap timer for daily summaries.
+- schedule(uid, due_ts) / unschedule(uid) keep one live entry per user
+  (stale heap entries are skipped lazily on pop).
+- pop_due(now_ts) returns only the users whose summary is due.
+- wait_next() sleeps until the earliest due time, or earlier if a schedule changes.
+"""
+
+import asyncio
+import heapq
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class SummaryScheduler:
+    def __init__(self):
+        self._heap: List[Tuple[float, int]] = []
+        self._due: Dict[int, float] = {}           # uid -> live due timestamp
+        self._changed: Optional[asyncio.Event] = None
+
+    def _event(self) -> asyncio.Event:
+        if self._changed is None:
+            self._changed = asyncio.Event()       # created lazily inside the running loop
+        return self._changed
+
+    def schedule(self, uid: int, due_ts: float):
+        uid = int(uid)
+        if self._due.get(uid) == due_ts:
+            return
+        self._due[uid] = float(due_ts)
+        heapq.heappush(self._heap, (float(due_ts), uid))
+        self._event().set()
+
+    def unschedule(self, uid: int):
+        self._due.pop(int(uid), None)   # heap entry becomes stale
+
+    def clear(self):
+        self._heap.clear()
+        self._due.clear()
+
+    def _drop_stale(self):
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_due(self) -> Optional[float]:
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now_ts: Optional[float] = None) -> List[int]:
+        now_ts = time.time() if now_ts is None else now_ts
+        due: List[int] = []
+        self._drop_stale()
+        while self._heap and self._heap[0][0] <= now_ts:
+            _, uid = heapq.heappop(self._heap)
+            del self._due[uid]
+            due.append(uid)
+            self._drop_stale()
+        return due
+
+    async def wait_next(self, max_sleep: float):
+        nxt = self.next_due()
+        delay = max_sleep if nxt is None else min(max_sleep, max(0.0, nxt - time.time()))
+        ev = self._event()
+        ev.clear()
+        try:
+            await asyncio.wait_for(ev.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def __len__(self) -> int:
+        return len(self._due)
@@ -6,6 +6,16 @@ Build a concrete swap plan from (balances, deltas).
 - Negative delta  => SELL that coin (receive base)
 - 'base' is the routing asset (default USDC).
 - Returns an ordered list of swaps you can feed to your backend swapper (1inch/0x/etc).
+- mode="net" re-routes the same flows as a min-cost transportation problem, so sellers can
+  swap straight into buyers (e.g. USDT->PYUSD) when that is cheaper than two hops via base.
+- bases=["USDC","USDT","DAI"] builds the plan once per candidate base and keeps the cheapest
+  executable one; plan.base_choice says why (costs, shortfalls, unavailable pairs).
+- dust=DustPolicy(...) drops or merges deltas below a per-coin minimum trade size (a $3 leg
+  isn't worth its gas); plan.dust reports what moved where and the residual left in base.
+- replan(prev_plan, balances, deltas, ...) returns a PlanPatch (legs added / removed / resized)
+  instead of a fresh plan; unchanged legs are reused, not re-split.
+- liquidity=LiquidityModel(...) splits each leg across the pair's venues so marginal price
+  impact is equal everywhere, and fills expected_receive / min_receive (slippage_bps budget).
 
 Example:
 plan = build_swap_plan(
@@ -16,8 +26,14 @@ plan = build_swap_plan(
 )
 """
 
-from dataclasses import dataclass, asdict
-from typing import Dict, List, Optional, Tuple
+import math
+from dataclasses import dataclass, asdict, field, replace
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+try:
+    import numpy as np  # only needed for build_swap_plans_batch
+except Exception:
+    np = None
 
 @dataclass
 class SwapLeg:
@@ -25,8 +41,11 @@ class SwapLeg:
     dst: str
     amount: float               # human units
     intent: str                 # "SELL" or "BUY"
-    min_receive: Optional[float] = None  # set by backend using slippage bps
+    min_receive: Optional[float] = None  # expected_receive less the slippage bps budget
     note: Optional[str] = None
+    expected_receive: Optional[float] = None  # after fee + price impact (needs a LiquidityModel)
+    impact_bps: Optional[float] = None
+    venue: Optional[str] = None
 
 @dataclass
 class SwapPlan:
@@ -40,11 +59,48 @@ class SwapPlan:
     base_pool_end: float
     shortfall: float               # >0 if not enough base to execute all buys + base target
     warnings: List[str]
+    direct_swaps: List[SwapLeg] = field(default_factory=list)  # coin->coin (mode="net")
+    mode: str = "base"
+    est_cost: Optional[float] = None   # USD, see estimate_cost()
+    slippage_bps: Optional[float] = None   # set when legs carry min_receive
+    base_choice: Optional[Dict] = None     # set when several bases were considered
+    dust: Optional[Dict] = None            # set when a DustPolicy moved sub-threshold deltas
+
+    @property
+    def legs(self) -> List[SwapLeg]:
+        # execution order: sells fund base, direct swaps, then buys spend it
+        return self.sells_to_base + self.direct_swaps + self.buys_from_base
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "SwapPlan":
+        """Inverse of to_dict() (e.g. a plan stored with a user), for replan()."""
+        known = SwapLeg.__dataclass_fields__
+        legs = lambda key: [SwapLeg(**{k: v for k, v in x.items() if k in known}) for x in d.get(key) or []]
+        return cls(
+            base=d["base"],
+            sells_to_base=legs("sells_to_base"),
+            buys_from_base=legs("buys_from_base"),
+            base_funding=dict(d.get("base_funding") or {}),
+            base_pool_start=float(d.get("base_pool_start", 0.0)),
+            base_needed_for_buys=float(d.get("base_needed_for_buys", 0.0)),
+            base_delta_target=float(d.get("base_delta_target", 0.0)),
+            base_pool_end=float(d.get("base_pool_end", 0.0)),
+            shortfall=float(d.get("shortfall", 0.0)),
+            warnings=list(d.get("warnings") or []),
+            direct_swaps=legs("direct_swaps"),
+            mode=d.get("mode", "base"),
+            est_cost=d.get("est_cost"),
+            slippage_bps=d.get("slippage_bps"),
+            base_choice=d.get("base_choice"),
+            dust=d.get("dust"),
+        )
 
     def to_dict(self):
         return {
             "base": self.base,
+            "mode": self.mode,
             "sells_to_base": [asdict(x) for x in self.sells_to_base],
+            "direct_swaps": [asdict(x) for x in self.direct_swaps],
             "buys_from_base": [asdict(x) for x in self.buys_from_base],
             "base_funding": self.base_funding,
             "base_pool_start": round(self.base_pool_start, 6),
@@ -52,26 +108,415 @@ class SwapPlan:
             "base_delta_target": round(self.base_delta_target, 6),
             "base_pool_end": round(self.base_pool_end, 6),
             "shortfall": round(self.shortfall, 6),
+            "leg_count": len(self.legs),
+            "est_cost": None if self.est_cost is None else round(self.est_cost, 6),
+            "slippage_bps": self.slippage_bps,
+            "base_choice": self.base_choice,
+            "dust": self.dust,
             "warnings": self.warnings,
         }
 
 def round2(x: float) -> float:
     return float(f"{x:.2f}")
 
+@dataclass
+class CostModel:
+    """
+    Rough execution cost of a leg: amount * bps / 1e4 + gas_per_leg (USD, stables ≈ $1).
+    pair_bps overrides the default per (src, dst); the reverse pair is used if only it is given;
+    float("inf") marks a pair as unavailable.
+    coin_bps adds a risk premium to every leg touching a coin (e.g. its depeg in bps), so a
+    depegging routing base gets expensive on every leg and multi-base planning avoids it.
+    """
+    fee_bps: float = 5.0                 # fee + slippage per hop on a typical stable pool
+    gas_per_leg: float = 0.5             # USD per swap transaction
+    pair_bps: Dict[Tuple[str, str], float] = field(default_factory=dict)
+    coin_bps: Dict[str, float] = field(default_factory=dict)
+
+    def risk_bps(self, src: str, dst: str) -> float:
+        return self.coin_bps.get(src, 0.0) + self.coin_bps.get(dst, 0.0)
+
+    def bps(self, src: str, dst: str) -> float:
+        if (src, dst) in self.pair_bps:
+            return self.pair_bps[(src, dst)] + self.risk_bps(src, dst)
+        return self.pair_bps.get((dst, src), self.fee_bps) + self.risk_bps(src, dst)
+
+    def leg_cost(self, leg: SwapLeg) -> float:
+        if leg.expected_receive is not None:
+            risk = leg.amount * self.risk_bps(leg.src, leg.dst) / 1e4
+            return leg.amount - leg.expected_receive + risk + self.gas_per_leg
+        return leg.amount * self.bps(leg.src, leg.dst) / 1e4 + self.gas_per_leg
+
+def estimate_cost(plan: SwapPlan, cost_model: Optional[CostModel] = None) -> float:
+    cm = cost_model or CostModel()
+    return sum(cm.leg_cost(l) for l in plan.legs)
+
+# ─────────────────────────────────────────────────────────────
+# Dust: minimum trade size per leg
+# ─────────────────────────────────────────────────────────────
+DUST_ACTIONS = ("merge", "drop")
+
+@dataclass
+class DustPolicy:
+    """
+    A coin's threshold is the larger of its minimum trade size (coin_min, else min_trade) and
+    the size at which the leg's gas is max_gas_bps of it. Deltas below it never become legs:
+    action="merge" adds them to the closest-in-size leg above threshold on the same side
+    (a sell only if that coin's balance covers it); with action="drop", or no such leg, they
+    move onto the base delta and are reported as the residual.
+    """
+    min_trade: float = 10.0
+    coin_min: Dict[str, float] = field(default_factory=dict)
+    max_gas_bps: Optional[float] = 100.0   # gas may be at most 1% of a leg
+    action: str = "merge"
+
+    def threshold(self, coin: str, cost_model: Optional[CostModel] = None) -> float:
+        t = self.coin_min.get(coin, self.min_trade)
+        if self.max_gas_bps:
+            t = max(t, (cost_model or CostModel()).gas_per_leg * 1e4 / self.max_gas_bps)
+        return t
+
+def _dust_report(
+    moved: Dict[str, float], into: Dict[str, Optional[str]], thresholds: Dict[str, float],
+    base: str, cost_model: Optional[CostModel],
+) -> Tuple[Dict, Optional[str]]:
+    # (plan.dust, warning or None); into[c] is None when c's delta went to base
+    residual = round2(sum(d for c, d in moved.items() if into[c] is None))
+    report = {
+        "thresholds": {c: round2(thresholds[c]) for c in moved},
+        "merged": {c: {"into": into[c], "delta": round2(d)} for c, d in moved.items() if into[c] is not None},
+        "to_base": {c: round2(d) for c, d in moved.items() if into[c] is None},
+        "residual": residual,
+        "legs_saved": len(moved),
+        "gas_saved": round2(len(moved) * (cost_model or CostModel()).gas_per_leg),
+    }
+    warning = None
+    if report["to_base"]:
+        listed = ", ".join(f"{c} {d:+.2f}" for c, d in report["to_base"].items())
+        warning = f"Skipped dust below the minimum trade size ({listed}); residual {residual:+.2f} goes to the {base} delta."
+    return report, warning
+
+def filter_dust(
+    balances: Dict[str, float],
+    deltas: Dict[str, float],
+    base: str,
+    policy: DustPolicy,
+    cost_model: Optional[CostModel] = None,
+) -> Tuple[Dict[str, float], Optional[Dict], Optional[str]]:
+    """(deltas without sub-threshold legs, plan.dust report or None, warning or None)."""
+    if policy.action not in DUST_ACTIONS:
+        raise ValueError(f"unknown dust action: {policy.action!r} (expected one of {DUST_ACTIONS})")
+    coins = sorted(deltas)
+    thresholds = {c: policy.threshold(c, cost_model) for c in coins if c != base}
+    dust = [c for c in coins if c != base and deltas[c] != 0 and abs(deltas[c]) < thresholds[c]]
+    if not dust:
+        return deltas, None, None
+    out = dict(deltas)
+    into: Dict[str, Optional[str]] = {}
+    for sign in (-1, 1):   # sells, then buys
+        side = [c for c in dust if deltas[c] * sign > 0]
+        if not side:
+            continue
+        moved = sum(deltas[c] for c in side)
+        for c in side:
+            out[c] = 0.0
+        target = None
+        if policy.action == "merge":
+            cands = [
+                c for c in coins
+                if c != base and c not in dust and deltas[c] * sign > 0
+                and (sign > 0 or balances.get(c, 0.0) + 1e-9 >= -(deltas[c] + moved))
+            ]
+            if cands:
+                target = min(cands, key=lambda c: abs(deltas[c]))
+        if target is None:
+            out[base] = out.get(base, 0.0) + moved
+        else:
+            out[target] += moved
+        into.update({c: target for c in side})
+    report, warning = _dust_report({c: deltas[c] for c in dust}, into, thresholds, base, cost_model)
+    return out, report, warning
+
+# ─────────────────────────────────────────────────────────────
+# Liquidity: per-pair venues, leg splitting, expected / min receive
+# ─────────────────────────────────────────────────────────────
+DEFAULT_SLIPPAGE_BPS = 30.0
+
+@dataclass
+class Venue:
+    """
+    One pool for a pair, as a constant-product curve with virtual reserves `depth` (USD per side):
+    receive(x) = (1 - fee) * x * depth / (depth + x). For an amplified (Curve-style) pool use
+    roughly A x its balance as depth.
+    """
+    name: str
+    depth: float
+    fee_bps: float = 0.0
+
+    def receive(self, x: float) -> float:
+        return (1 - self.fee_bps / 1e4) * x * self.depth / (self.depth + x) if x > 0 else 0.0
+
+    def amount_at_marginal(self, lam: float) -> float:
+        # solve d receive / dx = (1 - fee) * depth^2 / (depth + x)^2 = lam for x >= 0
+        if lam <= 0:
+            return float("inf")
+        return max(0.0, self.depth * (((1 - self.fee_bps / 1e4) / lam) ** 0.5 - 1.0))
+
+@dataclass
+class LiquidityModel:
+    """
+    Venues per (src, dst); the reverse pair is used if only it is given (like CostModel).
+    Pairs without venues fall back to one `default_depth` pool, or to CostModel bps if None.
+    min_split: USD below which a venue is not worth its own leg.
+    """
+    pairs: Dict[Tuple[str, str], List[Venue]] = field(default_factory=dict)
+    default_depth: Optional[float] = None
+    default_fee_bps: float = 1.0
+    min_split: float = 50.0
+
+    def venues(self, src: str, dst: str) -> List[Venue]:
+        v = self.pairs.get((src, dst)) or self.pairs.get((dst, src))
+        if v:
+            return v
+        if self.default_depth:
+            return [Venue("default", self.default_depth, self.default_fee_bps)]
+        return []
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "LiquidityModel":
+        """
+        {"default_depth": 5e6, "default_fee_bps": 1, "min_split": 50,
+         "pairs": {"GUSD/USDC": [{"venue": "curve", "depth": 4e5, "fee_bps": 4}, ...]},
+         "scores": {"GUSD": 0.42, ...}, "depth_per_score": 2e7, "score_bases": ["USDC", "USDT"]}
+        "scores" are the liquidity agent's per-coin scores (0..1); listed "pairs" win over them.
+        """
+        model = cls(
+            default_depth=d.get("default_depth"),
+            default_fee_bps=float(d.get("default_fee_bps", 1.0)),
+            min_split=float(d.get("min_split", 50.0)),
+        )
+        if d.get("scores"):
+            model.pairs.update(cls.from_scores(
+                d["scores"], float(d.get("depth_per_score", 2e7)), d.get("score_bases") or ["USDC"],
+                model.default_fee_bps,
+            ).pairs)
+        for key, venues in (d.get("pairs") or {}).items():
+            src, dst = key.upper().split("/")
+            model.pairs[(src, dst)] = [
+                Venue(v.get("venue", f"pool{i}"), float(v["depth"]), float(v.get("fee_bps", model.default_fee_bps)))
+                for i, v in enumerate(venues) if float(v.get("depth", 0)) > 0
+            ]
+        return model
+
+    @classmethod
+    def from_scores(
+        cls, scores: Dict[str, Optional[float]], depth_per_score: float,
+        bases: Sequence[str] = ("USDC",), fee_bps: float = 1.0,
+    ) -> "LiquidityModel":
+        """One pool per coin/base pair, depth = depth_per_score x the thinner side's score."""
+        pairs: Dict[Tuple[str, str], List[Venue]] = {}
+        for coin, s in scores.items():
+            for base in bases:
+                sb = scores.get(base, 1.0)
+                if coin == base or s is None or sb is None:
+                    continue
+                depth = depth_per_score * max(0.0, min(float(s), float(sb)))
+                if depth > 0:
+                    pairs[(coin.upper(), base.upper())] = [Venue("agent", depth, fee_bps)]
+        return cls(pairs=pairs, default_fee_bps=fee_bps)
+
+def _waterfill(venues: List[Venue], amount: float) -> List[float]:
+    # bisect on the common marginal rate lam so the per-venue amounts add up to `amount`
+    lo, hi = 0.0, max(1 - v.fee_bps / 1e4 for v in venues)
+    for _ in range(80):
+        lam = (lo + hi) / 2
+        if sum(v.amount_at_marginal(lam) for v in venues) > amount:
+            lo = lam
+        else:
+            hi = lam
+    xs = [v.amount_at_marginal(hi) for v in venues]
+    total = sum(xs)
+    return [x * amount / total for x in xs] if total > 0 else [amount / len(venues)] * len(venues)
+
+def split_leg(
+    leg: SwapLeg,
+    liquidity: LiquidityModel,
+    slippage_bps: float = DEFAULT_SLIPPAGE_BPS,
+    cost_model: Optional[CostModel] = None,
+) -> List[SwapLeg]:
+    """
+    Split one leg across its pair's venues with equal marginal price impact. A venue is
+    dropped (and the rest re-solved) while its share is below min_split or the extra receive
+    it brings doesn't pay for another leg's gas. Every returned leg has expected/min receive.
+    """
+    cm = cost_model or CostModel()
+    keep = 1 - slippage_bps / 1e4
+    venues = sorted(liquidity.venues(leg.src, leg.dst), key=lambda v: -v.depth)
+    if not venues or leg.amount <= 0:
+        exp = leg.amount * (1 - cm.bps(leg.src, leg.dst) / 1e4)
+        return [replace(leg, expected_receive=round2(exp), min_receive=round2(exp * keep))]
+
+    def solve(vs: List[Venue]):
+        xs = _waterfill(vs, leg.amount)
+        return xs, sum(v.receive(x) for v, x in zip(vs, xs))
+
+    xs, got = solve(venues)
+    while len(venues) > 1:
+        j = min(range(len(venues)), key=xs.__getitem__)
+        rest = venues[:j] + venues[j + 1:]
+        xs2, got2 = solve(rest)
+        if xs[j] >= liquidity.min_split and got - got2 > cm.gas_per_leg:
+            break
+        venues, xs, got = rest, xs2, got2
+
+    # cent amounts that still add up to the leg
+    cents = [int(round(x * 100)) for x in xs]
+    cents[0] += int(round(leg.amount * 100)) - sum(cents)
+    out: List[SwapLeg] = []
+    for v, c in zip(venues, cents):
+        if c <= 0:
+            continue
+        amt = c / 100
+        exp = v.receive(amt)
+        out.append(replace(
+            leg, amount=amt, venue=v.name,
+            expected_receive=round2(exp), min_receive=round2(exp * keep),
+            impact_bps=round(1e4 * (1 - exp / amt), 2),
+        ))
+    return out
+
+def apply_liquidity(
+    plan: SwapPlan,
+    liquidity: LiquidityModel,
+    slippage_bps: float = DEFAULT_SLIPPAGE_BPS,
+    cost_model: Optional[CostModel] = None,
+    reuse: Optional[Dict[Tuple[str, str], List[SwapLeg]]] = None,
+) -> SwapPlan:
+    """
+    Split every leg of `plan` (in place) and re-estimate its cost from the venue curves.
+    reuse: earlier split pieces per (src, dst) (see replan()); a leg whose amount equals their
+    total keeps them instead of being re-split.
+    """
+    def split_one(l: SwapLeg) -> List[SwapLeg]:
+        prev = (reuse or {}).get((l.src, l.dst))
+        if prev and abs(sum(p.amount for p in prev) - l.amount) < 0.005:
+            return prev
+        return split_leg(l, liquidity, slippage_bps, cost_model)
+
+    split = lambda legs: [p for l in legs for p in split_one(l)]
+    plan.sells_to_base = split(plan.sells_to_base)
+    plan.direct_swaps = split(plan.direct_swaps)
+    plan.buys_from_base = split(plan.buys_from_base)
+    plan.slippage_bps = slippage_bps
+    for l in plan.legs:
+        if l.impact_bps is not None and l.impact_bps > slippage_bps:
+            plan.warnings.append(
+                f"{l.src}->{l.dst} {l.amount:.2f} via {l.venue}: expected impact {l.impact_bps:.1f} bps "
+                f"exceeds the {slippage_bps:g} bps budget; consider a smaller trade."
+            )
+    plan.est_cost = estimate_cost(plan, cost_model)
+    return plan
+
+def _finish_plan(
+    plan: SwapPlan,
+    mode: str,
+    cost_model: Optional[CostModel],
+    liquidity: Optional[LiquidityModel],
+    slippage_bps: float,
+) -> SwapPlan:
+    plan.est_cost = estimate_cost(plan, cost_model)
+    if mode not in ("base", "net"):
+        raise ValueError(f"unknown swap plan mode: {mode!r}")
+    if not math.isfinite(plan.est_cost):
+        plan.warnings.append(f"Some {plan.base} pairs are unavailable; plan cannot be executed as is.")
+        return plan
+    if mode == "net":
+        plan = net_swap_plan(plan, cost_model)
+    if liquidity is not None:
+        plan = apply_liquidity(plan, liquidity, slippage_bps, cost_model)
+    return plan
+
+# ─────────────────────────────────────────────────────────────
+# Multi-base routing: one candidate plan per base, keep the cheapest executable one
+# ─────────────────────────────────────────────────────────────
+def choose_base(plans: Sequence[SwapPlan], preferred: Optional[str] = None) -> SwapPlan:
+    """
+    Pick among plans that differ only in routing base: all pairs available first, then no
+    base shortfall, then lowest est_cost; exact ties go to `preferred`. The winner gets
+    base_choice = {"chosen", "reason", "candidates": {base: {est_cost, shortfall, legs, note}}}.
+    """
+    finite = lambda p: p.est_cost is not None and math.isfinite(p.est_cost)
+    rank = lambda p: (not finite(p), p.shortfall > 0, round(p.est_cost, 6) if finite(p) else 0.0, p.base != preferred)
+    best = min(plans, key=rank)
+
+    candidates: Dict[str, Dict] = {}
+    others: List[str] = []
+    for p in plans:
+        note = None
+        if not finite(p):
+            note = "pair unavailable"
+        elif p.shortfall > 0:
+            note = f"short {p.shortfall:.2f} {p.base}"
+        candidates[p.base] = {
+            "est_cost": round(p.est_cost, 6) if finite(p) else None,
+            "shortfall": p.shortfall,
+            "legs": len(p.legs),
+            "note": note,
+        }
+        if p is not best:
+            others.append(f"{p.base} {note}" if note else f"{p.base} ${p.est_cost:.2f}")
+
+    if not finite(best):
+        reason = "no candidate base has every pair available"
+    elif best.shortfall > 0:
+        reason = f"every base is short; {best.base} is the cheapest at ${best.est_cost:.2f}"
+    else:
+        reason = f"lowest estimated cost ${best.est_cost:.2f}"
+        tied = [p.base for p in plans if p is not best and rank(p)[:3] == rank(best)[:3]]
+        if tied:
+            reason += f" (tied with {', '.join(tied)}; {'preferred base' if best.base == preferred else 'listed first'})"
+    if others:
+        reason += " vs " + ", ".join(others)
+    best.base_choice = {"chosen": best.base, "reason": reason, "candidates": candidates}
+    return best
+
+def _base_extra(wallet_base_available: Union[float, Dict[str, float]], base: str) -> float:
+    if isinstance(wallet_base_available, dict):
+        return float(wallet_base_available.get(base, 0.0))
+    return float(wallet_base_available)
+
 def build_swap_plan(
     balances: Dict[str, float],
     deltas: Dict[str, float],
     base: str = "USDC",
-    wallet_base_available: float = 0.0,
+    wallet_base_available: Union[float, Dict[str, float]] = 0.0,
     tolerance: float = 1.0,       # dollar tolerance for sum(deltas) ≈ 0
+    mode: str = "base",           # "base" (everything via base) | "net" (direct pairs where cheaper)
+    cost_model: Optional[CostModel] = None,
+    liquidity: Optional[LiquidityModel] = None,
+    slippage_bps: float = DEFAULT_SLIPPAGE_BPS,
+    bases: Optional[Sequence[str]] = None,
+    dust: Optional[DustPolicy] = None,
 ) -> SwapPlan:
     """
     balances: current wallet balances per coin
     deltas:   desired changes per coin (+ buy, - sell)
     base:     routing/staging stable (USDC recommended)
-    wallet_base_available: extra base liquidity outside 'balances[base]' (optional)
+    wallet_base_available: extra base liquidity outside 'balances[base]' (optional; per base as a dict)
     tolerance: how much total delta mismatch we allow before warning
+    mode/cost_model: see net_swap_plan(); est_cost is filled in either way
+    liquidity/slippage_bps: see split_leg(); None keeps one leg per coin and no min_receive
+    bases:    candidate routing bases; one plan per base, see choose_base() (`base` wins ties)
+    dust:     minimum trade sizes, see DustPolicy; None keeps every non-zero leg
     """
+    if bases:
+        plans = [
+            build_swap_plan(balances, deltas, b, _base_extra(wallet_base_available, b), tolerance,
+                            mode, cost_model, liquidity, slippage_bps, dust=dust)
+            for b in dict.fromkeys(bases)
+        ]
+        return choose_base(plans, preferred=base)
+    wallet_base_available = _base_extra(wallet_base_available, base)
 
     coins = sorted(set(balances) | set(deltas))
     balances = {c: float(balances.get(c, 0.0)) for c in coins}
@@ -80,9 +525,15 @@ def build_swap_plan(
         balances[base] = balances.get(base, 0.0)
         deltas[base] = deltas.get(base, 0.0)
 
-    # sanity: total deltas should ~= 0 for dollar-neutral rebalance
-    total_delta = sum(deltas.values())
     warnings: List[str] = []
+    dust_report = None
+    if dust is not None:
+        deltas, dust_report, dust_warning = filter_dust(balances, deltas, base, dust, cost_model)
+        if dust_warning:
+            warnings.append(dust_warning)
+
+    # sanity: total deltas should ~= 0 for dollar-neutral rebalance (checked to the cent, like the batch path)
+    total_delta = round2(sum(deltas.values()))
     if abs(total_delta) > tolerance:
         warnings.append(f"Sum of deltas = {total_delta:.2f} (>|{tolerance}|). Plan will proceed but check upstream math.")
 
@@ -170,7 +621,7 @@ def build_swap_plan(
         "from_sells": round2(base_from_sells),
     }
 
-    return SwapPlan(
+    plan = SwapPlan(
         base=base,
         sells_to_base=sells_to_base,
         buys_from_base=buys_from_base,
@@ -181,6 +632,512 @@ def build_swap_plan(
         base_pool_end=round2(base_pool_end),
         shortfall=shortfall,
         warnings=warnings,
+        dust=dust_report,
+    )
+    return _finish_plan(plan, mode, cost_model, liquidity, slippage_bps)
+
+# ─────────────────────────────────────────────────────────────
+# Netting mode: min-cost transportation from sellers to buyers
+# ─────────────────────────────────────────────────────────────
+def _min_cost_transport(
+    supply: Dict[str, int],
+    demand: Dict[str, int],
+    cost: Callable[[str, str], float],
+) -> Dict[Tuple[str, str], int]:
+    """
+    Successive shortest paths (Bellman-Ford on the residual graph) for a balanced
+    transportation problem in integer units (cents). Tiny: ~10 sellers x ~10 buyers.
+    """
+    srcs, dsts = list(supply), list(demand)
+    S, T = 0, 1 + len(srcs) + len(dsts)
+    n = T + 1
+    graph: List[List[list]] = [[] for _ in range(n)]   # edge: [to, cap, cost, rev_index]
+
+    def add(u: int, v: int, cap: int, c: float):
+        graph[u].append([v, cap, c, len(graph[v])])
+        graph[v].append([u, 0, -c, len(graph[u]) - 1])
+
+    big = sum(supply.values())
+    for i, a in enumerate(srcs):
+        add(S, 1 + i, supply[a], 0.0)
+        for j, b in enumerate(dsts):
+            add(1 + i, 1 + len(srcs) + j, big, cost(a, b))
+    for j, b in enumerate(dsts):
+        add(1 + len(srcs) + j, T, demand[b], 0.0)
+
+    while True:
+        dist = [float("inf")] * n
+        prev: List[Optional[Tuple[int, int]]] = [None] * n
+        dist[S] = 0.0
+        for _ in range(n - 1):
+            changed = False
+            for u in range(n):
+                if dist[u] == float("inf"):
+                    continue
+                for k, (v, cap, c, _) in enumerate(graph[u]):
+                    if cap > 0 and dist[u] + c < dist[v] - 1e-12:
+                        dist[v] = dist[u] + c
+                        prev[v] = (u, k)
+                        changed = True
+            if not changed:
+                break
+        if prev[T] is None:
+            break
+        push, v = big, T
+        while v != S:
+            u, k = prev[v]
+            push = min(push, graph[u][k][1])
+            v = u
+        v = T
+        while v != S:
+            u, k = prev[v]
+            graph[u][k][1] -= push
+            graph[v][graph[u][k][3]][1] += push
+            v = u
+
+    flows: Dict[Tuple[str, str], int] = {}
+    for i, a in enumerate(srcs):
+        for v, cap, c, rev in graph[1 + i]:
+            j = v - 1 - len(srcs)
+            if 0 <= j < len(dsts):
+                f = graph[v][rev][1]   # reverse residual = flow on the edge
+                if f > 0:
+                    flows[(a, dsts[j])] = f
+    return flows
+
+def net_swap_plan(plan: SwapPlan, cost_model: Optional[CostModel] = None) -> SwapPlan:
+    """
+    Re-route a base-routed plan with the same per-coin amounts, pairing sellers with buyers
+    directly where one hop is cheaper than two via base (per cost_model). Base covers any
+    imbalance (leftover sells go to base, extra buys come from base). Direct legs too small
+    to pay for their own gas are folded back into existing base legs. The netted plan is
+    returned only if its estimated cost beats the base-routed one.
+    """
+    cm = cost_model or CostModel()
+    base = plan.base
+    base_cost = plan.est_cost if plan.est_cost is not None else estimate_cost(plan, cm)
+
+    cents = lambda x: int(round(x * 100))
+    supply = {l.src: cents(l.amount) for l in plan.sells_to_base if cents(l.amount) > 0}
+    demand = {l.dst: cents(l.amount) for l in plan.buys_from_base if cents(l.amount) > 0}
+    gap = sum(demand.values()) - sum(supply.values())
+    if gap > 0:
+        supply[base] = gap        # buys beyond what sells raise are funded from the base pool
+    elif gap < 0:
+        demand[base] = -gap       # sells beyond what buys need stay in base
+    if not supply or not demand:
+        plan.mode = "base"
+        return plan
+
+    via_base = lambda a, b: cm.bps(a, base) + cm.bps(base, b)
+    def edge_bps(a: str, b: str) -> float:
+        if a == base:
+            return cm.bps(base, b)
+        if b == base:
+            return cm.bps(a, base)
+        return min(cm.bps(a, b), via_base(a, b))
+
+    flows = _min_cost_transport(supply, demand, edge_bps)
+
+    to_base: Dict[str, int] = {}
+    from_base: Dict[str, int] = {}
+    direct: Dict[Tuple[str, str], int] = {}
+    for (a, b), f in flows.items():
+        if a == base:
+            from_base[b] = from_base.get(b, 0) + f
+        elif b == base:
+            to_base[a] = to_base.get(a, 0) + f
+        elif cm.bps(a, b) <= via_base(a, b):
+            direct[(a, b)] = f
+        else:
+            to_base[a] = to_base.get(a, 0) + f
+            from_base[b] = from_base.get(b, 0) + f
+
+    # fold small direct legs into base legs that exist anyway, when that saves gas
+    for (a, b), f in sorted(direct.items(), key=lambda kv: kv[1]):
+        extra_legs = (a not in to_base) + (b not in from_base)
+        direct_cost = f / 100 * cm.bps(a, b) / 1e4 + cm.gas_per_leg
+        routed_cost = f / 100 * via_base(a, b) / 1e4 + extra_legs * cm.gas_per_leg
+        if routed_cost < direct_cost:
+            del direct[(a, b)]
+            to_base[a] = to_base.get(a, 0) + f
+            from_base[b] = from_base.get(b, 0) + f
+
+    sells_to_base = [SwapLeg(src=a, dst=base, amount=f / 100, intent="SELL", note="fund base")
+                     for a, f in sorted(to_base.items())]
+    buys_from_base = [SwapLeg(src=base, dst=b, amount=f / 100, intent="BUY")
+                      for b, f in sorted(from_base.items())]
+    direct_swaps = [SwapLeg(src=a, dst=b, amount=f / 100, intent="SWAP", note="direct")
+                    for (a, b), f in sorted(direct.items())]
+
+    from_sells = round2(sum(l.amount for l in sells_to_base))
+    netted = SwapPlan(
+        base=base,
+        sells_to_base=sells_to_base,
+        buys_from_base=buys_from_base,
+        base_funding={**plan.base_funding, "from_sells": from_sells},
+        base_pool_start=round2(plan.base_funding["base_balance_start"] + plan.base_funding["wallet_base_available"] + from_sells),
+        base_needed_for_buys=round2(sum(l.amount for l in buys_from_base)),
+        base_delta_target=plan.base_delta_target,
+        base_pool_end=plan.base_pool_end,    # net effect on base is unchanged
+        shortfall=plan.shortfall,
+        warnings=list(plan.warnings),
+        direct_swaps=direct_swaps,
+        mode="net",
+        dust=plan.dust,
+    )
+    netted.est_cost = estimate_cost(netted, cm)
+    if netted.est_cost >= base_cost:
+        plan.mode = "base"   # netting didn't help; keep base routing
+        return plan
+    return netted
+
+# ─────────────────────────────────────────────────────────────
+# Incremental replanning: patch against the previous plan
+# ─────────────────────────────────────────────────────────────
+LEG_PHASES = ("sells_to_base", "direct_swaps", "buys_from_base")
+
+def _leg_key(phase: str, leg: SwapLeg) -> Tuple[str, str, str, Optional[str]]:
+    return (phase, leg.src, leg.dst, leg.venue)
+
+def _same_leg(a: SwapLeg, b: SwapLeg) -> bool:
+    return abs(a.amount - b.amount) < 0.005 and a.min_receive == b.min_receive
+
+@dataclass
+class PlanPatch:
+    """
+    What changed between two plans, leg by leg (a leg is phase + src + dst + venue).
+    plan is the new plan; its unchanged legs are the previous plan's SwapLeg objects.
+    """
+    plan: SwapPlan
+    added: List[Tuple[str, SwapLeg]] = field(default_factory=list)        # (phase, leg)
+    removed: List[Tuple[str, SwapLeg]] = field(default_factory=list)
+    resized: List[Tuple[str, SwapLeg, SwapLeg]] = field(default_factory=list)   # (phase, previous, new)
+    unchanged: int = 0
+    rebuilt: bool = False          # no usable previous plan (none, other base): every leg is "added"
+
+    @property
+    def empty(self) -> bool:
+        return not (self.added or self.removed or self.resized)
+
+    def to_dict(self) -> Dict:
+        return {
+            "rebuilt": self.rebuilt,
+            "empty": self.empty,
+            "unchanged": self.unchanged,
+            "added": [{"phase": ph, **asdict(l)} for ph, l in self.added],
+            "removed": [{"phase": ph, **asdict(l)} for ph, l in self.removed],
+            "resized": [
+                {"phase": ph, **asdict(new), "previous_amount": old.amount, "previous_min_receive": old.min_receive}
+                for ph, old, new in self.resized
+            ],
+        }
+
+def diff_plans(prev: Optional[SwapPlan], new: SwapPlan) -> PlanPatch:
+    """Patch from prev to new; new's unchanged legs are swapped for prev's objects (in place)."""
+    if prev is None or prev.base != new.base:
+        return PlanPatch(plan=new, added=[(ph, l) for ph in LEG_PHASES for l in getattr(new, ph)], rebuilt=True)
+    old = {_leg_key(ph, l): (ph, l) for ph in LEG_PHASES for l in getattr(prev, ph)}
+    patch = PlanPatch(plan=new)
+    for ph in LEG_PHASES:
+        legs = getattr(new, ph)
+        for i, l in enumerate(legs):
+            hit = old.pop(_leg_key(ph, l), None)
+            if hit is None:
+                patch.added.append((ph, l))
+            elif _same_leg(hit[1], l):
+                legs[i] = hit[1]
+                patch.unchanged += 1
+            else:
+                patch.resized.append((ph, hit[1], l))
+    patch.removed = list(old.values())
+    return patch
+
+def replan(
+    prev: Optional[SwapPlan],
+    balances: Dict[str, float],
+    deltas: Dict[str, float],
+    **kw,
+) -> PlanPatch:
+    """
+    build_swap_plan(balances, deltas, **kw) as a patch against `prev` (e.g. last cycle's plan).
+    In base mode with a liquidity model, only legs whose amount changed are re-split across
+    venues; the rest keep prev's pieces, so the work scales with what moved. Net mode and
+    multi-base planning are global, so they rebuild and only the diff is incremental.
+    """
+    liquidity = kw.get("liquidity")
+    slippage_bps = kw.get("slippage_bps", DEFAULT_SLIPPAGE_BPS)
+    incremental = (
+        prev is not None and liquidity is not None
+        and kw.get("mode", "base") == "base" and not kw.get("bases")
+        and prev.base == kw.get("base", "USDC") and prev.slippage_bps == slippage_bps
+    )
+    if not incremental:
+        return diff_plans(prev, build_swap_plan(balances, deltas, **kw))
+
+    plan = build_swap_plan(balances, deltas, **{**kw, "liquidity": None})
+    if math.isfinite(plan.est_cost):
+        reuse: Dict[Tuple[str, str], List[SwapLeg]] = {}
+        for l in prev.legs:
+            reuse.setdefault((l.src, l.dst), []).append(l)
+        plan = apply_liquidity(plan, liquidity, slippage_bps, kw.get("cost_model"), reuse=reuse)
+    return diff_plans(prev, plan)
+
+# ─────────────────────────────────────────────────────────────
+# Batch mode: many portfolios over the same coin list, one NumPy pass
+# ─────────────────────────────────────────────────────────────
+class SwapPlanBatch:
+    """
+    Result of build_swap_plans_batch(). All numbers are arrays (one row per portfolio);
+    SwapLeg / SwapPlan objects are only built by plan(i) / to_dict(i).
+    """
+
+    def __init__(self, coins: List[str], base: str, **arrays):
+        self.coins = coins
+        self.base = base
+        self.sells = arrays["sells"]                     # (N, C) coin -> base amounts
+        self.sell_mask = arrays["sell_mask"]             # (N, C) leg exists
+        self.buys = arrays["buys"]                       # (N, C) base -> coin amounts (after scaling/upsizing)
+        self.buy_mask = arrays["buy_mask"]
+        self.balances = arrays["balances"]
+        self.oversold = arrays["oversold"]               # (N, C) requested sell > balance
+        self.sell_requested = arrays["sell_requested"]
+        self.total_delta = arrays["total_delta"]         # (N,)
+        self.base_balance_start = arrays["base_balance_start"]
+        self.wallet_base_available = arrays["wallet_base_available"]
+        self.base_from_sells = arrays["base_from_sells"]
+        self.base_pool_start = arrays["base_pool_start"]
+        self.base_needed_for_buys = arrays["base_needed_for_buys"]
+        self.base_delta_target = arrays["base_delta_target"]
+        self.base_pool_end = arrays["base_pool_end"]
+        self.shortfall = arrays["shortfall"]
+        self.tolerance = arrays["tolerance"]
+        self.dust = arrays.get("dust")                   # DustPolicy inputs/outcome, see _filter_dust_v()
+
+    def __len__(self) -> int:
+        return int(self.sells.shape[0])
+
+    @property
+    def leg_counts(self):
+        return self.sell_mask.sum(axis=1) + self.buy_mask.sum(axis=1)
+
+    def _dust(self, i: int) -> Tuple[Optional[Dict], Optional[str]]:
+        if self.dust is None or not self.dust["mask"][i].any():
+            return None, None
+        cols = np.flatnonzero(self.dust["mask"][i])
+        into = self.dust["into"][i]
+        return _dust_report(
+            {self.coins[j]: float(self.dust["delta"][i, j]) for j in cols},
+            {self.coins[j]: None if into[j] < 0 else self.coins[into[j]] for j in cols},
+            {self.coins[j]: float(self.dust["thresholds"][j]) for j in cols},
+            self.base, self.dust["cost_model"],
+        )
+
+    def _warnings(self, i: int) -> List[str]:
+        w: List[str] = []
+        base = self.base
+        dust_warning = self._dust(i)[1]
+        if dust_warning:
+            w.append(dust_warning)
+        if abs(self.total_delta[i]) > self.tolerance:
+            w.append(f"Sum of deltas = {self.total_delta[i]:.2f} (>|{self.tolerance}|). Plan will proceed but check upstream math.")
+        for j in np.flatnonzero(self.oversold[i]):
+            w.append(f"Balance of {self.coins[j]} ({self.balances[i, j]:.2f}) < SELL amount ({self.sell_requested[i, j]:.2f}). Will sell what is available.")
+        if self.shortfall[i] > 0:
+            w.append(f"Base shortfall of {self.shortfall[i]:.2f} {base} to execute all buys + base target.")
+        bdt = self.base_delta_target[i]
+        if bdt > 0 and self.base_pool_end[i] < -1e-6:
+            w.append("After reserving positive base delta, base went negative — check inputs.")
+        if bdt < 0 and self.base_pool_end[i] > 0 and not self.buy_mask[i].any():
+            w.append("Base is to be reduced but no BUY legs exist; consider swapping leftover base to the safest coin.")
+        return w
+
+    def plan(
+        self, i: int, mode: str = "base", cost_model: Optional[CostModel] = None,
+        liquidity: Optional[LiquidityModel] = None, slippage_bps: float = DEFAULT_SLIPPAGE_BPS,
+    ) -> SwapPlan:
+        """Materialize portfolio i as a SwapPlan (same as build_swap_plan's for the same mode)."""
+        sells_to_base = [
+            SwapLeg(src=self.coins[j], dst=self.base, amount=float(self.sells[i, j]), intent="SELL", note="fund base")
+            for j in np.flatnonzero(self.sell_mask[i])
+        ]
+        buys_from_base = [
+            SwapLeg(src=self.base, dst=self.coins[j], amount=float(self.buys[i, j]), intent="BUY")
+            for j in np.flatnonzero(self.buy_mask[i])
+        ]
+        plan = SwapPlan(
+            base=self.base,
+            sells_to_base=sells_to_base,
+            buys_from_base=buys_from_base,
+            base_funding={
+                "base_balance_start": round2(self.base_balance_start[i]),
+                "wallet_base_available": round2(self.wallet_base_available[i]),
+                "from_sells": round2(self.base_from_sells[i]),
+            },
+            base_pool_start=float(self.base_pool_start[i]),
+            base_needed_for_buys=float(self.base_needed_for_buys[i]),
+            base_delta_target=round2(self.base_delta_target[i]),
+            base_pool_end=round2(self.base_pool_end[i]),
+            shortfall=float(self.shortfall[i]),
+            warnings=self._warnings(i),
+            dust=self._dust(i)[0],
+        )
+        return _finish_plan(plan, mode, cost_model, liquidity, slippage_bps)
+
+    def to_dict(self, i: int, mode: str = "base", cost_model: Optional[CostModel] = None, **kw) -> dict:
+        return self.plan(i, mode, cost_model, **kw).to_dict()
+
+def _round2v(x):
+    # np.round(x, 2) is rint(x*100)/100; redo the near-half-cent cases with round2()
+    # so batch results match build_swap_plan to the cent
+    x = np.asarray(x, dtype=float)
+    out = np.round(x, 2)
+    frac = np.abs(x * 100.0) % 1.0
+    tie = np.abs(frac - 0.5) < 1e-6
+    if tie.any():
+        out = np.array(out, copy=True)
+        out[tie] = [round2(v) for v in x[tie]]
+    return out
+
+def _rowsum(m):
+    # left-to-right over columns (like Python's sum()), not NumPy's pairwise summation
+    acc = np.zeros(m.shape[0])
+    for j in range(m.shape[1]):
+        acc = acc + m[:, j]
+    return acc
+
+def _filter_dust_v(bal, dlt, coins: List[str], b: int, policy: DustPolicy, cost_model: Optional[CostModel]):
+    # filter_dust() over (N, C) rows; same candidates, sums and tie-breaks (first coin in sorted order)
+    if policy.action not in DUST_ACTIONS:
+        raise ValueError(f"unknown dust action: {policy.action!r} (expected one of {DUST_ACTIONS})")
+    N, C = dlt.shape
+    not_base = np.arange(C) != b
+    thresholds = np.array([policy.threshold(c, cost_model) if j != b else 0.0 for j, c in enumerate(coins)])
+    mask = not_base & (dlt != 0) & (np.abs(dlt) < thresholds)
+    out = dlt.copy()
+    into = np.full((N, C), -1)
+    rows_all = np.arange(N)
+    for sign in (-1, 1):
+        side = mask & (dlt * sign > 0)
+        has = side.any(axis=1)
+        if not has.any():
+            continue
+        moved = _rowsum(np.where(side, dlt, 0.0))
+        out = np.where(side, 0.0, out)
+        target = np.full(N, -1)
+        if policy.action == "merge":
+            cand = not_base & ~mask & (dlt * sign > 0)
+            if sign < 0:
+                cand &= bal + 1e-9 >= -(dlt + moved[:, None])
+            pick = np.where(cand, np.abs(dlt), np.inf).argmin(axis=1)
+            target = np.where(cand.any(axis=1), pick, -1)
+        rows = rows_all[has]
+        col = np.where(target[rows] >= 0, target[rows], b)
+        out[rows, col] = out[rows, col] + moved[rows]
+        into = np.where(side, target[:, None], into)
+    dust = {"mask": mask, "delta": np.where(mask, dlt, 0.0), "into": into,
+            "thresholds": thresholds, "cost_model": cost_model}
+    return out, dust
+
+def build_swap_plans_batch(
+    balances_matrix,
+    deltas_matrix,
+    coins: Sequence[str],
+    base: str = "USDC",
+    wallet_base_available: Union[float, Sequence[float]] = 0.0,
+    tolerance: float = 1.0,
+    dust: Optional[DustPolicy] = None,
+    cost_model: Optional[CostModel] = None,
+) -> SwapPlanBatch:
+    """
+    Vectorized build_swap_plan for N portfolios.
+    balances_matrix, deltas_matrix: (N, C) arrays, columns in `coins` order
+    wallet_base_available: scalar or (N,) array
+    Same rules as build_swap_plan: drop/merge dust, partition sells/buys, scale buys on base
+    shortfall, reserve a positive base delta or spread a negative one over the buy legs.
+    cost_model is only read for gas_per_leg (dust thresholds); pass the same one to plan(i).
+    """
+    if np is None:
+        raise ImportError("build_swap_plans_batch requires numpy")
+
+    given = list(coins)
+    bal = np.atleast_2d(np.asarray(balances_matrix, dtype=float))
+    dlt = np.atleast_2d(np.asarray(deltas_matrix, dtype=float))
+    if bal.shape != dlt.shape or bal.shape[1] != len(given):
+        raise ValueError(f"balances {bal.shape} and deltas {dlt.shape} must both be (N, {len(given)})")
+    if base not in given:
+        given.append(base)
+        pad = np.zeros((bal.shape[0], 1))
+        bal, dlt = np.hstack([bal, pad]), np.hstack([dlt, pad])
+    # legs come out in sorted coin order, like build_swap_plan
+    order = sorted(range(len(given)), key=given.__getitem__)
+    coins = [given[j] for j in order]
+    bal, dlt = bal[:, order], dlt[:, order]
+    N, C = bal.shape
+    b = coins.index(base)
+    not_base = np.ones(C, dtype=bool)
+    not_base[b] = False
+    wallet = np.broadcast_to(np.asarray(wallet_base_available, dtype=float), (N,)).astype(float)
+    dust_info = None
+    if dust is not None:
+        dlt, dust_info = _filter_dust_v(bal, dlt, coins, b, dust, cost_model)
+
+    total_delta = _round2v(_rowsum(dlt))   # to the cent, as build_swap_plan checks it
+
+    # SELL legs: coin -> base, capped at balance
+    sell_req = np.where((dlt < 0) & not_base, -dlt, 0.0)
+    oversold = (sell_req > 0) & (bal + 1e-9 < sell_req)
+    sell_amt = np.where(oversold, np.maximum(0.0, bal), sell_req)
+    sell_mask = sell_amt > 0
+    sells = np.where(sell_mask, _round2v(sell_amt), 0.0)
+
+    base_from_sells = _rowsum(sells)
+    base_balance_start = bal[:, b]
+    base_pool_start = _round2v(base_balance_start + wallet + base_from_sells)
+
+    buy_req = np.where((dlt > 0) & not_base, dlt, 0.0)
+    base_needed = _round2v(_rowsum(buy_req))
+    bdt = dlt[:, b]
+    pos_bdt = np.maximum(0.0, bdt)
+    shortfall = _round2v(np.maximum(0.0, base_needed + pos_bdt - base_pool_start))
+
+    # scale buys down to the spendable pool on shortfall
+    spendable = np.maximum(0.0, base_pool_start - pos_bdt)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        short_scale = np.where(base_needed == 0, 0.0, np.minimum(1.0, spendable / base_needed))
+    scale = np.where(shortfall > 0, short_scale, 1.0)
+    buys = _round2v(buy_req * scale[:, None])
+    buy_mask = buys > 0
+    buys = np.where(buy_mask, buys, 0.0)
+    pool_end = base_pool_start.copy()
+    for j in range(C):
+        pool_end = pool_end - buys[:, j]   # same order as build_swap_plan's `pool -= leg`
+
+    # positive base delta: keep it in base
+    pos = bdt > 0
+    pool_end = np.where(pos, _round2v(pool_end - bdt), pool_end)
+
+    # negative base delta: upsize buy legs proportionally with the leftover base
+    neg = bdt < 0
+    extra = _round2v(np.minimum(np.abs(bdt), pool_end))
+    total_buys = _rowsum(buys)
+    upsize = neg & (extra > 0) & buy_mask.any(axis=1) & (total_buys > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        share = np.where(upsize[:, None], buys / np.where(total_buys > 0, total_buys, 1.0)[:, None], 0.0)
+    add = _round2v(extra[:, None] * share)
+    buys = np.where(upsize[:, None] & buy_mask, _round2v(buys + add), buys)
+    pool_end = np.where(upsize, _round2v(pool_end - extra), pool_end)
+
+    return SwapPlanBatch(
+        coins, base,
+        sells=sells, sell_mask=sell_mask, buys=buys, buy_mask=buy_mask,
+        balances=bal, oversold=oversold, sell_requested=sell_req,
+        total_delta=total_delta,
+        base_balance_start=base_balance_start, wallet_base_available=wallet,
+        base_from_sells=base_from_sells, base_pool_start=base_pool_start,
+        base_needed_for_buys=base_needed, base_delta_target=bdt,
+        base_pool_end=_round2v(pool_end), shortfall=shortfall, tolerance=tolerance,
+        dust=dust_info,
     )
 
 # --- quick demo ---
@@ -197,4 +1154,15 @@ if __name__ == "__main__":
     }
     plan = build_swap_plan(balances, deltas, base="USDC", wallet_base_available=0.0)
     import json
-    print(json.dumps(plan.to_dict(), indent=2))
\ No newline at end of file
+    print(json.dumps(plan.to_dict(), indent=2))
+    net = build_swap_plan(balances, deltas, base="USDC", mode="net")
+    print(f"base: {len(plan.legs)} legs, est ${plan.est_cost:.2f}  |  net: {len(net.legs)} legs, est ${net.est_cost:.2f}")
+    liq = LiquidityModel.from_dict({
+        "default_depth": 5e6,
+        "pairs": {"GUSD/USDC": [{"venue": "curve", "depth": 2e5, "fee_bps": 4}, {"venue": "uniswap", "depth": 1e5, "fee_bps": 5}]},
+    })
+    split = build_swap_plan(balances, deltas, base="USDC", liquidity=liq)
+    for l in split.legs:
+        print(f"{l.src}->{l.dst} {l.amount:>9.2f} via {l.venue}: expect {l.expected_receive}, min {l.min_receive} ({l.impact_bps} bps)")
+    multi = build_swap_plan(balances, deltas, bases=["USDC", "USDT", "DAI"], cost_model=CostModel(coin_bps={"USDC": 30.0}))
+    print(f"multi-base: {multi.base_choice['chosen']} ({multi.base_choice['reason']})")
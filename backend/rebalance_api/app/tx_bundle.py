@@ -0,0 +1,276 @@
+# tx_bundle.py
+"""
+Turn a SwapPlan into one batched transaction instead of one per leg.
+- Calls, in order: ERC-20 approvals to the router (one per token spent, sized to the plan's
+  total; USDT-style tokens are reset to 0 first), then one router swap per leg in plan order
+  (sells_to_base, direct_swaps, buys_from_base), min_receive as the on-chain minimum out.
+- The calls are wrapped in a smart-account batch call (default executeBatch((address,uint256,bytes)[]),
+  ERC-4337 / EIP-7702 style) sent to the wallet itself. A plain Multicall3 won't do: approvals
+  would be made by the multicall contract, not the wallet.
+- Pure ABI encoding: no web3, no chain. Gas is estimated from calldata and per-call costs
+  (GasModel); estimate_gas_rpc() asks a devnet (anvil/hardhat) or any node if one is around.
+- Amounts go on chain in token units using the coin registry's decimals and addresses.
+
+Example:
+bundle = encode_plan(plan, account="0xYourSmartAccount", router="0xRouter")
+tx = bundle.to_tx()   # {"from", "to", "data", "value"} for eth_sendTransaction / eth_estimateGas
+"""
+
+from dataclasses import asdict, dataclass, field
+from decimal import Decimal, ROUND_DOWN
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from Crypto.Hash import keccak  # pycryptodome; only needed for selectors not in _SELECTORS
+except Exception:
+    keccak = None
+
+try:
+    import requests  # only needed for estimate_gas_rpc()
+except Exception:
+    requests = None
+
+try:
+    from app.coins import COINS, CoinRegistry
+    from app.swapPlanner import DEFAULT_SLIPPAGE_BPS, SwapLeg, SwapPlan
+except Exception:
+    from coins import COINS, CoinRegistry  # fallback for local runs
+    from swapPlanner import DEFAULT_SLIPPAGE_BPS, SwapLeg, SwapPlan
+
+# keccak256(signature)[:4] for the default signatures, so encoding works without pycryptodome
+_SELECTORS = {
+    "approve(address,uint256)": "095ea7b3",
+    "swap(address,address,uint256,uint256,address)": "d5bcb9b5",
+    "executeBatch((address,uint256,bytes)[])": "34fcd5be",
+    "balanceOf(address)": "70a08231",
+    "aggregate3((address,bool,bytes)[])": "82ad56cb",
+}
+
+
+def selector(signature: str) -> bytes:
+    sig = signature.replace(" ", "")
+    if sig in _SELECTORS:
+        return bytes.fromhex(_SELECTORS[sig])
+    if keccak is None:
+        raise ImportError(f"selector for {sig!r} needs pycryptodome (Crypto.Hash.keccak)")
+    k = keccak.new(digest_bits=256)
+    k.update(sig.encode())
+    return k.digest()[:4]
+
+
+# ─────────────────────────────────────────────────────────────
+# ABI encoding (head/tail, enough for approvals, swaps and batches)
+# ─────────────────────────────────────────────────────────────
+def _split_types(s: str) -> List[str]:
+    out, depth, cur = [], 0, ""
+    for ch in s:
+        if ch == "," and depth == 0:
+            out.append(cur)
+            cur = ""
+            continue
+        depth += ch == "("
+        depth -= ch == ")"
+        cur += ch
+    if cur:
+        out.append(cur)
+    return out
+
+
+def _is_dynamic(t: str) -> bool:
+    if t in ("bytes", "string") or t.endswith("[]"):
+        return True
+    if t.startswith("("):
+        return any(_is_dynamic(x) for x in _split_types(t[1:-1]))
+    return False
+
+
+def _word(n: int) -> bytes:
+    if n < 0 or n >= 1 << 256:
+        raise ValueError(f"value out of uint256 range: {n}")
+    return n.to_bytes(32, "big")
+
+
+def _encode_one(t: str, v: Any) -> bytes:
+    if t.endswith("[]"):
+        return _word(len(v)) + _encode_seq([t[:-2]] * len(v), v)
+    if t.startswith("("):
+        return _encode_seq(_split_types(t[1:-1]), v)
+    if t in ("bytes", "string"):
+        raw = v.encode() if isinstance(v, str) and t == "string" else bytes(v)
+        return _word(len(raw)) + raw + b"\0" * (-len(raw) % 32)
+    if t == "address":
+        raw = bytes.fromhex(v[2:] if v.startswith("0x") else v)
+        if len(raw) != 20:
+            raise ValueError(f"not a 20-byte address: {v!r}")
+        return b"\0" * 12 + raw
+    if t == "bool":
+        return _word(1 if v else 0)
+    if t.startswith("uint"):
+        return _word(int(v))
+    if t == "bytes32":
+        raw = bytes(v)
+        return raw + b"\0" * (32 - len(raw))
+    raise ValueError(f"unsupported ABI type: {t}")
+
+
+def _encode_seq(types: Sequence[str], values: Sequence[Any]) -> bytes:
+    if len(types) != len(values):
+        raise ValueError(f"{len(types)} types but {len(values)} values")
+    heads, tails = [], []
+    head_size = sum(32 if _is_dynamic(t) else len(_encode_one(t, v)) for t, v in zip(types, values))
+    for t, v in zip(types, values):
+        enc = _encode_one(t, v)
+        if _is_dynamic(t):
+            heads.append(_word(head_size + sum(len(x) for x in tails)))
+            tails.append(enc)
+        else:
+            heads.append(enc)
+    return b"".join(heads) + b"".join(tails)
+
+
+def encode_call(signature: str, *args: Any) -> bytes:
+    """selector + ABI-encoded args, e.g. encode_call("approve(address,uint256)", spender, amount)."""
+    sig = signature.replace(" ", "")
+    types = _split_types(sig[sig.index("(") + 1:-1])
+    return selector(sig) + _encode_seq(types, args)
+
+
+# ─────────────────────────────────────────────────────────────
+# Bundle
+# ─────────────────────────────────────────────────────────────
+@dataclass
+class RouterABI:
+    """Signatures the bundle is built for; swap args are (tokenIn, tokenOut, amountIn, minOut, recipient)."""
+    swap: str = "swap(address,address,uint256,uint256,address)"
+    approve: str = "approve(address,uint256)"
+    batch: str = "executeBatch((address,uint256,bytes)[])"
+    reset_approval: Tuple[str, ...] = ("USDT",)   # tokens that reject approve(n) over a non-zero allowance
+
+
+@dataclass
+class GasModel:
+    """Rough per-call gas; swap gas by venue substring (split legs know their venue), else swap_default."""
+    tx_base: int = 21000
+    calldata_zero: int = 4
+    calldata_nonzero: int = 16
+    batch_call: int = 5000        # per inner call: cold account access + call overhead
+    approve: int = 30000
+    swap_default: int = 160000
+    swap_by_venue: Dict[str, int] = field(default_factory=lambda: {"curve": 150000, "uniswap": 120000})
+
+    def calldata(self, data: bytes) -> int:
+        zeros = data.count(0)
+        return zeros * self.calldata_zero + (len(data) - zeros) * self.calldata_nonzero
+
+    def swap(self, venue: Optional[str]) -> int:
+        for key, g in self.swap_by_venue.items():
+            if venue and key in venue:
+                return g
+        return self.swap_default
+
+
+@dataclass
+class BundleCall:
+    target: str
+    data: str            # 0x-hex calldata
+    kind: str            # "approve" | "swap"
+    note: str = ""
+    value: int = 0
+    gas: int = 0         # execution estimate for this call alone
+
+
+@dataclass
+class Bundle:
+    account: str
+    data: str                    # 0x-hex batch calldata, sent to `account`
+    calls: List[BundleCall]
+    gas_estimate: int            # the whole bundle as one transaction
+    gas_separate: int            # the same calls as one transaction each
+    warnings: List[str] = field(default_factory=list)
+
+    def to_tx(self) -> Dict[str, str]:
+        return {"from": self.account, "to": self.account, "data": self.data, "value": "0x0"}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "tx": self.to_tx(),
+            "calls": [asdict(c) for c in self.calls],
+            "call_count": len(self.calls),
+            "gas_estimate": self.gas_estimate,
+            "gas_separate": self.gas_separate,
+            "gas_saved": self.gas_separate - self.gas_estimate,
+            "warnings": self.warnings,
+        }
+
+
+def _units(amount: float, decimals: int) -> int:
+    # floor, so rounding never asks for more than the plan (or the balance) has
+    return int((Decimal(str(amount)) * (Decimal(10) ** decimals)).to_integral_value(rounding=ROUND_DOWN))
+
+
+def _token(coins: CoinRegistry, symbol: str):
+    coin = coins.by_symbol.get(symbol)
+    if coin is None or not coin.address:
+        raise ValueError(f"no token address for {symbol} in the coin registry")
+    return coin
+
+
+def encode_plan(
+    plan: SwapPlan,
+    account: str,
+    router: str,
+    abi: Optional[RouterABI] = None,
+    gas: Optional[GasModel] = None,
+    slippage_bps: float = DEFAULT_SLIPPAGE_BPS,
+    coins: CoinRegistry = COINS,
+) -> Bundle:
+    """
+    One batch transaction for every leg of `plan`. Legs without min_receive (no LiquidityModel)
+    get amount less slippage_bps as their minimum out. The bundle is atomic: if a sell returns
+    less base than a later buy spends, everything reverts.
+    """
+    abi = abi or RouterABI()
+    gm = gas or GasModel()
+    legs: List[SwapLeg] = plan.legs
+    warnings: List[str] = []
+
+    spend: Dict[str, int] = {}
+    for l in legs:
+        spend[l.src] = spend.get(l.src, 0) + _units(l.amount, _token(coins, l.src).decimals)
+
+    calls: List[BundleCall] = []
+    for sym, total in spend.items():
+        token = _token(coins, sym).address
+        if sym in abi.reset_approval:
+            calls.append(BundleCall(token, "0x" + encode_call(abi.approve, router, 0).hex(), "approve",
+                                    f"reset {sym} allowance", gas=gm.approve))
+        calls.append(BundleCall(token, "0x" + encode_call(abi.approve, router, total).hex(), "approve",
+                                f"{sym} {total}", gas=gm.approve))
+    for l in legs:
+        src, dst = _token(coins, l.src), _token(coins, l.dst)
+        min_out = l.min_receive if l.min_receive is not None else l.amount * (1 - slippage_bps / 1e4)
+        if l.min_receive is None:
+            warnings.append(f"{l.src}->{l.dst}: no min_receive in plan; using amount less {slippage_bps:g} bps.")
+        data = encode_call(abi.swap, src.address, dst.address, _units(l.amount, src.decimals),
+                           _units(min_out, dst.decimals), account)
+        calls.append(BundleCall(router, "0x" + data.hex(), "swap",
+                                f"{l.src}->{l.dst} {l.amount}" + (f" via {l.venue}" if l.venue else ""),
+                                gas=gm.swap(l.venue)))
+
+    batch = encode_call(abi.batch, [(c.target, c.value, bytes.fromhex(c.data[2:])) for c in calls])
+    gas_estimate = gm.tx_base + gm.calldata(batch) + sum(c.gas + gm.batch_call for c in calls)
+    gas_separate = sum(gm.tx_base + gm.calldata(bytes.fromhex(c.data[2:])) + c.gas for c in calls)
+    return Bundle(account, "0x" + batch.hex(), calls, gas_estimate, gas_separate, warnings)
+
+
+def estimate_gas_rpc(bundle: Bundle, rpc_url: str, timeout: float = 10.0) -> int:
+    """eth_estimateGas for the bundle on a node (anvil/hardhat fork or any RPC); raises on errors."""
+    if requests is None:
+        raise ImportError("estimate_gas_rpc requires requests")
+    r = requests.post(rpc_url, json={"jsonrpc": "2.0", "id": 1, "method": "eth_estimateGas",
+                                     "params": [bundle.to_tx()]}, timeout=timeout)
+    r.raise_for_status()
+    out = r.json()
+    if out.get("error"):
+        raise RuntimeError(f"eth_estimateGas failed: {out['error']}")
+    return int(out["result"], 16)
@@ -0,0 +1,239 @@
+# user_store.py
+"""
+SQLite (WAL) store for vacation-mode users.
+- One row per user; unique index on the lowercase wallet address.
+- Updates touch only the given columns, so concurrent handlers don't clobber each other.
+- Rows are returned as plain dicts with the same keys as the old vacation_users.json
+  entries (balances_json / last_plan_json decoded back to dicts).
+- migrate_from_json() imports an existing vacation_users.json once, keeping user ids.
+- Columns added later (_ADDED_COLUMNS) are ALTERed into existing databases on open.
+- on_timing(op, seconds), if set, is called after every read/write (for metrics).
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+FIELDS = (
+    "wallet_address",
+    "telegram_chat_id",
+    "nickname",
+    "is_active",
+    "daily_summary_hour_utc",
+    "alert_threshold",
+    "next_summary_at",
+    "last_alert_at",
+    "balances_json",
+    "last_plan_json",
+    "last_rationale",
+    "last_regime",
+    "drift_band_json",
+    "last_drift_json",
+)
+JSON_FIELDS = ("balances_json", "last_plan_json", "drift_band_json", "last_drift_json")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id                     INTEGER PRIMARY KEY AUTOINCREMENT,
+    wallet_address         TEXT NOT NULL,
+    wallet_lc              TEXT NOT NULL,
+    telegram_chat_id       TEXT,
+    nickname               TEXT DEFAULT '',
+    is_active              INTEGER NOT NULL DEFAULT 0,
+    daily_summary_hour_utc INTEGER NOT NULL DEFAULT 9,
+    alert_threshold        TEXT,
+    next_summary_at        TEXT,
+    last_alert_at          TEXT,
+    balances_json          TEXT,
+    last_plan_json         TEXT,
+    last_rationale         TEXT,
+    last_regime            TEXT,
+    drift_band_json        TEXT,
+    last_drift_json        TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_users_wallet_lc ON users(wallet_lc);
+CREATE INDEX IF NOT EXISTS ix_users_active ON users(is_active);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# columns added after the first release; ALTERed into older databases on open
+_ADDED_COLUMNS = {
+    "drift_band_json": "TEXT",
+    "last_drift_json": "TEXT",
+}
+
+
+def _encode(field: str, value: Any) -> Any:
+    if field in JSON_FIELDS:
+        return None if value is None else json.dumps(value)
+    if field == "is_active":
+        return 1 if value else 0
+    return value
+
+
+def _row_to_user(row: sqlite3.Row) -> Dict[str, Any]:
+    u: Dict[str, Any] = {f: row[f] for f in FIELDS}
+    u["is_active"] = bool(u["is_active"])
+    for f in JSON_FIELDS:
+        u[f] = json.loads(u[f]) if u[f] else None
+    return u
+
+
+class UserStore:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # autocommit; one connection shared by the event loop (+ a lock for worker threads)
+        self._conn = sqlite3.connect(str(self.path), isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self.on_timing: Optional[Callable[[str, float], None]] = None
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+            have = {r["name"] for r in self._conn.execute("PRAGMA table_info(users)")}
+            for col, decl in _ADDED_COLUMNS.items():
+                if col not in have:
+                    self._conn.execute(f"ALTER TABLE users ADD COLUMN {col} {decl}")
+
+    @contextmanager
+    def _op(self, name: str):
+        t0 = time.perf_counter()
+        with self._lock:
+            yield
+        if self.on_timing is not None:
+            self.on_timing(name, time.perf_counter() - t0)
+
+    # ── reads ────────────────────────────────────────────────
+    def get(self, user_id: Union[int, str]) -> Optional[Dict[str, Any]]:
+        with self._op("get"):
+            row = self._conn.execute("SELECT * FROM users WHERE id = ?", (int(user_id),)).fetchone()
+        return _row_to_user(row) if row else None
+
+    def find_by_wallet(self, wallet_address: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        with self._op("find_by_wallet"):
+            row = self._conn.execute(
+                "SELECT * FROM users WHERE wallet_lc = ?", (wallet_address.lower(),)
+            ).fetchone()
+        return (int(row["id"]), _row_to_user(row)) if row else None
+
+    def active_users(self) -> List[Tuple[int, Dict[str, Any]]]:
+        with self._op("active_users"):
+            rows = self._conn.execute("SELECT * FROM users WHERE is_active = 1 ORDER BY id").fetchall()
+        return [(int(r["id"]), _row_to_user(r)) for r in rows]
+
+    def count(self) -> int:
+        with self._op("count"):
+            return int(self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0])
+
+    # ── writes ───────────────────────────────────────────────
+    def create(self, user: Dict[str, Any], user_id: Optional[int] = None) -> int:
+        cols = ["wallet_lc"] + [f for f in FIELDS if f in user]
+        vals = [user["wallet_address"].lower()] + [_encode(f, user[f]) for f in FIELDS if f in user]
+        if user_id is not None:
+            cols.insert(0, "id")
+            vals.insert(0, int(user_id))
+        sql = f"INSERT INTO users ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})"
+        with self._op("create"):
+            cur = self._conn.execute(sql, vals)
+        return int(cur.lastrowid)
+
+    def update(self, user_id: Union[int, str], **fields: Any) -> bool:
+        """Row-level update of only the given columns. Returns False if the user doesn't exist."""
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise KeyError(f"unknown user fields: {sorted(unknown)}")
+        if not fields:
+            return self.get(user_id) is not None
+        cols = list(fields)
+        vals = [_encode(f, fields[f]) for f in cols]
+        if "wallet_address" in fields:
+            cols.append("wallet_lc")
+            vals.append(fields["wallet_address"].lower())
+        sql = f"UPDATE users SET {', '.join(f'{c} = ?' for c in cols)} WHERE id = ?"
+        with self._op("update"):
+            cur = self._conn.execute(sql, vals + [int(user_id)])
+        return cur.rowcount > 0
+
+    def update_many(self, updates: Dict[int, Dict[str, Any]]) -> int:
+        """update() for many users in one transaction (e.g. a balance refresh). Returns rows changed."""
+        if not updates:
+            return 0
+        unknown = {f for fields in updates.values() for f in fields} - set(FIELDS)
+        if unknown:
+            raise KeyError(f"unknown user fields: {sorted(unknown)}")
+        changed = 0
+        with self._op("update_many"):
+            self._conn.execute("BEGIN")
+            try:
+                for uid, fields in updates.items():
+                    cols = list(fields)
+                    sql = f"UPDATE users SET {', '.join(f'{c} = ?' for c in cols)} WHERE id = ?"
+                    cur = self._conn.execute(sql, [_encode(f, fields[f]) for f in cols] + [int(uid)])
+                    changed += cur.rowcount
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return changed
+
+    # ── migration ────────────────────────────────────────────
+    def migrate_from_json(self, json_path: Path) -> int:
+        """
+        One-shot import of a legacy {"seq": n, "users": {id: {...}}} file.
+        Runs at most once per database; returns the number of users imported.
+        """
+        json_path = Path(json_path)
+        with self._lock:
+            done = self._conn.execute("SELECT value FROM meta WHERE key = 'migrated_from_json'").fetchone()
+        if done or not json_path.exists():
+            return 0
+        try:
+            legacy = json.loads(json_path.read_text())
+        except Exception:
+            legacy = {}
+
+        imported = 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for uid, u in (legacy.get("users") or {}).items():
+                    if not u.get("wallet_address"):
+                        continue
+                    # only the fields the row has: a NULL in a NOT NULL column would make
+                    # INSERT OR IGNORE skip the whole user instead of using the column default
+                    present = [f for f in FIELDS if u.get(f) is not None]
+                    cols = ["id", "wallet_lc"] + present
+                    vals = [int(uid), u["wallet_address"].lower()] + [_encode(f, u[f]) for f in present]
+                    cur = self._conn.execute(
+                        f"INSERT OR IGNORE INTO users ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                        vals,
+                    )
+                    imported += cur.rowcount   # 0 when the id or wallet was already there
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', ?)", (str(json_path),)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return imported
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# --- one-shot migration ---
+if __name__ == "__main__":
+    import sys
+    src = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).resolve().parent / "data" / "vacation_users.json"
+    dst = Path(sys.argv[2]) if len(sys.argv) > 2 else src.with_suffix(".db")
+    store = UserStore(dst)
+    n = store.migrate_from_json(src)
+    print(f"Imported {n} users from {src} into {dst} (total {store.count()})")
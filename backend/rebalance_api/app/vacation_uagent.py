@@ -1,5 +1,5 @@
 # vacation_uagent.py
-import os, json, httpx
+import os, json, httpx, asyncio
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
 from typing import Dict, Any, Optional
@@ -9,6 +9,17 @@ from uagents.setup import fund_agent_if_low
 
 from telegram import Bot  # send-only usage
 
+try:
+    from app.user_store import UserStore
+    from app.notify_queue import TelegramQueue
+    from app.coins import COINS
+    from app.summary_scheduler import SummaryScheduler
+except Exception:
+    from user_store import UserStore  # fallback for local runs
+    from notify_queue import TelegramQueue
+    from coins import COINS
+    from summary_scheduler import SummaryScheduler
+
 # ───────────────────────────────────────────────────────────────
 # Config
 # ───────────────────────────────────────────────────────────────
@@ -26,12 +37,19 @@ SUMMARY_TICK_SEC  = int(os.getenv("SUMMARY_TICK_SEC", "60"))
 
 DATA_DIR = Path(__file__).resolve().parent / "data"
 DATA_DIR.mkdir(parents=True, exist_ok=True)
-DB_PATH = DATA_DIR / "vacation_users.json"
+DB_PATH = DATA_DIR / "vacation_users.db"             # shared with port_agent (SQLite, WAL)
+LEGACY_DB_PATH = DATA_DIR / "vacation_users.json"    # migrated once on startup
 
 bot = Bot(TELEGRAM_BOT_TOKEN) if TELEGRAM_BOT_TOKEN else None
+TG = TelegramQueue(
+    bot,
+    global_rate=float(os.getenv("TG_GLOBAL_RATE", "25")),
+    per_chat_interval=float(os.getenv("TG_PER_CHAT_INTERVAL_SEC", "1.0")),
+    max_retries=int(os.getenv("TG_MAX_RETRIES", "5")),
+)
 
 # ───────────────────────────────────────────────────────────────
-# Helpers (UTC times, JSON "DB")
+# Helpers (UTC times, user store)
 # ───────────────────────────────────────────────────────────────
 def now_utc() -> datetime:
     return datetime.now(timezone.utc)
@@ -50,27 +68,41 @@ def as_utc(x: Optional[str | datetime]) -> Optional[datetime]:
 def iso(dt: Optional[datetime]) -> Optional[str]:
     return dt.astimezone(timezone.utc).isoformat() if dt else None
 
-def load_db() -> Dict[str, Any]:
-    if DB_PATH.exists():
-        try:
-            return json.loads(DB_PATH.read_text())
-        except Exception:
-            pass
-    return {"seq": 0, "users": {}}
+USERS = UserStore(DB_PATH)
+SUMMARIES = SummaryScheduler()   # uid -> next_summary_at, rebuilt from USERS on startup
+
+def _schedule_summary(uid: int, next_summary_at: Optional[str]):
+    nxt = as_utc(next_summary_at)
+    if nxt is None:
+        SUMMARIES.unschedule(uid)
+    else:
+        SUMMARIES.schedule(uid, nxt.timestamp())
 
-def save_db(db: Dict[str, Any]):
-    tmp = DB_PATH.with_suffix(".tmp")
-    tmp.write_text(json.dumps(db, indent=2))
-    tmp.replace(DB_PATH)
+def _rebuild_summary_schedule() -> int:
+    SUMMARIES.clear()
+    for uid, u in USERS.active_users():
+        _schedule_summary(uid, u.get("next_summary_at"))
+    return len(SUMMARIES)
 
-def next_id(db: Dict[str, Any]) -> int:
-    db["seq"] += 1
-    return db["seq"]
+def next_summary_target(hour: int) -> datetime:
+    now = now_utc()
+    target = now.replace(hour=int(hour), minute=0, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return target
 
 async def tg_send(chat_id: str | int, text: str):
+    """Queue a message and wait for delivery (REST paths that report the result)."""
     if not bot:
         raise RuntimeError("TELEGRAM_BOT_TOKEN not configured")
-    await bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML", disable_web_page_preview=True)
+    await TG.send(chat_id, text)
+
+def tg_enqueue(ctx: Context, chat_id: str | int, text: str, tag: str):
+    """Queue a message without waiting (background loops); failures are logged."""
+    def _log_failure(f):
+        if not f.cancelled() and f.exception() is not None:
+            ctx.logger.warning(f"[{tag}] telegram send failed chat {chat_id}: {f.exception()}")
+    TG.enqueue(chat_id, text).add_done_callback(_log_failure)
 
 def to_alloc(bal: Dict[str, float]) -> Dict[str, float]:
     total = sum(bal.values()) or 1.0
@@ -254,7 +286,12 @@ async def on_start(ctx: Context):
     ctx.logger.info(f"Mailbox Enabled: {bool(USE_MAILBOX)}")
     ctx.logger.info(f"DB: {DB_PATH}")
     ctx.logger.info(f"Planner: {'local' if PORT_AGENT_URL.lower() == 'local' else PORT_AGENT_URL}")
-    _ = load_db()
+    migrated = USERS.migrate_from_json(LEGACY_DB_PATH)
+    if migrated:
+        ctx.logger.info(f"Migrated {migrated} users from {LEGACY_DB_PATH}")
+    ctx.logger.info(f"Summary schedule: {_rebuild_summary_schedule()} users")
+    global _SUMMARY_TASK
+    _SUMMARY_TASK = asyncio.ensure_future(_summary_loop(ctx))
 
 # ───────────────────────────────────────────────────────────────
 # Unified Port-Agent routes (same service)
@@ -276,17 +313,16 @@ async def rebalance_preview_cached(ctx: Context) -> PreviewResp:
 # ───────────────────────────────────────────────────────────────
 @agent.on_rest_post("/users/onboard", Onboard, OnboardResp)
 async def rest_onboard(ctx: Context, body: Onboard) -> OnboardResp:
-    db = load_db()
-    # dedupe by wallet
-    for uid, u in db["users"].items():
-        if u["wallet_address"].lower() == body.wallet_address.lower():
-            u["telegram_chat_id"] = body.telegram_chat_id
-            if body.nickname:
-                u["nickname"] = body.nickname
-            save_db(db)
-            return OnboardResp(ok=True, user_id=int(uid))
-    uid = next_id(db)
-    db["users"][str(uid)] = {
+    # dedupe by wallet (unique index on lowercase address)
+    found = USERS.find_by_wallet(body.wallet_address)
+    if found:
+        uid, _ = found
+        updates = {"telegram_chat_id": body.telegram_chat_id}
+        if body.nickname:
+            updates["nickname"] = body.nickname
+        USERS.update(uid, **updates)
+        return OnboardResp(ok=True, user_id=uid)
+    uid = USERS.create({
         "wallet_address": body.wallet_address,
         "telegram_chat_id": body.telegram_chat_id,
         "nickname": body.nickname or "",
@@ -299,30 +335,25 @@ async def rest_onboard(ctx: Context, body: Onboard) -> OnboardResp:
         "last_plan_json": None,
         "last_rationale": None,
         "last_regime": None,
-    }
-    save_db(db)
+    })
     return OnboardResp(ok=True, user_id=uid)
 
 @agent.on_rest_post("/users/{user_id}/balances", Balances, OkResp)
 async def rest_balances_path(ctx: Context, user_id: str, body: Balances) -> OkResp:
-    db = load_db()
-    u = db["users"].get(user_id)  # use path param correctly
-    if not u:
+    try:
+        uid = int(user_id)
+    except (TypeError, ValueError):
+        return OkResp(ok=False, error="user not found")
+    if not USERS.update(uid, balances_json=body.dict()):
         return OkResp(ok=False, error="user not found")
-    u["balances_json"] = body.dict()
-    save_db(db)
     return OkResp(ok=True)
 
 @agent.on_rest_post("/users/balances", BalancesWithId, OkResp)
 async def rest_balances_body(ctx: Context, body: BalancesWithId) -> OkResp:
-    db = load_db()
-    u = db["users"].get(str(body.user_id))
-    if not u:
-        return OkResp(ok=False, error="user not found")
     payload = body.dict()
     payload.pop("user_id", None)
-    u["balances_json"] = payload
-    save_db(db)
+    if not USERS.update(body.user_id, balances_json=payload):
+        return OkResp(ok=False, error="user not found")
     return OkResp(ok=True)
 
 # ───────────────────────────────────────────────────────────────
@@ -330,68 +361,55 @@ async def rest_balances_body(ctx: Context, body: BalancesWithId) -> OkResp:
 # ───────────────────────────────────────────────────────────────
 @agent.on_rest_post("/users/prefs", PrefsBody, OkResp)
 async def prefs_body(ctx: Context, body: PrefsBody) -> OkResp:
-    db = load_db()
-    u = db["users"].get(str(body.user_id))
+    u = USERS.get(body.user_id)
     if not u:
         return OkResp(ok=False, error="user not found")
 
+    updates: Dict[str, Any] = {}
     if body.active is not None:
-        u["is_active"] = bool(body.active)
-        if u["is_active"] and not u.get("next_summary_at"):
-            now = now_utc()
-            target = now.replace(hour=int(u["daily_summary_hour_utc"]), minute=0, second=0, microsecond=0)
-            if target <= now:
-                target += timedelta(days=1)
-            u["next_summary_at"] = iso(target)
+        updates["is_active"] = bool(body.active)
+        if updates["is_active"] and not u.get("next_summary_at"):
+            updates["next_summary_at"] = iso(next_summary_target(u["daily_summary_hour_utc"]))
 
     if body.alert_threshold:
         if body.alert_threshold not in ("RED", "YELLOW", "GREEN"):
             return OkResp(ok=False, error="alert_threshold must be RED|YELLOW|GREEN")
-        u["alert_threshold"] = body.alert_threshold
+        updates["alert_threshold"] = body.alert_threshold
 
     if body.daily_summary_hour_utc is not None:
         hour = int(body.daily_summary_hour_utc)
         if not (0 <= hour <= 23):
             return OkResp(ok=False, error="daily_summary_hour_utc must be 0..23")
-        u["daily_summary_hour_utc"] = hour
-        now = now_utc()
-        target = now.replace(hour=hour, minute=0, second=0, microsecond=0)
-        if target <= now:
-            target += timedelta(days=1)
-        u["next_summary_at"] = iso(target)
-
-    save_db(db)
+        updates["daily_summary_hour_utc"] = hour
+        updates["next_summary_at"] = iso(next_summary_target(hour))
+
+    USERS.update(body.user_id, **updates)
+    if updates.get("is_active", u["is_active"]):
+        _schedule_summary(body.user_id, updates.get("next_summary_at", u.get("next_summary_at")))
+    else:
+        SUMMARIES.unschedule(body.user_id)
     return OkResp(ok=True)
 
 @agent.on_rest_post("/users/vacation/start", StartStopBody, OkResp)
 async def vacation_start_body(ctx: Context, body: StartStopBody) -> OkResp:
-    db = load_db()
-    u = db["users"].get(str(body.user_id))
+    u = USERS.get(body.user_id)
     if not u:
         return OkResp(ok=False, error="user not found")
-    u["is_active"] = True
-    now = now_utc()
-    target = now.replace(hour=int(u["daily_summary_hour_utc"]), minute=0, second=0, microsecond=0)
-    if target <= now:
-        target += timedelta(days=1)
-    u["next_summary_at"] = iso(target)
-    save_db(db)
+    next_summary_at = iso(next_summary_target(u["daily_summary_hour_utc"]))
+    USERS.update(body.user_id, is_active=True, next_summary_at=next_summary_at)
+    _schedule_summary(body.user_id, next_summary_at)
     return OkResp(ok=True)
 
 @agent.on_rest_post("/users/vacation/stop", StartStopBody, OkResp)
 async def vacation_stop_body(ctx: Context, body: StartStopBody) -> OkResp:
-    db = load_db()
-    u = db["users"].get(str(body.user_id))
-    if not u:
+    if not USERS.update(body.user_id, is_active=False):
         return OkResp(ok=False, error="user not found")
-    u["is_active"] = False
-    save_db(db)
+    SUMMARIES.unschedule(body.user_id)
     return OkResp(ok=True)
 
 @agent.on_rest_post("/users/notify/alert", NotifyBody, OkResp)
 async def notify_alert_body(ctx: Context, body: NotifyBody) -> OkResp:
-    db = load_db()
-    u = db["users"].get(str(body.user_id))
+    u = USERS.get(body.user_id)
     if not u:
         return OkResp(ok=False, error="user not found")
     if not u.get("balances_json"):
@@ -402,31 +420,25 @@ async def notify_alert_body(ctx: Context, body: NotifyBody) -> OkResp:
         rationale = data.get("error") or data.get("rationale") or ""
         if bot:
             await tg_send(u["telegram_chat_id"], fmt_rebalance_msg(plan, rationale))
-        u["last_alert_at"] = iso(now_utc())
-        u["last_plan_json"] = plan
-        u["last_rationale"] = rationale
-        u["last_regime"] = parse_regime(data)
-        save_db(db)
+        USERS.update(
+            body.user_id,
+            last_alert_at=iso(now_utc()),
+            last_plan_json=plan,
+            last_rationale=rationale,
+            last_regime=parse_regime(data),
+        )
         return OkResp(ok=True)
     except Exception as e:
         return OkResp(ok=False, error=str(e))
 
 @agent.on_rest_post("/users/notify/summary", NotifyBody, OkResp)
 async def notify_summary_body(ctx: Context, body: NotifyBody) -> OkResp:
-    db = load_db()
-    u = db["users"].get(str(body.user_id))
+    u = USERS.get(body.user_id)
     if not u:
         return OkResp(ok=False, error="user not found")
     if not (u.get("balances_json") and u.get("last_plan_json")):
         return OkResp(ok=False, error="need balances + at least one plan")
-    bal = u["balances_json"]
-    current = to_alloc({
-        "USDC": bal.get("usdc_balance", 0.0), "USDT": bal.get("usdt_balance", 0.0),
-        "DAI": bal.get("dai_balance", 0.0), "FDUSD": bal.get("fdusd_balance", 0.0),
-        "BUSD": bal.get("busd_balance", 0.0), "TUSD": bal.get("tusd_balance", 0.0),
-        "USDP": bal.get("usdp_balance", 0.0), "PYUSD": bal.get("pyusd_balance", 0.0),
-        "USDD": bal.get("usdd_balance", 0.0), "GUSD": bal.get("gusd_balance", 0.0),
-    })
+    current = to_alloc(COINS.parse_balances(u["balances_json"]))
     suggested = u["last_plan_json"].get("target_weights", {}) if isinstance(u["last_plan_json"], dict) else {}
     if bot:
         await tg_send(u["telegram_chat_id"], fmt_summary_msg(current, suggested))
@@ -434,8 +446,7 @@ async def notify_summary_body(ctx: Context, body: NotifyBody) -> OkResp:
 
 @agent.on_rest_post("/users/status", StatusBody, StatusResp)
 async def status_body(ctx: Context, body: StatusBody) -> StatusResp:
-    db = load_db()
-    u = db["users"].get(str(body.user_id))
+    u = USERS.get(body.user_id)
     if not u:
         return StatusResp(ok=False, error="user not found")
     return StatusResp(
@@ -452,19 +463,16 @@ async def status_body(ctx: Context, body: StatusBody) -> StatusResp:
 # ───────────────────────────────────────────────────────────────
 @agent.on_interval(period=CHECK_INTERVAL_SEC)
 async def periodic_alert_check(ctx: Context):
-    db = load_db()
-    for uid, u in list(db["users"].items()):
+    for uid, u in USERS.active_users():
         try:
-            if not u.get("is_active") or not u.get("balances_json"):
+            if not u.get("balances_json"):
                 continue
             data = await call_port_agent(u["balances_json"])
             plan = data.get("plan", {}) if isinstance(data.get("plan"), dict) else {}
             rationale = data.get("error") or data.get("rationale") or ""
             regime = parse_regime(data)
 
-            u["last_plan_json"] = plan
-            u["last_rationale"] = rationale
-            u["last_regime"] = regime
+            updates: Dict[str, Any] = {"last_plan_json": plan, "last_rationale": rationale, "last_regime": regime}
 
             order = {"GREEN": 0, "YELLOW": 1, "RED": 2, "UNKNOWN": 3}
             send_if = order.get(regime, 3) >= order.get(u.get("alert_threshold", "RED"), 2)
@@ -473,44 +481,62 @@ async def periodic_alert_check(ctx: Context):
             ok_to_send = (last is None) or (now_utc() - last > timedelta(hours=1))
 
             if send_if and ok_to_send and bot:
-                await tg_send(u["telegram_chat_id"], fmt_rebalance_msg(plan, rationale))
-                u["last_alert_at"] = iso(now_utc())
+                tg_enqueue(ctx, u["telegram_chat_id"], fmt_rebalance_msg(plan, rationale), "alert")
+                updates["last_alert_at"] = iso(now_utc())
+            USERS.update(uid, **updates)
         except Exception as e:
             ctx.logger.warning(f"[alert] uid={uid} error: {e}")
-    save_db(db)
 
-@agent.on_interval(period=SUMMARY_TICK_SEC)
 async def periodic_summary_check(ctx: Context):
-    db = load_db()
+    """Send summaries for the users the scheduler says are due (no full-table scan)."""
     now = now_utc()
-    for uid, u in list(db["users"].items()):
+    for uid in SUMMARIES.pop_due(now.timestamp()):
         try:
-            if not u.get("is_active"):
+            u = USERS.get(uid)
+            if not u or not u.get("is_active"):
                 continue
             nxt = as_utc(u.get("next_summary_at"))
-            if (nxt is None) or (now < nxt):
+            if nxt is None:
+                continue
+            if now < nxt:
+                _schedule_summary(uid, u["next_summary_at"])   # schedule moved since it was queued
                 continue
             if not (u.get("balances_json") and u.get("last_plan_json")):
-                u["next_summary_at"] = iso(now + timedelta(days=1))
+                next_summary_at = iso(now + timedelta(days=1))
+                USERS.update(uid, next_summary_at=next_summary_at)
+                _schedule_summary(uid, next_summary_at)
                 continue
 
-            bal = u["balances_json"]
-            current = to_alloc({
-                "USDC": bal.get("usdc_balance", 0.0), "USDT": bal.get("usdt_balance", 0.0),
-                "DAI": bal.get("dai_balance", 0.0), "FDUSD": bal.get("fdusd_balance", 0.0),
-                "BUSD": bal.get("busd_balance", 0.0), "TUSD": bal.get("tusd_balance", 0.0),
-                "USDP": bal.get("usdp_balance", 0.0), "PYUSD": bal.get("pyusd_balance", 0.0),
-                "USDD": bal.get("usdd_balance", 0.0), "GUSD": bal.get("gusd_balance", 0.0),
-            })
+            current = to_alloc(COINS.parse_balances(u["balances_json"]))
             suggested = u["last_plan_json"].get("target_weights", {}) if isinstance(u["last_plan_json"], dict) else {}
             if bot:
-                await tg_send(u["telegram_chat_id"], fmt_summary_msg(current, suggested))
+                tg_enqueue(ctx, u["telegram_chat_id"], fmt_summary_msg(current, suggested), "summary")
 
             next_day = nxt.replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
-            u["next_summary_at"] = iso(next_day)
+            while next_day <= now:   # missed days (agent was down): one summary, then the next future slot
+                next_day += timedelta(days=1)
+            USERS.update(uid, next_summary_at=iso(next_day))
+            _schedule_summary(uid, iso(next_day))
         except Exception as e:
             ctx.logger.warning(f"[summary] uid={uid} error: {e}")
-    save_db(db)
+            SUMMARIES.schedule(uid, now.timestamp() + SUMMARY_TICK_SEC)   # retry on a later tick
+
+_SUMMARY_TASK: Optional[asyncio.Task] = None
+
+async def _summary_loop(ctx: Context):
+    # sleep until the earliest next_summary_at (capped at SUMMARY_TICK_SEC), or until a schedule changes
+    while True:
+        try:
+            await periodic_summary_check(ctx)
+        except Exception as e:
+            ctx.logger.warning(f"[summary] cycle error: {e}")
+        await SUMMARIES.wait_next(max_sleep=SUMMARY_TICK_SEC)
+
+@agent.on_event("shutdown")
+async def on_shutdown(ctx: Context):
+    if _SUMMARY_TASK is not None:
+        _SUMMARY_TASK.cancel()
+    await TG.drain(timeout=10.0)
 
 # ───────────────────────────────────────────────────────────────
 # Health
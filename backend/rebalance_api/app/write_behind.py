@@ -0,0 +1,121 @@
+# write_behind.py
+"""
+Write-behind persister for the on-disk reply caches.
+- submit(path, obj) only records the latest object for that path; the event loop never touches disk.
+- A background thread writes at most once per `interval_sec` per burst; intermediate
+  versions of the same file are coalesced (only the newest one is written).
+- Writes are atomic: serialize (str or bytes) -> temp file in the same dir -> fsync -> os.replace.
+- flush() writes everything pending synchronously (used on shutdown).
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+Serializer = Callable[[Any], Union[str, bytes]]
+
+
+def atomic_write(path: Path, data: Union[str, bytes]):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, str(path))
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class WriteBehind:
+    def __init__(self, interval_sec: float = 1.0, logger=None):
+        self.interval_sec = max(0.0, float(interval_sec))
+        self.logger = logger
+        self._pending: Dict[Path, Tuple[Any, Serializer]] = {}
+        self._lock = threading.Lock()        # guards _pending
+        self._io_lock = threading.Lock()     # one writer at a time (thread vs flush())
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_flush = 0.0
+        self.submitted = 0
+        self.writes = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def submit(self, path: Path, obj: Any, serialize: Serializer = json.dumps):
+        """Queue `obj` to be written to `path`; replaces any not-yet-written version."""
+        with self._lock:
+            if path in self._pending:
+                self.coalesced += 1
+            self._pending[Path(path)] = (obj, serialize)
+            self.submitted += 1
+        self._ensure_thread()
+        self._wake.set()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            # coalesce: let the rest of the burst land before writing
+            delay = self._last_flush + self.interval_sec - time.monotonic()
+            if delay > 0 and self._stop.wait(delay):
+                break
+            self.flush()
+
+    def flush(self) -> int:
+        """Write all pending objects now. Returns the number of files written."""
+        with self._io_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            written = 0
+            for path, (obj, serialize) in batch.items():
+                try:
+                    atomic_write(path, serialize(obj))
+                    written += 1
+                except Exception as e:
+                    self.errors += 1
+                    if self.logger:
+                        self.logger.warning(f"write-behind: failed to write {path}: {e}")
+            self.writes += written
+            self._last_flush = time.monotonic()
+            return written
+
+    def close(self, timeout: float = 5.0):
+        """Stop the background thread and flush whatever is still pending."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+        self.flush()
+
+    def depth(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "submitted": self.submitted,
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "pending": self.depth(),
+        }
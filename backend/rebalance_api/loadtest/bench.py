@@ -0,0 +1,261 @@
+# bench.py
+"""
+Load generator for the REST port agent.
+- Drives /rebalance, /rebalance/preview and /users/* at a fixed concurrency.
+- Reports per scenario: requests, throughput, p50/p95/p99 latency, error and timeout rates, and
+  fallback_rate: upstream timeouts the agent answered ok=True from its cache (counted from the
+  port_agent_cached_fallbacks_total delta on the side server's /metrics; n/a if unreachable).
+- --spawn starts loadtest/fake_balancer.py (fake balancer + port agent in one Bureau) first,
+  so the whole benchmark runs on one machine.
+
+Examples (from backend/rebalance_api):
+    python loadtest/bench.py --spawn --concurrency 50 --requests 2000
+    python loadtest/bench.py --url http://127.0.0.1:8000 --scenario preview --distinct 20
+    FAKE_LATENCY_SEC=2 FAKE_DROP_RATE=0.05 python loadtest/bench.py --spawn --json out.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+HERE = Path(__file__).resolve().parent
+COINS = ["usdc", "usdt", "dai", "fdusd", "busd", "tusd", "usdp", "pyusd", "usdd", "gusd"]
+
+
+# ─────────────────────────────────────────────────────────────
+# Request bodies
+# ─────────────────────────────────────────────────────────────
+def balances_body(i: int, distinct: int) -> Dict[str, float]:
+    # `distinct` portfolios cycled through: small values exercise single-flight + preview cache
+    rnd = random.Random(i % distinct if distinct > 0 else i)
+    body = {f"{c}_balance": round(rnd.uniform(0, 1000), 2) for c in COINS}
+    body["quote_amount"] = 1000.0
+    return body
+
+
+class UserPool:
+    """Onboarded user ids shared by the /users/* scenario."""
+
+    def __init__(self):
+        self.ids: List[int] = []
+        self.seq = 0
+
+    def next_wallet(self) -> str:
+        self.seq += 1
+        return "0x" + f"{os.getpid():08x}{self.seq:032x}"
+
+
+# ─────────────────────────────────────────────────────────────
+# Scenarios: each returns (path, json body) for request i
+# ─────────────────────────────────────────────────────────────
+def scenario_rebalance(args, pool: UserPool) -> Callable[[int], Tuple[str, Dict[str, Any]]]:
+    return lambda i: ("/rebalance", balances_body(i, args.distinct))
+
+
+def scenario_preview(args, pool: UserPool) -> Callable[[int], Tuple[str, Dict[str, Any]]]:
+    return lambda i: ("/rebalance/preview", balances_body(i, args.distinct))
+
+
+def scenario_users(args, pool: UserPool) -> Callable[[int], Tuple[str, Dict[str, Any]]]:
+    # mix: onboard 10%, balances 40%, prefs 20%, status 30% (falls back to onboard until users exist)
+    def make(i: int):
+        r = random.random()
+        if r < 0.10 or not pool.ids:
+            return "/users/onboard", {"wallet_address": pool.next_wallet(), "telegram_chat_id": str(100000 + i), "nickname": "bench"}
+        uid = random.choice(pool.ids)
+        if r < 0.50:
+            return "/users/balances", {"user_id": uid, **balances_body(i, args.distinct)}
+        if r < 0.70:
+            return "/users/prefs", {"user_id": uid, "alert_threshold": random.choice(["RED", "YELLOW", "GREEN"]),
+                                    "daily_summary_hour_utc": random.randint(0, 23)}
+        return "/users/status", {"user_id": uid}
+    return make
+
+
+SCENARIOS = {
+    "rebalance": scenario_rebalance,
+    "preview": scenario_preview,
+    "users": scenario_users,
+}
+
+
+# ─────────────────────────────────────────────────────────────
+# Runner
+# ─────────────────────────────────────────────────────────────
+def pct(sorted_vals: List[float], p: float) -> Optional[float]:
+    if not sorted_vals:
+        return None
+    return sorted_vals[min(len(sorted_vals) - 1, int(round(p / 100.0 * (len(sorted_vals) - 1))))]
+
+
+async def fallback_count(session: aiohttp.ClientSession, metrics_url: str) -> Optional[float]:
+    """Sum of port_agent_cached_fallbacks_total over endpoints, or None if /metrics can't be read."""
+    try:
+        async with session.get(metrics_url + "/metrics") as resp:
+            if resp.status != 200:
+                return None
+            text = await resp.text()
+    except Exception:
+        return None
+    return sum(float(line.rsplit(" ", 1)[1]) for line in text.splitlines()
+               if line.startswith("port_agent_cached_fallbacks_total"))
+
+
+async def run_scenario(session: aiohttp.ClientSession, args, name: str, pool: UserPool) -> Dict[str, Any]:
+    make = SCENARIOS[name](args, pool)
+    latencies: List[float] = []
+    errors = timeouts = 0
+    issued = 0
+    deadline = time.monotonic() + args.duration if args.duration else None
+
+    def claim() -> Optional[int]:
+        nonlocal issued
+        if deadline is not None and time.monotonic() >= deadline:
+            return None
+        if deadline is None and issued >= args.requests:
+            return None
+        issued += 1
+        return issued
+
+    async def worker():
+        nonlocal errors, timeouts
+        while True:
+            i = claim()
+            if i is None:
+                return
+            path, body = make(i)
+            t0 = time.perf_counter()
+            try:
+                async with session.post(args.url + path, json=body) as resp:
+                    data = await resp.json(content_type=None)
+                latencies.append(time.perf_counter() - t0)
+                if resp.status != 200 or not data.get("ok"):
+                    if "timeout" in str(data.get("error") or "").lower():
+                        timeouts += 1
+                    else:
+                        errors += 1
+                elif path == "/users/onboard" and data.get("user_id") is not None:
+                    pool.ids.append(int(data["user_id"]))
+            except asyncio.TimeoutError:
+                latencies.append(time.perf_counter() - t0)
+                timeouts += 1
+            except Exception:
+                latencies.append(time.perf_counter() - t0)
+                errors += 1
+
+    # a timed-out /rebalance or /rebalance/preview answered from cache still says ok=True
+    fallbacks_before = await fallback_count(session, args.metrics_url)
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    wall = time.perf_counter() - started
+    fallbacks_after = await fallback_count(session, args.metrics_url)
+    fallbacks = None if fallbacks_before is None or fallbacks_after is None else fallbacks_after - fallbacks_before
+
+    lat = sorted(latencies)
+    n = len(lat)
+    ms = lambda v: None if v is None else round(v * 1000.0, 2)
+    return {
+        "scenario": name,
+        "requests": n,
+        "concurrency": args.concurrency,
+        "wall_sec": round(wall, 3),
+        "throughput_rps": round(n / wall, 1) if wall > 0 else None,
+        "p50_ms": ms(pct(lat, 50)),
+        "p95_ms": ms(pct(lat, 95)),
+        "p99_ms": ms(pct(lat, 99)),
+        "max_ms": ms(lat[-1] if lat else None),
+        "error_rate": round(errors / n, 4) if n else 0.0,
+        "timeout_rate": round(timeouts / n, 4) if n else 0.0,
+        "fallback_rate": None if fallbacks is None else round(fallbacks / n, 4) if n else 0.0,
+    }
+
+
+def print_report(rows: List[Dict[str, Any]]):
+    cols = ["scenario", "requests", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "max_ms", "error_rate", "timeout_rate", "fallback_rate"]
+    cell = lambda v: "n/a" if v is None else str(v)
+    widths = {c: max(len(c), *(len(cell(r[c])) for r in rows)) for c in cols}
+    print("  ".join(c.ljust(widths[c]) for c in cols))
+    for r in rows:
+        print("  ".join(cell(r[c]).ljust(widths[c]) for c in cols))
+
+
+async def wait_healthy(url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as s:
+        while time.monotonic() < deadline:
+            try:
+                async with s.get(url + "/health") as r:
+                    if r.status == 200:
+                        return
+            except Exception:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"{url}/health not up after {timeout:.0f}s")
+
+
+async def main_async(args) -> List[Dict[str, Any]]:
+    await wait_healthy(args.url)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    pool = UserPool()
+    rows = []
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        for name in args.scenario:
+            if args.warmup:
+                saved = (args.requests, args.duration)
+                args.requests, args.duration = args.warmup, 0
+                await run_scenario(session, args, name, pool)
+                args.requests, args.duration = saved
+            rows.append(await run_scenario(session, args, name, pool))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load test the rebalance REST port agent")
+    ap.add_argument("--url", default=None, help="base URL (default http://127.0.0.1:$PORT)")
+    ap.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="repeatable; default: all")
+    ap.add_argument("--concurrency", type=int, default=20)
+    ap.add_argument("--requests", type=int, default=500, help="requests per scenario (ignored with --duration)")
+    ap.add_argument("--duration", type=float, default=0.0, help="seconds per scenario instead of a request count")
+    ap.add_argument("--distinct", type=int, default=0, help="distinct portfolios to cycle through (0 = all unique)")
+    ap.add_argument("--warmup", type=int, default=0, help="unmeasured requests per scenario first")
+    ap.add_argument("--timeout", type=float, default=90.0, help="client-side timeout per request (s)")
+    ap.add_argument("--metrics-url", default=None, help="side server with /metrics (default http://127.0.0.1:$SIDE_HTTP_PORT)")
+    ap.add_argument("--spawn", action="store_true", help="start loadtest/fake_balancer.py for the run")
+    ap.add_argument("--json", dest="json_out", default=None, help="also write results to this file")
+    args = ap.parse_args()
+    args.scenario = args.scenario or ["rebalance", "preview", "users"]
+    port = int(os.getenv("PORT", "8000"))
+    args.url = (args.url or f"http://127.0.0.1:{port}").rstrip("/")
+    side_port = int(os.getenv("SIDE_HTTP_PORT", str(port + 1)))
+    args.metrics_url = (args.metrics_url or f"http://127.0.0.1:{side_port}").rstrip("/")
+
+    proc = None
+    if args.spawn:
+        proc = subprocess.Popen([sys.executable, str(HERE / "fake_balancer.py")], cwd=str(HERE.parent))
+    try:
+        rows = asyncio.run(main_async(args))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    print_report(rows)
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
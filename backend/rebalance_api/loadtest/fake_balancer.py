@@ -0,0 +1,112 @@
+# fake_balancer.py
+"""
+Local stand-in for the balancer agent + the REST port agent, in one Bureau.
+- The fake balancer answers RebalanceCheckRequest / CompactRebalanceRequest after FAKE_LATENCY_SEC
+  (± FAKE_JITTER_SEC) with equal target weights over the registry coins, on the request's session.
+- FAKE_ERROR_RATE: fraction of replies with ok=False; FAKE_DROP_RATE: fraction never answered
+  (exercises the timeout / cached-fallback path).
+- Messages stay in-process (Bureau dispatch): no mailbox, no Almanac, no network.
+- port_agent data (users DB, caches) goes to a temp dir unless PORT_AGENT_DATA_DIR is set.
+
+Run from backend/rebalance_api:
+    python loadtest/fake_balancer.py          # REST on :PORT (default 8000)
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+from uagents import Agent, Bureau, Context
+
+ROOT = Path(__file__).resolve().parents[1]   # backend/rebalance_api
+sys.path.insert(0, str(ROOT))
+
+from app.rebalance_models import RebalanceCheckRequest, RebalanceCheckResponse, RebalancePlan, CompactRebalanceRequest  # noqa: E402
+from app.coins import COINS as REGISTRY  # noqa: E402
+
+FAKE_SEED = os.getenv("FAKE_BALANCER_SEED", "loadtest-fake-balancer")
+FAKE_LATENCY_SEC = float(os.getenv("FAKE_LATENCY_SEC", "0.5"))
+FAKE_JITTER_SEC = float(os.getenv("FAKE_JITTER_SEC", "0.1"))
+FAKE_ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", "0.0"))
+FAKE_DROP_RATE = float(os.getenv("FAKE_DROP_RATE", "0.0"))
+FAKE_REGIME = os.getenv("FAKE_REGIME", "YELLOW")
+
+COINS = list(REGISTRY.symbols)
+
+balancer = Agent(name="fake-balancer", seed=FAKE_SEED)
+counts = {"received": 0, "answered": 0, "errors": 0, "dropped": 0}
+
+
+def fake_reply(req) -> RebalanceCheckResponse:
+    given = REGISTRY.parse_balances(req.dict())
+    balances = {c: given.get(c, 0.0) for c in COINS}
+    total = sum(balances.values()) or 1.0
+    w = round(1.0 / len(COINS), 4)
+    targets = {c: w for c in COINS}
+    return RebalanceCheckResponse(
+        ok=True,
+        plan=RebalancePlan(
+            trade_deltas={c: round(w * total - balances[c], 2) for c in COINS},
+            target_weights=targets,
+            current_weights={c: round(balances[c] / total, 4) for c in COINS},
+            expected_quote=req.quote_amount,
+        ),
+        diagnostics_json=json.dumps({"rationale": f"Regime={FAKE_REGIME} (fake balancer)"}),
+    )
+
+
+@balancer.on_message(model=CompactRebalanceRequest)
+async def on_compact_request(ctx: Context, sender: str, msg: CompactRebalanceRequest):
+    await on_request(ctx, sender, msg)
+
+
+@balancer.on_message(model=RebalanceCheckRequest)
+async def on_request(ctx: Context, sender: str, msg: RebalanceCheckRequest):
+    counts["received"] += 1
+    if random.random() < FAKE_DROP_RATE:
+        counts["dropped"] += 1
+        return
+
+    async def _answer():
+        await asyncio.sleep(max(0.0, FAKE_LATENCY_SEC + random.uniform(-FAKE_JITTER_SEC, FAKE_JITTER_SEC)))
+        if random.random() < FAKE_ERROR_RATE:
+            counts["errors"] += 1
+            await ctx.send(sender, RebalanceCheckResponse(ok=False, error="fake balancer error"))
+        else:
+            counts["answered"] += 1
+            await ctx.send(sender, fake_reply(msg))
+
+    # reply concurrently, like a balancer serving many clients
+    asyncio.ensure_future(_answer())
+
+
+@balancer.on_event("shutdown")
+async def on_shutdown(ctx: Context):
+    ctx.logger.info(f"fake balancer: {counts}")
+
+
+def main():
+    # point port_agent at the fake balancer and keep it fully local before importing it
+    os.environ["BALANCER_AGENT_ADDRESS"] = balancer.address
+    os.environ["MAILBOX_ENABLED"] = "false"
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "")
+    os.environ.setdefault("PORT_AGENT_DATA_DIR", tempfile.mkdtemp(prefix="port_agent_loadtest_"))
+    port = int(os.getenv("PORT", "8000"))
+
+    from app import port_agent  # noqa: E402
+
+    print(f"[loadtest] fake balancer {balancer.address} latency={FAKE_LATENCY_SEC}s "
+          f"error_rate={FAKE_ERROR_RATE} drop_rate={FAKE_DROP_RATE}", flush=True)
+    print(f"[loadtest] port agent REST on :{port}, data in {os.environ['PORT_AGENT_DATA_DIR']}", flush=True)
+    bureau = Bureau(port=port)
+    bureau.add(balancer)
+    bureau.add(port_agent.agent)
+    bureau.run()
+
+
+if __name__ == "__main__":
+    main()
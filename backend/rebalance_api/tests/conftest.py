@@ -0,0 +1,18 @@
+# conftest.py
+"""
+Shared setup for the backend tests (run from backend/rebalance_api: python -m pytest tests).
+- `app` is importable as in run.py; port_agent gets a throwaway data dir and no mailbox,
+  so importing it never touches app/data or the network.
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+os.environ.setdefault("PORT_AGENT_DATA_DIR", tempfile.mkdtemp(prefix="port_agent_test_"))
+os.environ.setdefault("MAILBOX_ENABLED", "false")
+os.environ.setdefault("BALANCER_AGENT_ADDRESS", "agent1qtestbalancer")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "")
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+
+import pytest
+
+import app.port_agent as pa
+from app.user_store import UserStore
+
+
+class _Ctx:
+    logger = logging.getLogger("test")
+
+
+@pytest.fixture
+def cycle(monkeypatch, tmp_path):
+    store = UserStore(tmp_path / "users.db")
+    for i in range(50):
+        store.create({"wallet_address": f"0x{i:040x}", "telegram_chat_id": "1", "is_active": True,
+                      "balances_json": {"usdc_balance": 100.0 + i, "quote_amount": 1.0}})
+    clock = {"t": 0.0}
+    planned = []
+
+    def plan_user(ctx, uid, u, market):
+        planned.append(uid)
+        clock["t"] += 1.0   # each user "costs" one second of the deadline
+
+    async def snapshot(ctx, portfolios, quote_amount=1000.0):
+        return {"ok": True}
+
+    monkeypatch.setattr(pa, "USERS", store)
+    monkeypatch.setattr(pa, "_now", lambda: clock["t"])
+    monkeypatch.setattr(pa, "_alert_check_user", plan_user)
+    monkeypatch.setattr(pa, "_fetch_market_snapshot", snapshot)
+    monkeypatch.setattr(pa, "_band_check", lambda u: None)
+    monkeypatch.setattr(pa, "ALERT_CYCLE_DEADLINE_SEC", 12.0)
+    monkeypatch.setattr(pa, "ALERT_SLICE_SIZE", 4)
+    monkeypatch.setattr(pa, "_ALERT_CURSOR", None)
+    return store, planned
+
+
+def test_rotate_after_wraps_past_cursor():
+    users = [(uid, {}) for uid in (3, 1, 7, 5)]
+    assert [u for u, _ in pa._rotate_after(users, None)] == [1, 3, 5, 7]
+    assert [u for u, _ in pa._rotate_after(users, 3)] == [5, 7, 1, 3]
+    assert [u for u, _ in pa._rotate_after(users, 7)] == [1, 3, 5, 7]
+    assert [u for u, _ in pa._rotate_after(users, 4)] == [5, 7, 1, 3]   # cursor user since deactivated
+
+
+def test_deadline_cut_users_are_planned_on_later_cycles(cycle):
+    store, planned = cycle
+    all_uids = {uid for uid, _ in store.active_users()}
+
+    cycles = 0
+    while not all_uids <= set(planned):
+        asyncio.run(pa.periodic_alert_check(_Ctx()))
+        cycles += 1
+        assert cycles <= 10, "some users are never reached"
+
+    # 50 users, 12 per cycle (three slices of four before the deadline): every user within 5 cycles
+    assert cycles == 5
+    assert planned[:12] == sorted(all_uids)[:12]
+    assert planned[12] == sorted(all_uids)[12]   # second cycle resumes where the first stopped
@@ -0,0 +1,70 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from app import swapPlanner as sp
+from app.amm_sim import Pool, PoolSet, _stable_D, simulate_batch, simulate_plans
+
+COINS = ["DAI", "GUSD", "USDC", "USDT"]
+POOLS = PoolSet(
+    {("USDT", "USDC"): [Pool("stableswap", (6e7, 6e7), amp=2000, fee_bps=1, venue="curve")],
+     ("GUSD", "USDC"): [Pool("constant_product", (4e5, 4e5), fee_bps=5, venue="uni")]},
+    default=Pool("stableswap", (1e7, 1e7), amp=200, fee_bps=4, venue="default"),
+)
+
+
+def _arr(*xs):
+    return np.array(xs, dtype=float)
+
+
+def test_constant_product_keeps_k_before_the_fee():
+    pool = Pool("constant_product", (1000.0, 4000.0), fee_bps=30)
+    out, fee, spot, nx, ny = pool.swap(_arr(1000.0), _arr(4000.0), _arr(100.0))
+    assert spot[0] == pytest.approx(4.0)
+    assert fee[0] == pytest.approx(0.3)
+    assert (nx[0] - fee[0]) * ny[0] == pytest.approx(1000.0 * 4000.0)
+
+
+def test_stableswap_keeps_d_and_trades_near_par():
+    pool = Pool("stableswap", (1e6, 1e6), amp=100, fee_bps=4)
+    x, y, dx = _arr(1e6), _arr(1e6), _arr(1000.0)
+    out, fee, spot, nx, ny = pool.swap(x, y, dx)
+    assert spot[0] == pytest.approx(1.0)
+    assert out[0] == pytest.approx(1000.0 * (1 - 4e-4), rel=1e-5)
+    ann = _arr(400.0)   # the fee stays in the pool, on top of the invariant
+    assert _stable_D(nx, ny - fee, ann)[0] == pytest.approx(_stable_D(x, y, ann)[0], rel=1e-10)
+
+
+def test_simulate_batch_matches_simulate_plans():
+    bal = [[900.0, 10.0, 2000.0, 500.0], [0.0, 3000.0, 100.0, 100.0], [400.0, 400.0, 400.0, 400.0]]
+    dlt = [[-400.0, 300.0, -200.0, 300.0], [500.0, -2500.0, 1500.0, 500.0], [100.0, -100.0, 0.0, 0.0]]
+    batch = sp.build_swap_plans_batch(bal, dlt, COINS)
+    plans = [batch.plan(i) for i in range(len(batch))]
+    a = simulate_batch(batch, POOLS)
+    b = simulate_plans(plans, POOLS, [dict(zip(COINS, row)) for row in bal])
+    legs = lambda d: sorted(d["legs"], key=lambda l: (l["phase"], l["src"], l["dst"]))
+    for i in range(len(batch)):
+        da, db = a.to_dict(i), b.to_dict(i)
+        assert legs(da) == legs(db)
+        assert da["end_balances"] == pytest.approx(db["end_balances"])
+        assert da["value_lost"] == pytest.approx(db["value_lost"])
+
+
+def test_legs_through_one_pool_see_each_others_impact():
+    leg = lambda amt: sp.SwapLeg("GUSD", "USDC", amt, "SELL")
+    plan = lambda legs: sp.SwapPlan("USDC", legs, [], {}, 0, 0, 0, 0, 0, [])
+    one = simulate_plans([plan([leg(20000.0)])], POOLS).out.sum()
+    two = simulate_plans([plan([leg(10000.0), sp.replace(leg(10000.0), venue="uni")])], POOLS)
+    assert two.out[0, 1] < two.out[0, 0]
+    assert two.out.sum() == pytest.approx(one, rel=1e-4)   # (the first leg's fee deepens the pool a little)
+
+
+def test_min_receive_above_the_curve_flags_a_revert():
+    liq = sp.LiquidityModel(pairs={("GUSD", "USDC"): [sp.Venue("uni", 4e5, 5)]})
+    plan = sp.build_swap_plan({"GUSD": 50000.0, "USDC": 0.0}, {"GUSD": -50000.0, "USDC": 50000.0},
+                              liquidity=liq, slippage_bps=30)
+    assert not simulate_plans([plan], PoolSet.from_liquidity(liq)).below_min.any()
+    shallow = PoolSet({("GUSD", "USDC"): [Pool("constant_product", (1e5, 1e5), fee_bps=5, venue="uni")]})
+    sim = simulate_plans([plan], shallow)
+    assert sim.below_min.all()
+    assert "revert" in sim.to_dict(0)["warnings"][0]
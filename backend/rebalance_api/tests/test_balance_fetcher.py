@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from app.balance_fetcher import MULTICALL3, BalanceFetcher, decode_aggregate3, refresh_users
+from app.coins import Coin, CoinRegistry
+from app.tx_bundle import _encode_seq, selector
+from app.user_store import UserStore
+
+USDC = "0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48"
+DAI = "0x6b175474e89094c44da98b954eedeac495271d0f"
+COINS = CoinRegistry([Coin("USDC", decimals=6, address=USDC), Coin("DAI", decimals=18, address=DAI), Coin("GUSD")])
+WALLETS = [f"0x{i:040x}" for i in range(1, 8)]
+
+
+def _word(data, off):
+    return int.from_bytes(data[off:off + 32], "big")
+
+
+class ChainStub:
+    """In-process JSON-RPC: eth_blockNumber and Multicall3 aggregate3 over balanceOf."""
+
+    def __init__(self, balances, block=123, fail_tokens=(), fail_calls=()):
+        self.balances = balances            # {(token, wallet): raw units}
+        self.block = block
+        self.fail_tokens = set(fail_tokens)
+        self.fail_calls = set(fail_calls)   # eth_call numbers (1-based, over all requests) that error
+        self.requests = []
+        self.eth_calls = 0
+
+    def _aggregate3(self, data):
+        assert data[:4] == selector("aggregate3((address,bool,bytes)[])")
+        args = data[4:]
+        arr = _word(args, 0)
+        results = []
+        for i in range(_word(args, arr)):
+            t = arr + 32 + _word(args, arr + 32 + 32 * i)
+            target = "0x" + args[t + 12:t + 32].hex()
+            b = t + _word(args, t + 64)
+            call = args[b + 32:b + 32 + _word(args, b)]
+            assert call[:4] == selector("balanceOf(address)")
+            wallet = "0x" + call[16:36].hex()
+            if target in self.fail_tokens:
+                results.append((False, b""))
+            else:
+                results.append((True, self.balances.get((target, wallet), 0).to_bytes(32, "big")))
+        return _encode_seq(["(bool,bytes)[]"], [results])
+
+    async def __call__(self, batch):
+        self.requests.append(batch)
+        out = []
+        for req in batch:
+            if req["method"] == "eth_blockNumber":
+                out.append({"id": req["id"], "result": hex(self.block)})
+                continue
+            self.eth_calls += 1
+            call, block = req["params"]
+            assert call["to"] == MULTICALL3 and block == hex(self.block)
+            if self.eth_calls in self.fail_calls:
+                out.append({"id": req["id"], "error": {"code": -32000, "message": "out of gas"}})
+            else:
+                out.append({"id": req["id"], "result": "0x" + self._aggregate3(bytes.fromhex(call["data"][2:])).hex()})
+        return out
+
+
+def test_decode_aggregate3_known_vector():
+    w = lambda n: n.to_bytes(32, "big")
+    # [(true, 0x2a as a word), (false, empty)] as aggregate3 returns it
+    data = (w(0x20) + w(2) + w(0x40) + w(0xc0)
+            + w(1) + w(0x40) + w(32) + w(0x2a)
+            + w(0) + w(0x40) + w(0))
+    assert decode_aggregate3(data) == [(True, w(0x2a)), (False, b"")]
+    assert decode_aggregate3(_encode_seq(["(bool,bytes)[]"], [[(True, b"\x01\x02"), (False, b"")]])) == [
+        (True, b"\x01\x02"), (False, b"")]
+
+
+def test_fetch_chunks_and_batches_requests():
+    bal = {(USDC, w): (i + 1) * 1_500_000 for i, w in enumerate(WALLETS)}
+    bal.update({(DAI, w): 2 * 10**18 for w in WALLETS})
+    rpc = ChainStub(bal)
+    fetcher = BalanceFetcher(rpc, COINS, chunk_wallets=2, chunks_per_request=3)
+    block, out = asyncio.run(fetcher.fetch(WALLETS + ["not-a-wallet", WALLETS[0].upper().replace("0X", "0x")]))
+    assert block == 123
+    assert out == {w: {"USDC": (i + 1) * 1.5, "DAI": 2.0} for i, w in enumerate(WALLETS)}
+    # 7 wallets / 2 per chunk = 4 eth_calls, 3 per HTTP request = 2 requests (+1 for the block number)
+    assert fetcher.stats() == {"http_requests": 3, "eth_calls": 4, "failed_calls": 0}
+    assert [len(b) for b in rpc.requests] == [1, 3, 1]
+
+
+def test_fetch_skips_failed_tokens_and_chunks():
+    fetcher = BalanceFetcher(ChainStub({}, fail_tokens={DAI}, fail_calls={2}), COINS, chunk_wallets=3)
+    _, out = asyncio.run(fetcher.fetch(WALLETS))
+    assert set(out) == set(WALLETS[:3] + WALLETS[6:])   # the second chunk's eth_call failed
+    assert all(b == {"USDC": 0.0} for b in out.values())
+    assert fetcher.failed_calls == 3 * 2 + 4   # whole failed chunk + one DAI call per other wallet
+
+
+def test_refresh_users_stores_only_changes(tmp_path):
+    store = UserStore(tmp_path / "users.db")
+    same = store.create({"wallet_address": WALLETS[0], "balances_json": {"usdc_balance": 5.0, "dai_balance": 1.0}})
+    moved = store.create({"wallet_address": WALLETS[1],
+                          "balances_json": {"usdc_balance": 1.0, "gusd_balance": 7.0, "quote_amount": 250.0}})
+    offchain = store.create({"wallet_address": "0xnot", "balances_json": {"usdc_balance": 3.0}})
+    bal = {(USDC, WALLETS[0]): 5_000_000, (DAI, WALLETS[0]): 10**18,
+           (USDC, WALLETS[1]): 9_250_000, (DAI, WALLETS[1]): 0}
+    users = [(uid, store.get(uid)) for uid in (same, moved, offchain)]
+
+    report = asyncio.run(refresh_users(store, BalanceFetcher(ChainStub(bal), COINS), users, COINS))
+    assert report == {"block": 123, "wallets": 3, "fetched": 2, "updated": 1,
+                      "http_requests": 2, "eth_calls": 1, "failed_calls": 0}
+    # chain answers replace USDC/DAI; GUSD (no address) and quote_amount are kept
+    assert store.get(moved)["balances_json"] == {"USDC": 9.25, "GUSD": 7.0, "DAI": 0.0, "quote_amount": 250.0}
+    assert store.get(same)["balances_json"] == {"usdc_balance": 5.0, "dai_balance": 1.0}
+    assert store.get(offchain)["balances_json"] == {"usdc_balance": 3.0}
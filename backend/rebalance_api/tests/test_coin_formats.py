@@ -0,0 +1,34 @@
+import pytest
+
+import app.port_agent as pa
+from app.coins import Coin, CoinRegistry
+from app.rebalance_models import CompactRebalanceRequest
+
+RAW = {"ok": True, "plan": {"trade_deltas": {}, "target_weights": {"USDC": 0.5, "DAI": 0.5}}, "diagnostics_json": "Regime=GREEN"}
+
+
+@pytest.fixture
+def registry_with_usde(monkeypatch):
+    monkeypatch.setattr(pa, "COINS", CoinRegistry([Coin(s) for s in pa.COINS.symbols] + [Coin("USDE")]))
+
+
+def test_legacy_upstream_rejects_coins_it_cannot_carry(monkeypatch, registry_with_usde):
+    monkeypatch.setattr(pa, "UPSTREAM_COMPACT", False)
+    err = pa._compact_error(CompactRebalanceRequest(balances={"USDC": 10.0, "USDE": 5.0}))
+    assert err and "USDE" in err and "BALANCER_COMPACT_REQUESTS" in err
+    # a zero balance is not dropped information
+    assert pa._compact_error(CompactRebalanceRequest(balances={"USDC": 10.0, "USDE": 0.0})) is None
+
+
+def test_compact_upstream_accepts_any_registry_coin(monkeypatch, registry_with_usde):
+    monkeypatch.setattr(pa, "UPSTREAM_COMPACT", True)
+    assert pa._compact_error(CompactRebalanceRequest(balances={"USDC": 10.0, "USDE": 5.0})) is None
+    assert "XYZ" in pa._compact_error(CompactRebalanceRequest(balances={"XYZ": 1.0}))
+
+
+def test_preview_of_stored_balances_warns_about_unsent_coins(monkeypatch, registry_with_usde):
+    monkeypatch.setattr(pa, "UPSTREAM_COMPACT", False)
+    out = pa._build_preview({"USDC": 100.0, "DAI": 20.0, "USDE": 30.0}, RAW, local_deltas=True)
+    assert any("USDE" in w for w in out["swap_plan"]["warnings"])
+    out = pa._build_preview({"USDC": 100.0, "DAI": 20.0}, RAW, local_deltas=True)
+    assert not any("Not priced" in w for w in out["swap_plan"].get("warnings", []))
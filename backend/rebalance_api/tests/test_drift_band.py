@@ -0,0 +1,50 @@
+import pytest
+
+from app.drift_band import DriftBand
+
+TARGET = {"USDC": 0.5, "USDT": 0.3, "DAI": 0.2}
+
+
+def _shift(coin_from, coin_to, w):
+    cur = dict(TARGET)
+    cur[coin_from] = round(cur[coin_from] - w, 10)
+    cur[coin_to] = round(cur[coin_to] + w, 10)
+    return cur
+
+
+@pytest.mark.parametrize("w, inside", [(0.0199, True), (0.02, True), (0.0201, False)])
+def test_abs_edge(w, inside):
+    check = DriftBand(abs_bps=200, rel=None, turnover_bps=None).check(_shift("USDC", "USDT", w), TARGET)
+    assert check.inside is inside
+    assert check.max_abs_bps == pytest.approx(w * 1e4, abs=0.1)
+
+
+@pytest.mark.parametrize("w, inside", [(0.0499, True), (0.05, True), (0.0501, False)])
+def test_rel_edge(w, inside):
+    # DAI's target is 0.2; 0.05 off is exactly 25% of it
+    check = DriftBand(abs_bps=None, rel=0.25, turnover_bps=None).check(_shift("USDC", "DAI", w), TARGET)
+    assert check.inside is inside
+    assert [b.startswith("DAI") for b in check.breaches] == ([] if inside else [True])
+
+
+@pytest.mark.parametrize("w, inside", [(0.0299, True), (0.03, True), (0.0301, False)])
+def test_turnover_edge(w, inside):
+    check = DriftBand(abs_bps=None, rel=None, turnover_bps=300).check(_shift("USDC", "USDT", w), TARGET)
+    assert check.inside is inside
+    assert check.turnover_bps == pytest.approx(w * 1e4, abs=0.1)
+
+
+def test_untargeted_coin_uses_only_abs():
+    cur = {**TARGET, "USDC": 0.49, "GUSD": 0.01}
+    assert DriftBand(abs_bps=None, rel=0.25, turnover_bps=None).check(cur, TARGET).inside
+    assert not DriftBand(abs_bps=50, rel=None, turnover_bps=None).check(cur, TARGET).inside
+
+
+def test_all_limits_off_is_never_inside():
+    check = DriftBand(abs_bps=None, rel=None, turnover_bps=None).check(TARGET, TARGET)
+    assert not check.inside and check.breaches == []
+
+
+def test_from_prefs_overrides_and_disables():
+    band = DriftBand.from_prefs({"abs_bps": "150", "rel": None}, DriftBand())
+    assert band == DriftBand(abs_bps=150.0, rel=None, turnover_bps=300.0)
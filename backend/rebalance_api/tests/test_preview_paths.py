@@ -0,0 +1,55 @@
+import asyncio
+import json
+import logging
+
+import pytest
+
+import app.port_agent as pa
+
+RAW = {
+    "ok": True,
+    "error": None,
+    "plan": {
+        "trade_deltas": {"USDC": -300.0, "USDT": 100.0, "DAI": 200.0},
+        "target_weights": {"USDC": 0.4, "USDT": 0.3, "DAI": 0.3},
+        "current_weights": {"USDC": 0.7, "USDT": 0.2, "DAI": 0.1},
+    },
+    "diagnostics_json": json.dumps({"rationale": "Regime=YELLOW"}),
+}
+BODY = {"usdc_balance": 700.0, "usdt_balance": 200.0, "dai_balance": 100.0}
+
+
+class _Ctx:
+    logger = logging.getLogger("test")
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    async def fetch(ctx, body):
+        return RAW
+
+    monkeypatch.setattr(pa, "_fetch_reply", fetch)
+    monkeypatch.setattr(pa, "_AGENT_CTX", _Ctx())
+    monkeypatch.setattr(pa, "_SNAPSHOT_SIG", None)
+
+
+async def _events(body):
+    return [(event, data) async for event, data in pa._stream_preview(body)]
+
+
+def test_stream_done_matches_rest_preview(upstream):
+    events = asyncio.run(_events(BODY))
+    assert [e for e, _ in events] == ["allocation", "plan", "swap_plan", "rationale", "done"]
+    done = events[-1][1]
+
+    balances = pa._balances_from_request(pa.RebalanceCheckRequest(**BODY))
+    assert done == pa._build_preview(balances, RAW)
+    assert pa.PreviewResponse(**done) == asyncio.run(pa.rebalance_preview(_Ctx(), pa.RebalanceCheckRequest(**BODY)))
+
+
+def test_batch_matches_single_preview_shape():
+    balances = [{"USDC": 700.0, "USDT": 200.0, "DAI": 100.0}, {"USDC": 10.0, "DAI": 990.0}]
+    for bal, out in zip(balances, pa._build_previews_batch(balances, RAW)):
+        single = pa._build_preview(bal, RAW, local_deltas=True)
+        assert set(out) == set(single)
+        assert {k: v for k, v in out.items() if k != "swap_plan"} == {k: v for k, v in single.items() if k != "swap_plan"}
@@ -0,0 +1,201 @@
+import random
+
+import pytest
+
+from app import swapPlanner as sp
+
+np = pytest.importorskip("numpy")
+
+COINS = ["DAI", "USDC", "USDT", "PYUSD", "GUSD"]
+
+
+def _portfolios(n, seed=7):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(n):
+        bal = [round(rng.uniform(0, 5000), 2) for _ in COINS]
+        dlt = [round(rng.uniform(-1500, 1500), 2) if rng.random() < 0.8 else 0.0 for _ in COINS]
+        rows.append((bal, dlt))
+    return rows
+
+
+def _scalar(bal, dlt, **kw):
+    return sp.build_swap_plan(dict(zip(COINS, bal)), dict(zip(COINS, dlt)), **kw).to_dict()
+
+
+@pytest.mark.parametrize("dust", [None, sp.DustPolicy(action="merge"), sp.DustPolicy(action="drop")])
+def test_batch_matches_scalar(dust):
+    rows = _portfolios(200)
+    batch = sp.build_swap_plans_batch([b for b, _ in rows], [d for _, d in rows], COINS, dust=dust)
+    for i, (bal, dlt) in enumerate(rows):
+        assert batch.to_dict(i) == _scalar(bal, dlt, dust=dust), f"portfolio {i}"
+
+
+@pytest.mark.parametrize("off", [0.004, 0.005, 0.006, 1e-12, -1e-12])
+def test_tolerance_warning_agrees_at_the_edge(off):
+    # the deltas sum to just around the $1 tolerance; both paths must decide on the same rounded cent
+    bal = [1000.0, 1000.0, 1000.0, 0.0, 0.0]
+    dlt = [400.0, -300.0 + off, -99.0, 0.0, 0.0]
+    batch = sp.build_swap_plans_batch([bal], [dlt], COINS)
+    scalar = _scalar(bal, dlt)
+    assert batch.to_dict(0)["warnings"] == scalar["warnings"]
+    warned = any(w.startswith("Sum of deltas") for w in scalar["warnings"])
+    assert warned == (sp.round2(1.0 + off) > 1.0)
+
+
+def _net_flow(plan):
+    # cents each coin gains (+) or gives up (-) over all of a plan's legs
+    flow = {}
+    for l in plan.legs:
+        flow[l.src] = flow.get(l.src, 0) - int(round(l.amount * 100))
+        flow[l.dst] = flow.get(l.dst, 0) + int(round(l.amount * 100))
+    return {c: f for c, f in flow.items() if f}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_net_swap_plan_keeps_each_coins_net_amount(seed):
+    cm = sp.CostModel(fee_bps=5, gas_per_leg=0.1, pair_bps={("DAI", "USDT"): 1, ("GUSD", "PYUSD"): 2})
+    for bal, dlt in _portfolios(40, seed):
+        base = sp.build_swap_plan(dict(zip(COINS, bal)), dict(zip(COINS, dlt)), cost_model=cm)
+        netted = sp.net_swap_plan(base, cm)
+        assert _net_flow(netted) == _net_flow(base)
+        assert netted.est_cost <= base.est_cost
+
+
+def test_net_swap_plan_pairs_cheap_direct_swaps():
+    cm = sp.CostModel(fee_bps=5, pair_bps={("DAI", "USDT"): 1})
+    plan = sp.build_swap_plan({"DAI": 1000.0, "USDC": 0.0, "USDT": 0.0}, {"DAI": -500.0, "USDT": 500.0},
+                              mode="net", cost_model=cm)
+    assert plan.mode == "net"
+    assert [(l.src, l.dst, l.amount) for l in plan.legs] == [("DAI", "USDT", 500.0)]
+    assert _net_flow(plan) == {"DAI": -50000, "USDT": 50000}
+
+
+LIQ = sp.LiquidityModel(pairs={("GUSD", "USDC"): [sp.Venue("curve", 4e5, 4), sp.Venue("uni", 1.5e5, 5),
+                                                   sp.Venue("tiny", 2e3, 30)]}, min_split=50.0)
+
+
+@pytest.mark.parametrize("amount", [0.01, 12.34, 999.99, 25_000.0, 180_000.05, 1_000_000.0])
+def test_split_leg_pieces_sum_to_the_leg(amount):
+    leg = sp.SwapLeg(src="GUSD", dst="USDC", amount=amount, intent="SELL")
+    pieces = sp.split_leg(leg, LIQ, slippage_bps=30)
+    assert sum(int(round(p.amount * 100)) for p in pieces) == int(round(amount * 100))
+    assert len({p.venue for p in pieces}) == len(pieces)
+    for p in pieces:
+        assert p.amount > 0 and p.min_receive <= p.expected_receive <= p.amount
+
+
+def test_split_leg_uses_more_venues_for_bigger_legs():
+    split = lambda amt: sp.split_leg(sp.SwapLeg("GUSD", "USDC", amt, "SELL"), LIQ)
+    assert len(split(100.0)) == 1
+    assert len(split(200_000.0)) > 1
+
+
+BAL3 = {"USDC": 2000.0, "USDT": 2000.0, "DAI": 2000.0, "GUSD": 500.0}
+DLT3 = {"USDC": -400.0, "USDT": 0.0, "DAI": -100.0, "GUSD": 500.0}
+
+
+def test_multi_base_avoids_a_depegging_base():
+    cm = sp.CostModel(coin_bps={"USDC": 40})
+    plan = sp.build_swap_plan(BAL3, DLT3, bases=["USDC", "USDT", "DAI"], cost_model=cm)
+    assert plan.base != "USDC"
+    assert plan.base_choice["chosen"] == plan.base
+    assert set(plan.base_choice["candidates"]) == {"USDC", "USDT", "DAI"}
+    assert round(plan.est_cost, 6) == min(c["est_cost"] for c in plan.base_choice["candidates"].values())
+
+
+def test_multi_base_skips_a_base_with_an_unavailable_pair():
+    cm = sp.CostModel(pair_bps={("GUSD", "USDT"): float("inf"), ("USDC", "GUSD"): 50})
+    plan = sp.build_swap_plan(BAL3, DLT3, bases=["USDT", "USDC"], cost_model=cm)
+    assert plan.base == "USDC"
+    assert plan.base_choice["candidates"]["USDT"]["note"] == "pair unavailable"
+
+
+def test_multi_base_tie_goes_to_the_preferred_base():
+    bal = {"USDC": 1000.0, "USDT": 1000.0, "DAI": 1000.0}
+    dlt = {"DAI": -100.0, "PYUSD": 100.0}
+    plan = sp.build_swap_plan(bal, dlt, base="USDT", bases=["USDC", "USDT"])
+    assert plan.base == "USDT"
+    assert "preferred base" in plan.base_choice["reason"]
+
+
+@pytest.mark.parametrize("action", ["merge", "drop"])
+def test_dust_never_becomes_a_leg_and_keeps_the_delta_sum(action):
+    policy = sp.DustPolicy(min_trade=10.0, coin_min={"GUSD": 50.0}, max_gas_bps=None, action=action)
+    for bal, dlt in _portfolios(100, seed=3):
+        dlt = [d if i % 2 else round(d / 100, 2) for i, d in enumerate(dlt)]   # some sub-threshold deltas
+        deltas = dict(zip(COINS, dlt))
+        out, report, _ = sp.filter_dust(dict(zip(COINS, bal)), deltas, "USDC", policy)
+        assert sum(out.values()) == pytest.approx(sum(deltas.values()))
+        plan = sp.build_swap_plan(dict(zip(COINS, bal)), deltas, dust=policy)
+        for leg in plan.legs:
+            coin = leg.dst if leg.src == "USDC" else leg.src
+            assert leg.amount >= policy.threshold(coin) - 0.005 or leg.amount < abs(deltas[coin]) - 0.005
+
+
+def test_dust_merges_into_the_closest_leg_on_the_same_side():
+    policy = sp.DustPolicy(min_trade=10.0, max_gas_bps=None)
+    bal = {"USDC": 0.0, "DAI": 1000.0, "USDT": 1000.0, "GUSD": 5.0}
+    out, report, warning = sp.filter_dust(bal, {"DAI": -300.0, "USDT": -50.0, "GUSD": -4.0, "USDC": 354.0}, "USDC", policy)
+    assert out == {"DAI": -300.0, "USDT": -54.0, "GUSD": 0.0, "USDC": 354.0}
+    assert report["merged"] == {"GUSD": {"into": "USDT", "delta": -4.0}} and warning is None
+
+
+def test_dust_without_a_leg_to_join_goes_to_base():
+    policy = sp.DustPolicy(min_trade=10.0, max_gas_bps=None)
+    out, report, warning = sp.filter_dust({"USDC": 100.0, "DAI": 3.0}, {"DAI": -3.0, "USDC": 3.0}, "USDC", policy)
+    assert out == {"DAI": 0.0, "USDC": 0.0}
+    assert report["to_base"] == {"DAI": -3.0} and report["residual"] == -3.0
+    assert "DAI -3.00" in warning
+
+
+def test_gas_raises_the_dust_threshold():
+    policy = sp.DustPolicy(min_trade=10.0, max_gas_bps=100)
+    assert policy.threshold("DAI", sp.CostModel(gas_per_leg=0.5)) == pytest.approx(50.0)
+    assert policy.threshold("DAI", sp.CostModel(gas_per_leg=0.05)) == pytest.approx(10.0)
+
+
+def test_diff_plans_reuses_unchanged_legs():
+    bal = {"USDC": 500.0, "DAI": 1000.0, "USDT": 1000.0, "GUSD": 0.0}
+    prev = sp.build_swap_plan(bal, {"DAI": -300.0, "USDT": -200.0, "GUSD": 500.0})
+    new = sp.build_swap_plan(bal, {"DAI": -300.0, "USDT": -250.0, "GUSD": 400.0, "PYUSD": 150.0})
+    prev_dai = prev.sells_to_base[0]
+    patch = sp.diff_plans(prev, new)
+    assert new.sells_to_base[0] is prev_dai
+    assert patch.unchanged == 1
+    assert [(ph, o.amount, n.amount) for ph, o, n in patch.resized] == [
+        ("sells_to_base", 200.0, 250.0), ("buys_from_base", 500.0, 400.0)]
+    assert [(ph, l.dst) for ph, l in patch.added] == [("buys_from_base", "PYUSD")]
+    assert not patch.removed and not patch.empty and not patch.rebuilt
+    assert sp.diff_plans(prev, sp.build_swap_plan(bal, {"DAI": -300.0, "USDT": -200.0, "GUSD": 500.0})).empty
+
+
+def test_diff_plans_rebuilds_on_a_new_base():
+    bal = {"USDC": 500.0, "DAI": 1000.0, "USDT": 1000.0}
+    dlt = {"DAI": -300.0, "USDT": 300.0}
+    patch = sp.diff_plans(sp.build_swap_plan(bal, dlt), sp.build_swap_plan(bal, dlt, base="DAI"))
+    assert patch.rebuilt and patch.unchanged == 0 and len(patch.added) == len(patch.plan.legs)
+
+
+def test_replan_resplits_only_legs_that_moved(monkeypatch):
+    bal = {"USDC": 0.0, "GUSD": 300_000.0, "DAI": 0.0, "USDT": 0.0}
+    kw = dict(liquidity=LIQ, slippage_bps=30)
+    prev = sp.build_swap_plan(bal, {"GUSD": -200_000.0, "DAI": 120_000.0, "USDT": 80_000.0}, **kw)
+    assert len(prev.sells_to_base) > 1   # the big GUSD sell is split across venues
+
+    calls = []
+    real = sp.split_leg
+    monkeypatch.setattr(sp, "split_leg", lambda leg, *a, **k: calls.append((leg.src, leg.dst)) or real(leg, *a, **k))
+    patch = sp.replan(prev, bal, {"GUSD": -200_000.0, "DAI": 100_000.0, "USDT": 100_000.0}, **kw)
+    assert ("GUSD", "USDC") not in calls
+    assert sorted(calls) == [("USDC", "DAI"), ("USDC", "USDT")]
+    assert all(a is b for a, b in zip(patch.plan.sells_to_base, prev.sells_to_base))
+    assert patch.unchanged == len(prev.sells_to_base)
+    assert {l.dst for _, _, l in patch.resized} == {"DAI", "USDT"}
+
+
+def test_replan_round_trips_a_stored_plan():
+    bal = {"USDC": 500.0, "DAI": 1000.0, "USDT": 1000.0}
+    dlt = {"DAI": -300.0, "USDT": 300.0}
+    stored = sp.SwapPlan.from_dict(sp.build_swap_plan(bal, dlt, liquidity=LIQ).to_dict())
+    assert sp.replan(stored, bal, dlt, liquidity=LIQ).empty
@@ -0,0 +1,74 @@
+import pytest
+
+from app import tx_bundle as tb
+from app.swapPlanner import SwapLeg, SwapPlan
+
+ACCOUNT = "0x1111111111111111111111111111111111111111"
+ROUTER = "0x2222222222222222222222222222222222222222"
+USDC = "a0b86991c6218b36c1d19d4a2e9eb0ce3606eb48"
+DAI = "6b175474e89094c44da98b954eedeac495271d0f"
+USDT = "dac17f958d2ee523a2206206994597c13d831ec7"
+
+
+def w(x):
+    # one 32-byte word: an int, or a hex address / bytes left-padded to it
+    return f"{x:064x}" if isinstance(x, int) else x.lower().replace("0x", "").rjust(64, "0")
+
+
+def _plan(*legs):
+    return SwapPlan("USDC", [l for l in legs if l.intent == "SELL"], [l for l in legs if l.intent == "BUY"],
+                    {}, 0, 0, 0, 0, 0, [])
+
+
+@pytest.mark.parametrize("signature", sorted(tb._SELECTORS))
+def test_builtin_selectors_are_keccak(signature):
+    if tb.keccak is None:
+        pytest.skip("pycryptodome not installed")
+    k = tb.keccak.new(digest_bits=256)
+    k.update(signature.encode())
+    assert tb._SELECTORS[signature] == k.hexdigest()[:8]
+
+
+def test_abi_spec_example_dynamic_args():
+    # Solidity ABI spec: sam("dave", true, [1, 2, 3])
+    enc = tb._encode_seq(["bytes", "bool", "uint256[]"], [b"dave", True, [1, 2, 3]]).hex()
+    assert enc == "".join([w(0x60), w(1), w(0xa0), w(4), "64617665".ljust(64, "0"), w(3), w(1), w(2), w(3)])
+
+
+def test_approve_calldata():
+    assert tb.encode_call("approve(address,uint256)", ROUTER, 10**6).hex() == "095ea7b3" + w(ROUTER) + w(10**6)
+
+
+def test_encode_plan_known_vector():
+    leg = SwapLeg("USDC", "DAI", 100.25, "BUY", min_receive=99.95)
+    bundle = tb.encode_plan(_plan(leg), ACCOUNT, ROUTER)
+
+    approve = "095ea7b3" + w(ROUTER) + w(100_250_000)
+    swap = "d5bcb9b5" + w(USDC) + w(DAI) + w(100_250_000) + w(99_950_000_000_000_000_000) + w(ACCOUNT)
+    assert [(c.target.lower(), c.kind, c.data) for c in bundle.calls] == [
+        ("0x" + USDC, "approve", "0x" + approve), (ROUTER, "swap", "0x" + swap)]
+
+    # executeBatch((address,uint256,bytes)[]) laid out by hand
+    def call(target, data):
+        n = len(data) // 2
+        return w(target) + w(0) + w(0x60) + w(n) + data.ljust(-(-len(data) // 64) * 64, "0")
+    first, second = call(USDC, approve), call(ROUTER, swap)
+    batch = "34fcd5be" + w(0x20) + w(2) + w(0x40) + w(0x40 + len(first) // 2) + first + second
+    assert bundle.data == "0x" + batch
+    assert bundle.to_tx() == {"from": ACCOUNT, "to": ACCOUNT, "data": "0x" + batch, "value": "0x0"}
+    assert bundle.gas_estimate < bundle.gas_separate and not bundle.warnings
+
+
+def test_usdt_allowance_is_reset_first_and_min_out_defaults_to_slippage():
+    bundle = tb.encode_plan(_plan(SwapLeg("USDT", "USDC", 1000.0, "SELL")), ACCOUNT, ROUTER, slippage_bps=30)
+    assert [c.data[:10] for c in bundle.calls] == ["0x095ea7b3", "0x095ea7b3", "0xd5bcb9b5"]
+    assert bundle.calls[0].data == "0x095ea7b3" + w(ROUTER) + w(0)
+    assert bundle.calls[2].data.endswith(w(997_000_000) + w(ACCOUNT))
+    assert "no min_receive" in bundle.warnings[0]
+
+
+def test_units_floor_never_overspends():
+    assert tb._units(0.1 + 0.2, 6) == 300_000
+    assert tb._units(1.999999999, 6) == 1_999_999
+    with pytest.raises(ValueError):
+        tb._word(-1)
@@ -0,0 +1,20 @@
+import json
+
+from app.user_store import UserStore
+
+
+def test_migrate_from_json_counts_only_inserted_rows(tmp_path):
+    store = UserStore(tmp_path / "users.db")
+    store.create({"wallet_address": "0xAAA", "telegram_chat_id": "1"}, user_id=1)
+    legacy = tmp_path / "users.json"
+    legacy.write_text(json.dumps({"seq": 3, "users": {
+        "1": {"wallet_address": "0xaaa", "telegram_chat_id": "1"},    # already there: ignored
+        "2": {"wallet_address": "0xBBB", "telegram_chat_id": "2"},
+        "3": {"wallet_address": "0xCCC", "telegram_chat_id": "3"},
+        "4": {"telegram_chat_id": "4"},                               # no wallet: skipped
+    }}))
+
+    assert store.migrate_from_json(legacy) == 2
+    assert store.count() == 3
+    assert store.get(2)["daily_summary_hour_utc"] == 9   # missing NOT NULL field falls back to the default
+    assert store.migrate_from_json(legacy) == 0   # once per database